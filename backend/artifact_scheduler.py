@@ -0,0 +1,273 @@
+import os
+import json
+import heapq
+import itertools
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from filelock import FileLock, Timeout
+
+logger = logging.getLogger(__name__)
+
+# Thứ tự ưu tiên: số nhỏ chạy trước
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_MINDMAP = 2
+# Dọn dẹp/compaction chạy sau cùng
+PRIORITY_MAINTENANCE = 3
+
+# Số worker cho job nền (summary/mindmap) và số worker luôn để dành cho request tương tác
+ARTIFACT_BACKGROUND_WORKERS = int(os.getenv("ARTIFACT_BACKGROUND_WORKERS", "2"))
+ARTIFACT_INTERACTIVE_WORKERS = int(os.getenv("ARTIFACT_INTERACTIVE_WORKERS", "2"))
+ARTIFACT_JOBS_FILE = os.getenv("ARTIFACT_JOBS_FILE", "./chroma_store/artifact_jobs.json")
+# Thời gian tối đa một request tương tác chờ kết quả trước khi trả 503
+ARTIFACT_INTERACTIVE_TIMEOUT_S = float(os.getenv("ARTIFACT_INTERACTIVE_TIMEOUT_S", "180"))
+
+
+class ArtifactScheduler:
+    """Bounded, prioritized worker pool for LLM artifact generation.
+
+    Background jobs (summary, mindmap) are identified by (kind, chat_history_id, file_id):
+    submitting the same job twice while it is pending or running is a no-op. They are
+    persisted to a JSON file so jobs that were queued or running when the process died
+    are picked up again on the next start. Jobs are owned by a per-start token whose lock
+    file the owner holds while it runs, so a new process that reuses the old PID (e.g.
+    PID 1 after a container restart) still adopts them. Interactive work is never persisted and always
+    has at least ``interactive_workers`` threads that background jobs cannot occupy.
+    """
+
+    def __init__(
+        self,
+        background_workers: int = ARTIFACT_BACKGROUND_WORKERS,
+        interactive_workers: int = ARTIFACT_INTERACTIVE_WORKERS,
+        jobs_file: str = ARTIFACT_JOBS_FILE,
+    ):
+        self.background_workers = max(1, background_workers)
+        self.interactive_workers = max(1, interactive_workers)
+        self.jobs_file = jobs_file
+        self._file_lock = FileLock(f"{jobs_file}.lock")
+        self._owner = f"{os.getpid()}-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self._owner_lock = FileLock(self._owner_lock_path(self._owner))
+
+        self._handlers: Dict[str, Dict[str, Any]] = {}
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._interactive: Dict[str, tuple] = {}
+        self._running_background = 0
+        self._started = False
+
+    def register(self, kind: str, handler: Callable[..., Any], priority: int):
+        """Register the function that runs jobs of a given kind"""
+        self._handlers[kind] = {"handler": handler, "priority": priority}
+
+    def start(self):
+        """Start the worker threads and resume persisted jobs (idempotent)"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+
+        os.makedirs(os.path.dirname(self.jobs_file) or ".", exist_ok=True)
+        # Giữ lock suốt đời process: worker khác thấy lock còn bị giữ thì không nhận job của process này
+        self._owner_lock.acquire()
+        for job in self._recover_jobs():
+            self._enqueue(job, persist=False)
+
+        for i in range(self.background_workers + self.interactive_workers):
+            threading.Thread(target=self._worker, name=f"artifact-worker-{i}", daemon=True).start()
+        logger.info(f"✅ Artifact scheduler started ({self.background_workers} background + {self.interactive_workers} interactive workers)")
+
+    def submit(self, kind: str, user_id: str, chat_history_id: str, file_id: str) -> bool:
+        """Queue a background job. Returns False if the same job is already pending or running."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown artifact job kind: {kind}")
+        self.start()
+
+        job = {
+            "job_id": f"{kind}:{chat_history_id}:{file_id}",
+            "kind": kind,
+            "priority": self._handlers[kind]["priority"],
+            "params": {"user_id": user_id, "chat_history_id": chat_history_id, "file_id": file_id},
+            "owner": self._owner,
+            "created_at": time.time(),
+        }
+        return self._enqueue(job, persist=True)
+
+    def submit_interactive(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Run a callable ahead of every background job. Returns a concurrent Future."""
+        self.start()
+        future = Future()
+        job_id = f"interactive:{next(self._seq)}"
+        with self._cond:
+            self._interactive[job_id] = (fn, args, kwargs, future)
+            heapq.heappush(self._heap, (PRIORITY_INTERACTIVE, next(self._seq), job_id))
+            self._cond.notify()
+        return future
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "background_jobs": len(self._jobs),
+                "running_background": self._running_background,
+                "interactive_pending": len(self._interactive),
+            }
+
+    def _enqueue(self, job: Dict[str, Any], persist: bool) -> bool:
+        with self._cond:
+            if job["job_id"] in self._jobs:
+                return False
+            self._jobs[job["job_id"]] = job
+            heapq.heappush(self._heap, (job["priority"], next(self._seq), job["job_id"]))
+            self._cond.notify()
+        if persist:
+            self._persist(add=job)
+        return True
+
+    def _next_job(self) -> str:
+        """Pop the highest-priority runnable job, skipping background jobs while the background quota is full"""
+        with self._cond:
+            while True:
+                skipped = []
+                picked = None
+                while self._heap:
+                    item = heapq.heappop(self._heap)
+                    job_id = item[2]
+                    if job_id in self._interactive:
+                        picked = job_id
+                        break
+                    if self._running_background < self.background_workers:
+                        self._running_background += 1
+                        picked = job_id
+                        break
+                    skipped.append(item)
+                for item in skipped:
+                    heapq.heappush(self._heap, item)
+                if picked is not None:
+                    return picked
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            job_id = self._next_job()
+
+            with self._cond:
+                interactive = self._interactive.pop(job_id, None)
+            if interactive is not None:
+                fn, args, kwargs, future = interactive
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                continue
+
+            job = self._jobs[job_id]
+            handler = self._handlers.get(job["kind"], {}).get("handler")
+            started = time.time()
+            try:
+                if handler is None:
+                    # Giữ job trong file để process sau (có handler) chạy lại
+                    logger.warning(f"⚠️ No handler registered for artifact job {job_id}")
+                else:
+                    handler(**job["params"])
+                    logger.info(f"✅ Artifact job {job_id} done in {time.time() - started:.1f}s")
+            except Exception as e:
+                logger.error(f"❌ Artifact job {job_id} failed: {e}")
+            finally:
+                with self._cond:
+                    self._jobs.pop(job_id, None)
+                    self._running_background -= 1
+                    # Một slot nền vừa trống, đánh thức worker đang chờ
+                    self._cond.notify_all()
+                if handler is not None:
+                    self._persist(remove=job_id)
+
+    def _owner_lock_path(self, owner: str) -> str:
+        return f"{self.jobs_file}.{owner}.owner.lock"
+
+    def _owner_alive(self, owner: Optional[str]) -> bool:
+        if owner == self._owner:
+            return True
+        # Job ghi trước khi có token (chỉ có owner_pid) thuộc về lần chạy trước
+        if not owner:
+            return False
+        lock = FileLock(self._owner_lock_path(owner))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            return True
+        lock.release()
+        return False
+
+    def _load_file(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.jobs_file):
+            return {}
+        try:
+            with open(self.jobs_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"❌ Error loading artifact jobs: {e}")
+            return {}
+
+    def _write_file(self, jobs: Dict[str, Dict[str, Any]]):
+        tmp_path = f"{self.jobs_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False)
+        os.replace(tmp_path, self.jobs_file)
+
+    def _persist(self, add: Optional[Dict[str, Any]] = None, remove: Optional[str] = None):
+        """Merge one change into the shared jobs file (other uvicorn workers write to it too)"""
+        try:
+            os.makedirs(os.path.dirname(self.jobs_file) or ".", exist_ok=True)
+            with self._file_lock:
+                jobs = self._load_file()
+                if add is not None:
+                    jobs[add["job_id"]] = add
+                if remove is not None:
+                    jobs.pop(remove, None)
+                self._write_file(jobs)
+        except Exception as e:
+            logger.error(f"❌ Error persisting artifact jobs: {e}")
+
+    def _recover_jobs(self) -> List[Dict[str, Any]]:
+        """Adopt persisted jobs whose owning process is gone"""
+        recovered = []
+        try:
+            os.makedirs(os.path.dirname(self.jobs_file) or ".", exist_ok=True)
+            with self._file_lock:
+                jobs = self._load_file()
+                dead_owners = set()
+                for job in jobs.values():
+                    owner = job.get("owner")
+                    if self._owner_alive(owner):
+                        continue
+                    job.pop("owner_pid", None)
+                    job["owner"] = self._owner
+                    recovered.append(job)
+                    if owner:
+                        dead_owners.add(owner)
+                if recovered:
+                    self._write_file(jobs)
+                for owner in dead_owners:
+                    try:
+                        os.remove(self._owner_lock_path(owner))
+                    except FileNotFoundError:
+                        pass
+        except Exception as e:
+            logger.error(f"❌ Error recovering artifact jobs: {e}")
+            return []
+
+        if recovered:
+            logger.info(f"📂 Resuming {len(recovered)} artifact jobs from previous run")
+        return recovered
+
+
+artifact_scheduler = ArtifactScheduler()
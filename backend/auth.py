@@ -1,37 +1,189 @@
 # auth.py
 import os
-import requests
+import hmac
+import time
+import hashlib
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
 from jose import jwt
-from fastapi import Depends, HTTPException
+from fastapi import Depends, Header, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import dotenv
 
+from http_clients import get_http_session, get_supabase, HTTP_TIMEOUT
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
 dotenv.load_dotenv()
 
 security = HTTPBearer()
 
-JWKS_URL = os.environ["SUPABASE_JWKS_URL"]
-JWKS = requests.get(JWKS_URL).json()
+JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or f"{os.getenv('SUPABASE_URL', '').rstrip('/')}/auth/v1/.well-known/jwks.json"
+# Secret HS256 (legacy JWT secret của project); để trống nếu project dùng khóa bất đối xứng
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+JWKS_TTL = float(os.getenv("JWKS_TTL", "600"))
+# Không refresh JWKS quá thường xuyên khi gặp kid lạ (tránh bị spam token giả)
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "60"))
+# Token cho các endpoint /admin (không đặt = tắt các endpoint này)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-def decode_token(token: str):
-    try:
-        headers = jwt.get_unverified_header(token)
-        kid = headers["kid"]
-        key = next((k for k in JWKS["keys"] if k["kid"] == kid), None)
+ASYMMETRIC_ALGORITHMS = ["RS256", "ES256"]
+
+
+class AuthUser:
+    """Authenticated Supabase user, with the same fields endpoints used from auth.get_user"""
+
+    def __init__(self, id: str, email: Optional[str], user_metadata: Optional[Dict[str, Any]], claims: Dict[str, Any]):
+        self.id = id
+        self.email = email
+        self.user_metadata = user_metadata or {}
+        self.claims = claims
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> "AuthUser":
+        return cls(claims["sub"], claims.get("email"), claims.get("user_metadata"), claims)
+
+
+class JWKSCache:
+    """Supabase signing keys, loaded lazily and refreshed in the background after `ttl` seconds"""
+
+    def __init__(self, url: str, ttl: float = JWKS_TTL, min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        response = get_http_session().get(self.url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        keys = {key["kid"]: key for key in response.json().get("keys", []) if "kid" in key}
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            logger.warning(f"⚠️ JWKS refresh failed, keeping cached keys: {e}")
+        finally:
+            self._refreshing = False
+
+    def warm(self):
+        """Fetch the keys ahead of the first request (startup warm-up)"""
+        try:
+            self._fetch()
+        except Exception as e:
+            logger.warning(f"⚠️ JWKS warm-up failed, keys will be fetched on first use: {e}")
+
+    def get_key(self, kid: str) -> Optional[Dict[str, Any]]:
+        age = time.monotonic() - self._fetched_at
+        key = self._keys.get(kid)
+
+        if key is None:
+            # kid lạ: có thể Supabase vừa xoay khóa -> refresh ngay (có giới hạn tần suất)
+            if not self._fetched_at or age >= self.min_refresh_interval:
+                try:
+                    self._fetch()
+                except Exception as e:
+                    logger.error(f"❌ Error fetching JWKS: {e}")
+                    return None
+                key = self._keys.get(kid)
+        elif age >= self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name="jwks-refresh", daemon=True).start()
+        return key
+
+
+jwks_cache = JWKSCache(JWKS_URL)
+_verified_tokens: TTLCache = TTLCache(maxsize=AUTH_TOKEN_CACHE_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+_verified_lock = threading.Lock()
 
+
+def _verify_claims(token: str) -> Dict[str, Any]:
+    headers = jwt.get_unverified_header(token)
+    algorithm = headers.get("alg")
+
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        key = jwks_cache.get_key(headers.get("kid"))
         if not key:
             raise Exception("Matching key not found")
+        return jwt.decode(token, key, algorithms=[algorithm], options={"verify_aud": False})
+
+    if algorithm == "HS256" and SUPABASE_JWT_SECRET:
+        return jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], options={"verify_aud": False})
+
+    # Không tự xác thực được (HS256 mà không có secret): hỏi Supabase như trước
+    user = get_supabase().auth.get_user(token).user
+    if not user:
+        raise Exception("Supabase rejected token")
+    return {
+        "sub": user.id,
+        "email": user.email,
+        "user_metadata": user.user_metadata,
+        "exp": jwt.get_unverified_claims(token).get("exp"),
+    }
+
 
-        return jwt.decode(
-            token,
-            key,
-            algorithms=["RS256"],
-            options={"verify_aud": False},
-        )
+def decode_token(token: str):
+    try:
+        return _verify_claims(token)
     except Exception as e:
-        print("JWT decode error:", e)
+        logger.warning(f"JWT decode error: {e}")
         raise HTTPException(status_code=403, detail="Invalid token")
 
+
+def verify_supabase_token(token: str) -> Optional[AuthUser]:
+    """Verify a Supabase access token locally; returns None when it is invalid or expired"""
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    with _verified_lock:
+        user = _verified_tokens.get(cache_key)
+    if user is not None:
+        # Cache có TTL cố định, token có thể hết hạn sớm hơn
+        exp = user.claims.get("exp")
+        if exp is None or exp > time.time():
+            return user
+
+    try:
+        claims = _verify_claims(token)
+    except Exception as e:
+        logger.warning(f"JWT decode error: {e}")
+        return None
+
+    user = AuthUser.from_claims(claims)
+    with _verified_lock:
+        _verified_tokens[cache_key] = user
+    return user
+
+
+@traced("auth")
+def get_authenticated_user(authorization: Optional[str] = Header(None)) -> AuthUser:
+    """FastAPI dependency: 401 without a bearer token, 403 when the token does not verify"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user = verify_supabase_token(authorization[7:])
+    if user is None:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return user
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """FastAPI dependency for /admin endpoints: 404 while ADMIN_TOKEN is unset, 403 on a wrong token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     return decode_token(token)
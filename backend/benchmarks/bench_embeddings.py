@@ -0,0 +1,114 @@
+"""Throughput benchmark: local ONNX embeddings vs the Jina API.
+
+Run from backend/:
+    python -m benchmarks.bench_embeddings --backends local,jina --docs 200 --pdf sample.pdf
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+# storage cấu hình Gemini khi import; benchmark không gọi Gemini
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+SAMPLE_SENTENCES = [
+    "Trí tuệ nhân tạo giúp máy tính học từ dữ liệu và đưa ra dự đoán.",
+    "Gradient descent cập nhật trọng số theo hướng ngược với đạo hàm của hàm mất mát.",
+    "Retrieval-augmented generation combines a vector search with a language model.",
+    "The mitochondria is the powerhouse of the cell and produces ATP.",
+    "機械学習はデータからパターンを学習する技術です。",
+    "東京は日本の首都であり、多くの人が住んでいます。",
+    "Học sinh lớp 5 được làm quen với phân số và số thập phân.",
+    "Transformers use self-attention to model long-range dependencies in text.",
+]
+
+
+def synthetic_texts(count: int, words_per_text: int, seed: int = 0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        sentences = []
+        while sum(len(s.split()) for s in sentences) < words_per_text:
+            sentences.append(rng.choice(SAMPLE_SENTENCES))
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def pdf_texts(paths, count: int):
+    from loader import pdf_to_text, clean_text, split_text_parallel
+
+    texts = []
+    for path in paths:
+        with open(path, "rb") as f:
+            texts.extend(split_text_parallel(clean_text(pdf_to_text(f.read()))))
+    if not texts:
+        raise SystemExit("No text extracted from the given PDFs")
+    return (texts * (count // len(texts) + 1))[:count]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def bench_backend(name: str, texts, queries):
+    if name == "local":
+        from local_embeddings import OnnxEmbeddings
+        model = OnnxEmbeddings()
+    elif name == "jina":
+        from storage import JinaEmbeddings
+        model = JinaEmbeddings()
+    else:
+        raise SystemExit(f"Unknown backend: {name}")
+
+    # Warm-up (load session / mở kết nối)
+    model.embed_documents(texts[:2])
+
+    started = time.perf_counter()
+    vectors = model.embed_documents(texts)
+    elapsed = time.perf_counter() - started
+
+    query_latencies = []
+    for query in queries:
+        query_started = time.perf_counter()
+        model.embed_query(query)
+        query_latencies.append((time.perf_counter() - query_started) * 1000)
+
+    return {
+        "backend": name,
+        "docs": len(texts),
+        "dimension": len(vectors[0]) if vectors else 0,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(len(texts) / elapsed, 2) if elapsed else None,
+        "query_ms_p50": round(statistics.median(query_latencies), 2),
+        "query_ms_p95": round(percentile(query_latencies, 95), 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="local", help="comma separated: local,jina")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--words", type=int, default=300, help="words per synthetic document")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--pdf", nargs="*", default=[], help="use chunks from these PDFs instead of synthetic text")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    texts = pdf_texts(args.pdf, args.docs) if args.pdf else synthetic_texts(args.docs, args.words)
+    queries = synthetic_texts(args.queries, 12, seed=1)
+
+    results = [bench_backend(name.strip(), texts, queries) for name in args.backends.split(",") if name.strip()]
+    output = json.dumps({"benchmark": "embeddings", "results": results}, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""Ingestion benchmark: per-stage time and peak RSS of loader.py on synthetic PDFs.
+
+PDFs are generated with PyMuPDF as born-digital text, rasterised scans (each page is a
+single image) or mixed (every third page scanned), at several page counts. Each case
+runs in a fresh subprocess through the real loader class; loader's stage functions are
+wrapped to time detection, extraction, rasterisation, OCR, cleaning and chunking and to
+record the peak RSS reached inside each stage. Gemini OCR is replaced by a local fake
+with a fixed per-image latency, so runs are offline and reproducible.
+
+Run from backend/:
+    python -m benchmarks.bench_ingestion --pages 10,100,1000 --output ingestion.json
+    python -m benchmarks.bench_ingestion --kinds scanned --pages 100 --baseline ingestion.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+KINDS = ("text", "scanned", "mixed")
+# Các hàm của loader.py được đo, theo thứ tự chạy
+STAGES = (
+    ("detection", "is_scanned_PDF"),
+    ("extraction", "pdf_to_text"),
+    ("rasterize", "convert_pdf_to_images_parallel"),
+    ("ocr", "extract_text_from_images_parallel"),
+    ("ocr", "image_to_text_parallel"),
+    ("cleaning", "clean_text"),
+    ("chunking", "split_text_parallel"),
+)
+WORDS_PER_PAGE = 350
+SCAN_DPI = 100
+
+
+def page_texts(pages: int, seed: int):
+    from benchmarks.bench_retrieval import pseudo_word
+
+    rng = random.Random(seed)
+    vocabulary = [pseudo_word(rng, rng.randint(1, 4)) for _ in range(2000)]
+    texts = []
+    for page_index in range(pages):
+        words = [rng.choice(vocabulary) for _ in range(WORDS_PER_PAGE)]
+        # Ngắt đoạn để clean_text/splitter có cấu trúc giống tài liệu thật
+        for i in range(40, len(words), 40):
+            words[i] += ".\n\n"
+        texts.append(f"Page {page_index + 1}\n\n" + " ".join(words))
+    return texts
+
+
+def generate_pdf(path: str, kind: str, pages: int, seed: int):
+    import fitz
+
+    pdf = fitz.open()
+    scratch = fitz.open()
+    rect = fitz.Rect(36, 36, 559, 806)
+    for page_index, text in enumerate(page_texts(pages, seed)):
+        scanned = kind == "scanned" or (kind == "mixed" and page_index % 3 == 2)
+        if not scanned:
+            pdf.new_page().insert_textbox(rect, text, fontsize=9)
+            continue
+        # Trang scan: render trang chữ thành ảnh xám rồi chèn ảnh (không còn lớp text)
+        source = scratch.new_page()
+        source.insert_textbox(rect, text, fontsize=9)
+        pixmap = source.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+        page = pdf.new_page()
+        page.insert_image(page.rect, stream=pixmap.tobytes("png"))
+        scratch.delete_page(0)
+    pdf.save(path, deflate=True)
+    pdf.close()
+    scratch.close()
+
+
+class RSSMonitor:
+    """Samples this process's RSS in the background; peak() is the max since the last reset()"""
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self._peak = 0
+        self._lock = threading.Lock()
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        threading.Thread(target=self._run, name="rss-monitor", daemon=True).start()
+
+    def current(self) -> int:
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # Không có /proc (macOS): chỉ có peak của cả process
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def reset(self):
+        with self._lock:
+            self._peak = self.current()
+
+    def peak(self) -> int:
+        with self._lock:
+            self._peak = max(self._peak, self.current())
+            return self._peak
+
+    def _run(self):
+        while True:
+            rss = self.current()
+            with self._lock:
+                if rss > self._peak:
+                    self._peak = rss
+            time.sleep(self.interval_s)
+
+
+class FakeGeminiOCR:
+    """Stands in for llm_client.generate on OCR calls: fixed latency, fixed-size text"""
+
+    def __init__(self, latency_ms: float, seed: int):
+        self.latency_s = latency_ms / 1000
+        self.text = page_texts(1, seed)[0]
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, model_name, contents, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self.text
+
+
+def instrument(loader_module, monitor: RSSMonitor):
+    """Wrap loader's stage functions; returns the dict the timings accumulate into"""
+    stats = {}
+    active = threading.local()
+
+    def wrap(stage, fn):
+        def timed(*args, **kwargs):
+            # Stage lồng nhau (vd. OCR gọi bên trong stage khác) chỉ tính ở stage ngoài
+            if getattr(active, "stage", None):
+                return fn(*args, **kwargs)
+            active.stage = stage
+            monitor.reset()
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                entry = stats.setdefault(stage, {"seconds": 0.0, "calls": 0, "peak_rss_mb": 0.0})
+                entry["seconds"] += time.perf_counter() - started
+                entry["calls"] += 1
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"], monitor.peak() / 2 ** 20)
+                active.stage = None
+        return timed
+
+    for stage, name in STAGES:
+        setattr(loader_module, name, wrap(stage, getattr(loader_module, name)))
+    return stats
+
+
+def run_case(path: str, ocr: str, ocr_latency_ms: float, seed: int):
+    """Load one PDF through the real loader class (runs inside the case subprocess)"""
+    monitor = RSSMonitor()
+    baseline_rss = monitor.current()
+    import loader
+
+    fake = FakeGeminiOCR(ocr_latency_ms, seed)
+    loader.llm_client.generate = fake.generate
+    stats = instrument(loader, monitor)
+    loader_class = loader.ParallelLoaderWithGemini if ocr == "gemini" else loader.ParallelLoader
+
+    monitor.reset()
+    started = time.perf_counter()
+    chunks = loader_class(file_path=path).load_chunks()
+    total = time.perf_counter() - started
+    peak = monitor.peak()
+
+    return {
+        "seconds": round(total, 4),
+        "chunks": len(chunks),
+        "text_chars": sum(len(chunk.page_content) for chunk in chunks),
+        "ocr_calls": fake.calls,
+        "baseline_rss_mb": round(baseline_rss / 2 ** 20, 1),
+        "peak_rss_mb": round(peak / 2 ** 20, 1),
+        # Peak của các process con (OCR EasyOCR chạy trong ProcessPoolExecutor)
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "stages": {
+            stage: {"seconds": round(entry["seconds"], 4), "calls": entry["calls"], "peak_rss_mb": round(entry["peak_rss_mb"], 1)}
+            for stage, entry in stats.items()
+        },
+        "other_seconds": round(total - sum(entry["seconds"] for entry in stats.values()), 4),
+    }
+
+
+def compare(baseline: dict, current: dict, max_regression: float):
+    """Print per-case deltas against a previous run; returns the number of regressions"""
+    previous = {(entry["kind"], entry["pages"]): entry for entry in baseline.get("results", [])}
+    regressions = 0
+    for entry in current["results"]:
+        before = previous.get((entry["kind"], entry["pages"]))
+        if before is None:
+            continue
+        label = f"{entry['kind']:>8} {entry['pages']:>5}p"
+        metrics = [("total s", before["seconds"], entry["seconds"]), ("peak RSS MB", before["peak_rss_mb"], entry["peak_rss_mb"])]
+        metrics += [
+            (f"{stage} s", before["stages"][stage]["seconds"], stats["seconds"])
+            for stage, stats in entry["stages"].items() if stage in before.get("stages", {})
+        ]
+        for name, old, new in metrics:
+            change = (new - old) / old if old else 0
+            # Stage rất ngắn dao động nhiều: bỏ qua chênh lệch dưới 50 ms / 5 MB
+            min_delta = 5 if name == "peak RSS MB" else 0.05
+            flag = ""
+            if change > max_regression and new - old > min_delta:
+                regressions += 1
+                flag = "  <-- regression"
+            print(f"{label} {name}: {old} -> {new} ({change:+.1%}){flag}")
+        if entry["chunks"] != before["chunks"] or entry["text_chars"] != before["text_chars"]:
+            regressions += 1
+            print(f"{label} output changed: {before['chunks']} -> {entry['chunks']} chunks, "
+                  f"{before['text_chars']} -> {entry['text_chars']} chars  <-- regression")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kinds", default=",".join(KINDS), help="comma separated: text,scanned,mixed")
+    parser.add_argument("--pages", default="10,100,1000")
+    parser.add_argument("--ocr", choices=("gemini", "easyocr"), default="gemini",
+                        help="gemini: ParallelLoaderWithGemini with the fake OCR; easyocr: ParallelLoader (real EasyOCR, slow)")
+    parser.add_argument("--ocr-latency-ms", type=float, default=0, help="latency of each fake Gemini OCR call")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdf-dir", default=os.path.join(tempfile.gettempdir(), "bench_ingestion_pdfs"),
+                        help="generated PDFs are cached here between runs")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON result")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative increase vs baseline")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--case-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        result = run_case(args.case, args.ocr, args.ocr_latency_ms, args.seed)
+        with open(args.case_output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise SystemExit(f"Unknown kinds: {', '.join(sorted(unknown))}")
+    page_counts = [int(pages) for pages in args.pages.split(",") if pages.strip()]
+    os.makedirs(args.pdf_dir, exist_ok=True)
+
+    results = []
+    for kind in kinds:
+        for pages in page_counts:
+            path = os.path.join(args.pdf_dir, f"{kind}_{pages}_{args.seed}.pdf")
+            if not os.path.exists(path):
+                started = time.perf_counter()
+                generate_pdf(path, kind, pages, args.seed)
+                print(f"📂 Generated {path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                # Mỗi lần chạy một process mới để peak RSS không bị lần chạy trước ảnh hưởng
+                with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as case_output:
+                    case_path = case_output.name
+                try:
+                    command = [
+                        sys.executable, "-m", "benchmarks.bench_ingestion",
+                        "--case", path, "--case-output", case_path,
+                        "--ocr", args.ocr, "--ocr-latency-ms", str(args.ocr_latency_ms), "--seed", str(args.seed),
+                    ]
+                    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                    if completed.returncode != 0:
+                        raise SystemExit(f"{kind}/{pages} pages failed:\n{completed.stderr}")
+                    with open(case_path, "r", encoding="utf-8") as f:
+                        runs.append(json.load(f))
+                finally:
+                    os.remove(case_path)
+
+            entry = {"kind": kind, "pages": pages, "file_mb": round(os.path.getsize(path) / 2 ** 20, 2)}
+            entry.update(min(runs, key=lambda run: run["seconds"]))
+            entry["pages_per_sec"] = round(pages / entry["seconds"], 2) if entry["seconds"] else None
+            results.append(entry)
+            stages = ", ".join(f"{stage} {stats['seconds']:.2f}s" for stage, stats in entry["stages"].items())
+            print(f"📊 {kind} {pages}p: {entry['seconds']:.2f}s ({stages}), peak RSS {entry['peak_rss_mb']} MB", file=sys.stderr)
+
+    report = {
+        "benchmark": "ingestion",
+        "config": {"ocr": args.ocr, "ocr_latency_ms": args.ocr_latency_ms, "repeat": args.repeat, "seed": args.seed, "scan_dpi": SCAN_DPI},
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Recall / latency / memory of truncated and quantised embeddings vs full float32.
+
+Vectors come from an existing Chroma collection (real chunk embeddings), or are
+synthesised for a quick run. A held-out slice of the vectors is used as queries and
+exact full-precision top-k is the ground truth.
+
+Run from backend/:
+    python -m benchmarks.bench_quantization --persist-dir ./chroma_store --collection <name>
+    python -m benchmarks.bench_quantization --synthetic 20000 --dims 1024,512,256
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from vector_index import EMBEDDING_FULL_DIMENSIONS, QUANTIZATION_MODES, VectorSidecar
+from benchmarks.bench_embeddings import percentile
+
+
+def chroma_vectors(persist_dir: str, collection: str):
+    import chromadb
+
+    client = chromadb.PersistentClient(path=persist_dir)
+    data = client.get_collection(collection).get(include=["embeddings"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if len(vectors) == 0:
+        raise SystemExit(f"Collection {collection} is empty")
+    return vectors
+
+
+def synthetic_vectors(count: int, dims: int, seed: int = 0):
+    # Vector có cấu trúc cụm (gần với embedding thật hơn nhiễu đều)
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 50), dims)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size=count)] + 0.6 * rng.normal(size=(count, dims)).astype(np.float32)
+    # Matryoshka: các chiều đầu mang nhiều thông tin hơn
+    vectors *= np.linspace(1.5, 0.5, dims, dtype=np.float32)
+    return vectors
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def bench_config(corpus, queries, truth, dims: int, quantization: str, k: int, candidates: int):
+    workdir = tempfile.mkdtemp(prefix="bench_quant_")
+    try:
+        sidecar = VectorSidecar(workdir, dims=dims, quantization=quantization)
+        ids = [str(i) for i in range(len(corpus))]
+        sidecar.add(ids, ["bench"] * len(ids), corpus)
+
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            hits = sidecar.search(query, k=k, candidates=candidates)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found = {int(chunk_id) for chunk_id, _ in hits}
+            recalls.append(len(found & expected) / k)
+
+        memory = sidecar.memory_bytes()
+        return {
+            "dims": dims,
+            "quantization": quantization,
+            "recall_at_k": round(statistics.mean(recalls), 4),
+            "query_ms_p50": round(statistics.median(latencies), 3),
+            "query_ms_p95": round(percentile(latencies, 95), 3),
+            "index_bytes": memory["index_bytes"],
+            "bytes_per_vector": round(memory["index_bytes"] / len(corpus), 1),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--persist-dir", default="./chroma_store")
+    parser.add_argument("--collection", help="read vectors from this Chroma collection")
+    parser.add_argument("--synthetic", type=int, default=10000, help="number of synthetic vectors when no collection is given")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=50, help="rescoring candidates (RESCORE_CANDIDATES)")
+    parser.add_argument("--dims", default="1024,512,256")
+    parser.add_argument("--quantization", default=",".join(QUANTIZATION_MODES))
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if args.collection:
+        vectors = chroma_vectors(args.persist_dir, args.collection)
+        source = f"chroma:{args.collection}"
+    else:
+        vectors = synthetic_vectors(args.synthetic, EMBEDDING_FULL_DIMENSIONS)
+        source = "synthetic"
+
+    n_queries = min(args.queries, len(vectors) // 5)
+    queries, corpus = normalise(vectors[:n_queries]), normalise(vectors[n_queries:])
+    exact = queries @ corpus.T
+    truth = [set(np.argsort(-row)[:args.k].tolist()) for row in exact]
+
+    results = []
+    for dims in [int(d) for d in args.dims.split(",") if d.strip()]:
+        if dims > corpus.shape[1]:
+            continue
+        for quantization in [q.strip() for q in args.quantization.split(",") if q.strip()]:
+            results.append(bench_config(corpus, queries, truth, dims, quantization, args.k, args.candidates))
+
+    output = json.dumps({
+        "benchmark": "quantization",
+        "source": source,
+        "vectors": len(corpus),
+        "queries": len(queries),
+        "k": args.k,
+        "candidates": args.candidates,
+        "full_float32_bytes_per_vector": corpus.shape[1] * 4,
+        "results": results,
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
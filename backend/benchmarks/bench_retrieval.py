@@ -0,0 +1,313 @@
+"""Offline retrieval benchmark: ingest throughput, retrieval latency and recall@k.
+
+Collections are built through MultiFileRAGSystem.store_documents from generated PDFs
+(or the PDFs given with --pdf) using a deterministic hashing embedder and a stub LLM,
+so runs need no network and are comparable between commits. Generated PDFs contain
+one "fact" per paragraph; each labelled query asks for a fact and is a hit when a
+retrieved chunk contains its answer. With --pdf, labelled queries come from --queries
+(JSON list of {"query": ..., "answer": ...}).
+
+Run from backend/:
+    python -m benchmarks.bench_retrieval --sizes 100,500,1000 --output retrieval.json
+    python -m benchmarks.bench_retrieval --baseline retrieval.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import statistics
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.bench_embeddings import percentile
+
+FILLER_WORDS = 3000
+FACTS_PER_PAGE = 6
+WORDS_PER_PARAGRAPH = 60
+SUBJECT_WORDS = 3
+STOP_WORDS = {"a", "an", "and", "in", "is", "of", "the", "to", "what"}
+
+
+def pseudo_word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice("bcdfghklmnpqrstvxz") + rng.choice("aeiou") for _ in range(length))
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic set-of-words embedder (signed feature hashing, L2-normalised).
+
+    Each distinct non-stop word adds ±1 to one of `dimensions` buckets, so ranking
+    quality degrades with collection size much like a real embedder does on needle
+    queries, without any model or network.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self._buckets = {}
+
+    def _bucket(self, token: str):
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = self._buckets[token] = (int.from_bytes(digest[:4], "little") % self.dimensions, 1.0 if digest[4] & 1 else -1.0)
+        return bucket
+
+    def _embed(self, text: str):
+        vector = [0.0] * self.dimensions
+        tokens = {token.strip(".,:;?!()\"'") for token in text.lower().split()}
+        for token in tokens - STOP_WORDS:
+            if token:
+                index, sign = self._bucket(token)
+                vector[index] += sign
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def generate_pdf(path: str, doc_index: int, pages: int, vocabulary, seed: int):
+    """Write a text PDF; returns its labelled queries"""
+    import fitz
+
+    rng = random.Random(seed * 100003 + doc_index)
+    # Từ đệm phân bố Zipf: vài từ xuất hiện ở mọi chunk, phần đuôi phân biệt được chunk
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    queries = []
+    pdf = fitz.open()
+    for page_index in range(pages):
+        paragraphs = []
+        for fact_index in range(FACTS_PER_PAGE):
+            subject = " ".join(pseudo_word(rng, 3) for _ in range(SUBJECT_WORDS))
+            answer = f"{pseudo_word(rng, 4)}{doc_index}x{page_index}x{fact_index}"
+            attribute = rng.choice(("access code", "project lead", "launch city", "reference number"))
+            filler = " ".join(rng.choices(vocabulary, weights=weights, k=WORDS_PER_PARAGRAPH))
+            paragraphs.append(f"{filler}. The {attribute} of {subject} is {answer}.")
+            queries.append({"query": f"What is the {attribute} of {subject}?", "answer": answer, "doc": doc_index})
+        page = pdf.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 559, 806), "\n\n".join(paragraphs), fontsize=7)
+    pdf.save(path)
+    pdf.close()
+    return queries
+
+
+def page_count(path: str) -> int:
+    import fitz
+
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+class StubLLM:
+    """Stands in for llm_client.generate: fixed latency, answer derived from the prompt"""
+
+    def __init__(self, latency_ms: float):
+        self.latency_s = latency_ms / 1000
+        self.calls = 0
+
+    def generate(self, model_name, prompt, **kwargs):
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return f"stub answer ({len(prompt)} chars of prompt)"
+
+
+def measure_size(rag, queries, k_values, runs: int, chat_runs: int, rerank: bool, workdir: str):
+    """Latency percentiles and recall@k for the collection as it is now"""
+    max_k = max(k_values)
+    latencies, embed_ms, search_ms = [], [], []
+    hits = {k: 0 for k in k_values}
+    for i in range(runs):
+        labelled = queries[i % len(queries)]
+        started = time.perf_counter()
+        docs = rag.retrieve_documents(labelled["query"], k=max_k, rerank=rerank)
+        latencies.append((time.perf_counter() - started) * 1000)
+        embed_ms.append(rag.last_retrieval_timings.get("embed_query_ms", 0))
+        search_ms.append(rag.last_retrieval_timings.get("vector_search_ms", 0))
+        if i < len(queries):
+            for k in k_values:
+                if any(labelled["answer"] in doc.page_content for doc in docs[:k]):
+                    hits[k] += 1
+
+    chat_latencies = []
+    # chat() ghi relevant_chunks.txt vào thư mục hiện tại: chạy trong workdir để không ghi đè file của repo
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for i in range(chat_runs):
+            started = time.perf_counter()
+            rag.chat(queries[i % len(queries)]["query"], k=max_k)
+            chat_latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        os.chdir(cwd)
+
+    labelled_count = min(runs, len(queries))
+    result = {
+        "queries": runs,
+        "labelled_queries": labelled_count,
+        "retrieve_ms_p50": round(percentile(latencies, 50), 3),
+        "retrieve_ms_p95": round(percentile(latencies, 95), 3),
+        "retrieve_ms_p99": round(percentile(latencies, 99), 3),
+        "embed_query_ms_mean": round(statistics.mean(embed_ms), 3),
+        "vector_search_ms_mean": round(statistics.mean(search_ms), 3),
+        "recall": {f"@{k}": round(hits[k] / labelled_count, 4) for k in k_values},
+    }
+    if chat_latencies:
+        result["chat_ms_p50"] = round(percentile(chat_latencies, 50), 3)
+        result["chat_ms_p95"] = round(percentile(chat_latencies, 95), 3)
+    return result
+
+
+def compare(baseline: dict, current: dict, max_regression: float):
+    """Print per-size deltas against a previous run; returns the number of regressions"""
+    previous = {entry["target_chunks"]: entry for entry in baseline.get("results", [])}
+    regressions = 0
+    for entry in current["results"]:
+        before = previous.get(entry["target_chunks"])
+        if before is None:
+            continue
+        for metric in ("retrieve_ms_p50", "retrieve_ms_p95", "retrieve_ms_p99"):
+            change = (entry[metric] - before[metric]) / before[metric] if before[metric] else 0
+            flag = ""
+            if change > max_regression:
+                regressions += 1
+                flag = "  <-- regression"
+            print(f"{entry['target_chunks']:>8} chunks {metric}: {before[metric]:.3f} -> {entry[metric]:.3f} ms ({change:+.1%}){flag}")
+        for cutoff, recall in entry["recall"].items():
+            old = before["recall"].get(cutoff)
+            if old is None:
+                continue
+            flag = ""
+            if recall < old - 1e-9:
+                regressions += 1
+                flag = "  <-- regression"
+            print(f"{entry['target_chunks']:>8} chunks recall{cutoff}: {old:.4f} -> {recall:.4f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,500,1000", help="collection sizes (chunks) to measure at")
+    parser.add_argument("--pages-per-doc", type=int, default=40)
+    parser.add_argument("--pdf", nargs="*", default=[], help="ingest these PDFs (round robin) instead of generated ones")
+    parser.add_argument("--queries", help="labelled queries JSON for --pdf: [{\"query\": ..., \"answer\": ...}]")
+    parser.add_argument("--k", default="1,5,10", help="recall@k cutoffs; the largest is the retrieval k")
+    parser.add_argument("--runs", type=int, default=200, help="retrieval calls per collection size")
+    parser.add_argument("--chat-runs", type=int, default=20, help="chat() calls per collection size (stub LLM)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--rerank", action="store_true", help="use the configured local reranker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep collections here instead of a temporary directory")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON result")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative latency increase vs baseline")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(int(size) for size in args.sizes.split(",") if size.strip())
+    k_values = sorted(int(k) for k in args.k.split(",") if k.strip())
+    if args.pdf and not args.queries:
+        raise SystemExit("--pdf needs --queries with labelled queries")
+
+    # Mọi state (Chroma, catalog, journal) nằm trong workdir, không đụng ./chroma_store
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bench_retrieval_"))
+    for name, relative in (
+        ("CHROMA_ROOT", "chroma_store"),
+        ("FILE_CATALOG_PATH", "file_catalog.sqlite3"),
+        ("ARTIFACT_JOBS_FILE", "artifact_jobs.json"),
+        ("WRITE_BEHIND_DIR", "write_behind"),
+        ("READ_CACHE_EPOCH_DIR", "read_cache"),
+        ("UPLOAD_SPOOL_DIR", "spool"),
+    ):
+        os.environ[name] = os.path.join(workdir, relative)
+    pdf_dir = os.path.join(workdir, "pdfs")
+    os.makedirs(pdf_dir, exist_ok=True)
+
+    import storage
+    from vector_index import EMBEDDING_FULL_DIMENSIONS, EMBEDDING_DIMENSIONS, EMBEDDING_QUANTIZATION
+
+    embedder = HashingEmbeddings(EMBEDDING_FULL_DIMENSIONS)
+    llm = StubLLM(args.llm_latency_ms)
+    storage.create_embedding_model = lambda jina_api_key=None: embedder
+    storage.llm_client.generate = llm.generate
+
+    rag = storage.MultiFileRAGSystem(user_id="bench", chat_history_id=f"retrieval-{args.seed}")
+
+    if args.pdf:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            fixed_queries = json.load(f)
+    rng = random.Random(args.seed)
+    vocabulary = [pseudo_word(rng, rng.randint(2, 4)) for _ in range(FILLER_WORDS)]
+
+    ingest = {"files": 0, "pages": 0, "chunks": 0, "seconds": 0.0}
+    queries = []
+    results = []
+    for size in sizes:
+        while ingest["chunks"] < size:
+            index = ingest["files"]
+            if args.pdf:
+                path = args.pdf[index % len(args.pdf)]
+            else:
+                path = os.path.join(pdf_dir, f"doc_{index}.pdf")
+                queries.extend(generate_pdf(path, index, args.pages_per_doc, vocabulary, args.seed))
+            started = time.perf_counter()
+            if not rag.store_documents(file_id=f"file{index}", filename=os.path.basename(path), file_type="pdf",
+                                       file_path=path, schedule_artifacts=False):
+                raise SystemExit(f"Ingestion failed for {path}")
+            ingest["seconds"] += time.perf_counter() - started
+            ingest["files"] += 1
+            ingest["pages"] += page_count(path)
+            ingest["chunks"] = sum(info["chunk_count"] for info in rag.file_manager.files_info.values())
+
+        labelled = fixed_queries if args.pdf else queries
+        # Trộn để query không dồn vào các tài liệu đầu tiên
+        labelled = random.Random(args.seed + size).sample(labelled, len(labelled))
+        entry = {"target_chunks": size, "chunks": ingest["chunks"], "files": ingest["files"], "pages": ingest["pages"]}
+        entry.update(measure_size(rag, labelled, k_values, args.runs, args.chat_runs, args.rerank, workdir))
+        results.append(entry)
+        print(f"📊 {entry['chunks']} chunks: p50 {entry['retrieve_ms_p50']} ms, p95 {entry['retrieve_ms_p95']} ms, recall {entry['recall']}", file=sys.stderr)
+
+    report = {
+        "benchmark": "retrieval",
+        "config": {
+            "embedder": f"hashing-{EMBEDDING_FULL_DIMENSIONS}",
+            "embedding_dimensions": EMBEDDING_DIMENSIONS,
+            "quantization": EMBEDDING_QUANTIZATION,
+            "rerank": args.rerank,
+            "k": k_values,
+            "runs": args.runs,
+            "pages_per_doc": None if args.pdf else args.pages_per_doc,
+            "pdfs": args.pdf or "generated",
+            "seed": args.seed,
+        },
+        "ingest": {
+            "files": ingest["files"],
+            "pages": ingest["pages"],
+            "chunks": ingest["chunks"],
+            "seconds": round(ingest["seconds"], 3),
+            "pages_per_sec": round(ingest["pages"] / ingest["seconds"], 2) if ingest["seconds"] else None,
+            "chunks_per_sec": round(ingest["chunks"] / ingest["seconds"], 2) if ingest["seconds"] else None,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
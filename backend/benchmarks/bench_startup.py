@@ -0,0 +1,193 @@
+"""Startup benchmark: import time and RSS of the backend modules, and the first-use cost of lazy stacks.
+
+Each target module is imported in a fresh interpreter (cwd is a scratch directory, so
+./chroma_store state is not touched). The benchmark reports the import time, the RSS
+before and after the import, and which heavy libraries (torch, easyocr, PyMuPDF,
+Chroma, google.generativeai, ...) the import pulled in. Those libraries should only
+load on first use or through the WARMUP_ON_STARTUP warm-up. With --first-use, the
+warm-up steps then run one by one in the same process to show the latency and RSS the
+first upload/chat pays for each lazily loaded stack. --importtime adds the slowest
+modules from `python -X importtime`.
+
+Run from backend/:
+    python -m benchmarks.bench_startup --output startup.json
+    python -m benchmarks.bench_startup --targets main --first-use llm,vector_store,pdf,ocr --importtime 15
+    python -m benchmarks.bench_startup --baseline startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import importlib
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGETS = ("main", "storage", "loader", "auth")
+# Thư viện không được nạp khi import: chỉ khi dùng lần đầu hoặc warm-up
+HEAVY_MODULES = (
+    "torch", "easyocr", "fitz", "pdf2image", "PIL.Image", "chromadb",
+    "langchain", "langchain_community", "langchain_text_splitters", "google.generativeai", "onnxruntime",
+)
+# Env tối thiểu để import main.py không cần dịch vụ thật (không có request mạng khi import)
+BENCH_ENV = {
+    "GEMINI_API_KEY": "benchmark",
+    "SUPABASE_URL": "http://127.0.0.1:54321",
+    "SUPABASE_SERVICE_ROLE_KEY": "benchmark",
+    "WARMUP_ON_STARTUP": "false",
+}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except OSError:
+        # Không có /proc (macOS): chỉ có peak của cả process
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round((peak if sys.platform == "darwin" else peak * 1024) / 2 ** 20, 1)
+
+
+def run_case(target: str, first_use):
+    """Import one module and optionally run warm-up steps (runs inside the case subprocess)"""
+    sys.path.insert(0, BACKEND_DIR)
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    importlib.import_module(target)
+    import_seconds = time.perf_counter() - started
+    result = {
+        "import_seconds": round(import_seconds, 4),
+        "rss_before_mb": rss_before,
+        "rss_mb": rss_mb(),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+        "modules_loaded": len(sys.modules),
+    }
+    if first_use:
+        from warmup import WARMUP_STEPS
+
+        steps = {}
+        for step in first_use:
+            started = time.perf_counter()
+            WARMUP_STEPS[step]()
+            steps[step] = {"seconds": round(time.perf_counter() - started, 4), "rss_mb": rss_mb()}
+        result["first_use"] = steps
+    return result
+
+
+def import_profile(target: str, workdir: str, env: dict, top: int):
+    """Slowest modules (cumulative) from `python -X importtime -c 'import target'`"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Chỉ tính module cấp cao nhất trong cây import (module con được thụt thêm 2 dấu cách)
+        if not name.startswith("  "):
+            entries.append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    return sorted(entries, key=lambda entry: -entry["cumulative_ms"])[:top]
+
+
+def compare(baseline: dict, current: dict, max_regression: float):
+    """Print per-target deltas against a previous run; returns the number of regressions"""
+    previous = {entry["target"]: entry for entry in baseline.get("results", [])}
+    regressions = 0
+    for entry in current["results"]:
+        before = previous.get(entry["target"])
+        if before is None:
+            continue
+        for name, old, new, min_delta in (
+            ("import s", before["import_seconds"], entry["import_seconds"], 0.05),
+            ("RSS MB", before["rss_mb"], entry["rss_mb"], 5),
+        ):
+            change = (new - old) / old if old else 0
+            flag = ""
+            if change > max_regression and new - old > min_delta:
+                regressions += 1
+                flag = "  <-- regression"
+            print(f"{entry['target']:>10} {name}: {old} -> {new} ({change:+.1%}){flag}")
+        added = sorted(set(entry["heavy_modules"]) - set(before["heavy_modules"]))
+        if added:
+            regressions += 1
+            print(f"{entry['target']:>10} now imports {', '.join(added)} at load  <-- regression")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", default=",".join(DEFAULT_TARGETS), help="comma separated module names")
+    parser.add_argument("--first-use", default="",
+                        help="warm-up steps timed after importing each target, e.g. llm,vector_store,pdf,ocr")
+    parser.add_argument("--importtime", type=int, default=0, help="report the N slowest modules from -X importtime")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per target; the fastest is reported")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON result")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative increase vs baseline")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--case-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    first_use = [step.strip() for step in args.first_use.split(",") if step.strip()]
+
+    if args.case:
+        result = run_case(args.case, first_use)
+        with open(args.case_output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ)
+    for name, value in BENCH_ENV.items():
+        env.setdefault(name, value)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+
+    results = []
+    for target in targets:
+        runs = []
+        for _ in range(max(1, args.repeat)):
+            # Mỗi lần chạy một interpreter mới: không có module nào đã được cache
+            case_path = os.path.join(workdir, f"{target}.json")
+            command = [sys.executable, "-m", "benchmarks.bench_startup", "--case", target, "--case-output", case_path]
+            if first_use:
+                command += ["--first-use", ",".join(first_use)]
+            completed = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if completed.returncode != 0:
+                raise SystemExit(f"import {target} failed:\n{completed.stderr}")
+            with open(case_path, "r", encoding="utf-8") as f:
+                runs.append(json.load(f))
+            os.remove(case_path)
+
+        entry = {"target": target}
+        entry.update(min(runs, key=lambda run: run["import_seconds"]))
+        if args.importtime:
+            entry["slowest_imports"] = import_profile(target, workdir, env, args.importtime)
+        results.append(entry)
+        heavy = ", ".join(entry["heavy_modules"]) or "none"
+        print(f"📊 import {target}: {entry['import_seconds']:.2f}s, RSS {entry['rss_before_mb']} -> {entry['rss_mb']} MB, heavy: {heavy}", file=sys.stderr)
+        for step, stats in entry.get("first_use", {}).items():
+            print(f"   first use {step}: {stats['seconds']:.2f}s, RSS {stats['rss_mb']} MB", file=sys.stderr)
+
+    report = {
+        "benchmark": "startup",
+        "config": {"repeat": args.repeat, "first_use": first_use, "python": sys.version.split()[0]},
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
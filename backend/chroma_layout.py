@@ -0,0 +1,123 @@
+import os
+import glob
+import shutil
+import sqlite3
+import hashlib
+import logging
+from contextlib import ExitStack
+from typing import Dict, Optional
+
+from filelock import FileLock
+
+from file_catalog import file_catalog
+from vector_index import EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS, EMBEDDING_FULL_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+CHROMA_ROOT = os.getenv("CHROMA_ROOT", "./chroma_store")
+# user: một thư mục Chroma cho mỗi user (layout cũ) | chat: mỗi chat một thư mục | hashed: N bucket cố định
+CHROMA_SHARDING = os.getenv("CHROMA_SHARDING", "user").lower()
+CHROMA_SHARD_BUCKETS = int(os.getenv("CHROMA_SHARD_BUCKETS", "64"))
+# Chỉ VACUUM khi tỉ lệ trang trống trong chroma.sqlite3 vượt ngưỡng này
+CHROMA_VACUUM_MIN_FREE_RATIO = float(os.getenv("CHROMA_VACUUM_MIN_FREE_RATIO", "0.2"))
+
+SHARDING_LAYOUTS = ("user", "chat", "hashed")
+
+
+def user_store_dir(user_id: str) -> str:
+    return os.path.join(CHROMA_ROOT, user_id)
+
+
+def shard_dir(user_id: str, chat_history_id: str, layout: str = CHROMA_SHARDING) -> str:
+    """Directory a new chat's Chroma store goes to under the given layout"""
+    if layout == "chat":
+        return os.path.join(CHROMA_ROOT, user_id, "chats", chat_history_id)
+    if layout == "hashed":
+        bucket = int(hashlib.sha1(f"{user_id}:{chat_history_id}".encode()).hexdigest(), 16) % CHROMA_SHARD_BUCKETS
+        return os.path.join(CHROMA_ROOT, "shards", f"{bucket:03d}")
+    if layout == "user":
+        return user_store_dir(user_id)
+    raise ValueError(f"Unknown CHROMA_SHARDING: {layout}")
+
+
+def resolve_store_dir(user_id: str, chat_history_id: str) -> str:
+    """Where this chat's vectors live.
+
+    Chats keep the directory they were first written to (recorded in the file catalog),
+    so changing CHROMA_SHARDING only affects new chats. Chats written before the
+    catalog recorded directories live in the per-user directory.
+    """
+    # Chat cũ chỉ có chat_<id>_files.json: import vào catalog trước khi dựa vào has_files
+    file_catalog.migrate_legacy_json(user_id, chat_history_id)
+    registered = file_catalog.store_dir(chat_history_id)
+    if registered:
+        return registered
+    if CHROMA_SHARDING != "user" and file_catalog.has_files(chat_history_id):
+        return user_store_dir(user_id)
+    return shard_dir(user_id, chat_history_id)
+
+
+def collection_name(user_id: str, chat_history_id: str) -> str:
+    """Chroma collection holding a chat's chunks for the configured embedding backend"""
+    # Sử dụng 1 collection cho tất cả files của user trong chat này
+    name = f"{user_id}_{chat_history_id}"
+    if EMBEDDING_BACKEND != "jina":
+        # Vector của backend khác có số chiều khác, không trộn vào collection cũ
+        name = f"{name}_{EMBEDDING_BACKEND}"
+    if EMBEDDING_DIMENSIONS < EMBEDDING_FULL_DIMENSIONS:
+        name = f"{name}_d{EMBEDDING_DIMENSIONS}"
+    return name
+
+
+def writer_lock_path(persist_dir: str, collection_name: str) -> str:
+    """File lock held by a collection's writer while it commits"""
+    return os.path.join(persist_dir, f".{collection_name}.write.lock")
+
+
+def is_dedicated_dir(user_id: str, chat_history_id: str, persist_dir: str) -> bool:
+    """True when the directory holds only this chat (can be removed as a whole)"""
+    return os.path.normpath(persist_dir) == os.path.normpath(shard_dir(user_id, chat_history_id, "chat"))
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def remove_tree(path: str) -> int:
+    """Delete a directory, returning the bytes freed"""
+    if not os.path.isdir(path):
+        return 0
+    size = directory_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    return size
+
+
+def vacuum_store(persist_dir: str, min_free_ratio: float = CHROMA_VACUUM_MIN_FREE_RATIO) -> Optional[Dict[str, int]]:
+    """Compact chroma.sqlite3 after deletions; None when there was nothing worth reclaiming"""
+    db_path = os.path.join(persist_dir, "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return None
+    with ExitStack() as stack:
+        # Giữ writer lock của mọi collection trong thư mục (theo thứ tự cố định): không commit nào chen vào giữa VACUUM
+        for lock_path in sorted(glob.glob(writer_lock_path(persist_dir, "*"))):
+            stack.enter_context(FileLock(lock_path))
+        conn = sqlite3.connect(db_path, timeout=60)
+        try:
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not page_count or free_pages / page_count < min_free_ratio:
+                return None
+            size_before = os.path.getsize(db_path)
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        size_after = os.path.getsize(db_path)
+    logger.info(f"🧹 Vacuumed {db_path}: {size_before} -> {size_after} bytes")
+    return {"bytes_before": size_before, "bytes_after": size_after, "reclaimed_bytes": size_before - size_after}
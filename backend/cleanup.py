@@ -0,0 +1,511 @@
+import os
+import glob
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+from filelock import FileLock, Timeout
+
+from http_clients import get_supabase
+from artifact_scheduler import artifact_scheduler, PRIORITY_MAINTENANCE
+from file_catalog import file_catalog
+from chroma_layout import CHROMA_ROOT, collection_name, resolve_store_dir, shard_dir, is_dedicated_dir, remove_tree, vacuum_store
+from collection_writer import delete_file_chunks, delete_collection
+from read_cache import read_cache, user_scope, chat_scope
+
+logger = logging.getLogger(__name__)
+
+# Số chunk / object / row xoá mỗi lô (các upload đang chạy được chen vào giữa các lô)
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "500"))
+CLEANUP_DB_PATH = os.getenv("CLEANUP_DB_PATH", "./chroma_store/cleanup.sqlite3")
+# Chu kỳ quét dữ liệu mồ côi (0 = tắt), và thời gian một task dở dang được coi là bị bỏ rơi
+CLEANUP_SWEEP_INTERVAL_S = float(os.getenv("CLEANUP_SWEEP_INTERVAL_S", "21600"))
+CLEANUP_RESUME_AFTER_S = float(os.getenv("CLEANUP_RESUME_AFTER_S", "600"))
+# Dữ liệu mới hơn ngưỡng này không bị coi là mồ côi (row catalog có thể có trước row files trên Supabase)
+CLEANUP_ORPHAN_GRACE_S = float(os.getenv("CLEANUP_ORPHAN_GRACE_S", "3600"))
+# Quá tỉ lệ này bị coi là mồ côi thì nghi Supabase trả kết quả sai: bỏ qua, không xoá gì
+CLEANUP_MAX_ORPHAN_RATIO = float(os.getenv("CLEANUP_MAX_ORPHAN_RATIO", "0.5"))
+# Task đã xong được giữ lại bao lâu để báo cáo
+CLEANUP_KEEP_FINISHED_S = float(os.getenv("CLEANUP_KEEP_FINISHED_S", str(7 * 24 * 3600)))
+
+STORAGE_BUCKET = "usersfiles"
+# Supabase giới hạn độ dài URL: lọc `in_` theo lô nhỏ
+SUPABASE_FILTER_BATCH = 100
+
+FILE_STEPS = ("vectors", "chunk_logs", "catalog", "storage", "caches", "compact")
+CHAT_STEPS = ("vectors", "chunk_logs", "catalog", "storage", "rows", "caches", "directory")
+# Chat do sweeper phát hiện: chỉ xoá dữ liệu local, không xoá object Storage hay row Supabase
+SWEEP_CHAT_STEPS = ("vectors", "chunk_logs", "catalog", "caches", "directory")
+TASK_STEPS = {"cleanup_file": FILE_STEPS, "cleanup_chat": CHAT_STEPS, "sweep_chat": SWEEP_CHAT_STEPS}
+# Tỉ lệ mồ côi chỉ được kiểm tra khi có đủ số mục để so sánh
+ORPHAN_RATIO_MIN_CHECKED = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cleanup_tasks (
+    task_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    chat_history_id TEXT NOT NULL,
+    file_id TEXT NOT NULL DEFAULT '',
+    persist_dir TEXT NOT NULL,
+    storage_path TEXT,
+    steps_done TEXT NOT NULL DEFAULT '[]',
+    reclaimed_bytes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cleanup_unfinished ON cleanup_tasks (finished_at, updated_at);
+"""
+
+
+def _task_id(kind: str, chat_history_id: str, file_id: str) -> str:
+    # Trùng với job id của artifact_scheduler
+    return f"{kind}:{chat_history_id}:{file_id}"
+
+
+class CleanupJournal:
+    """SQLite record of cascade deletes and the steps each one has completed"""
+
+    def __init__(self, db_path: str = CLEANUP_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                        init = sqlite3.connect(self.db_path, timeout=30)
+                        init.execute("PRAGMA journal_mode=WAL")
+                        init.executescript(_SCHEMA)
+                        init.close()
+                        self._initialized = True
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create(self, task: Dict[str, Any]):
+        """Record a task; an unfinished task with the same id is kept (and its progress)"""
+        now = time.time()
+        self._connect().execute(
+            """
+            INSERT INTO cleanup_tasks (task_id, kind, user_id, chat_history_id, file_id, persist_dir, storage_path, created_at, updated_at)
+            VALUES (:task_id, :kind, :user_id, :chat_history_id, :file_id, :persist_dir, :storage_path, :now, :now)
+            ON CONFLICT (task_id) DO UPDATE SET
+                persist_dir = excluded.persist_dir,
+                storage_path = COALESCE(excluded.storage_path, cleanup_tasks.storage_path),
+                steps_done = CASE WHEN cleanup_tasks.finished_at IS NULL THEN cleanup_tasks.steps_done ELSE '[]' END,
+                reclaimed_bytes = CASE WHEN cleanup_tasks.finished_at IS NULL THEN cleanup_tasks.reclaimed_bytes ELSE 0 END,
+                finished_at = NULL,
+                error = NULL,
+                updated_at = excluded.updated_at
+            """,
+            {**task, "now": now},
+        )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM cleanup_tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = dict(row)
+        task["steps_done"] = json.loads(task["steps_done"])
+        return task
+
+    def step_done(self, task_id: str, steps_done: List[str], reclaimed_bytes: int):
+        self._connect().execute(
+            "UPDATE cleanup_tasks SET steps_done = ?, reclaimed_bytes = reclaimed_bytes + ?, updated_at = ? WHERE task_id = ?",
+            (json.dumps(steps_done), reclaimed_bytes, time.time(), task_id),
+        )
+
+    def finish(self, task_id: str, error: Optional[str] = None):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE cleanup_tasks SET finished_at = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (None if error else now, error, now, task_id),
+        )
+
+    def stalled(self, older_than: float) -> List[Dict[str, Any]]:
+        """Unfinished tasks nobody has worked on since `older_than`"""
+        rows = self._connect().execute(
+            "SELECT task_id, kind, user_id, chat_history_id, file_id FROM cleanup_tasks "
+            "WHERE finished_at IS NULL AND updated_at < ?",
+            (older_than,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self, since: float) -> Dict[str, int]:
+        row = self._connect().execute(
+            """
+            SELECT
+                COALESCE(SUM(finished_at >= :since), 0) AS finished,
+                COALESCE(SUM(CASE WHEN finished_at >= :since THEN reclaimed_bytes ELSE 0 END), 0) AS reclaimed_bytes,
+                COALESCE(SUM(finished_at IS NULL), 0) AS pending,
+                COALESCE(SUM(finished_at IS NULL AND error IS NOT NULL), 0) AS failing
+            FROM cleanup_tasks
+            """,
+            {"since": since},
+        ).fetchone()
+        return dict(row)
+
+    def prune(self, finished_before: float) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM cleanup_tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,)
+        )
+        return cursor.rowcount
+
+
+class CleanupPipeline:
+    """Asynchronous, resumable cascade delete for chats and files.
+
+    Deleting a chat or file only removes what the user sees synchronously; everything
+    derived from it (Chroma chunks, sidecar vectors, catalog rows, chunk logs, storage
+    objects, Supabase rows, cached listings) is removed by a persisted maintenance job
+    on the artifact scheduler. Every task runs a fixed list of idempotent steps and
+    records each completed step, so a task interrupted by a crash or an error continues
+    where it stopped. A periodic sweeper queues cleanup of local data (vectors, chunk
+    logs, catalog, directories) whose chat or file no longer exists in Supabase and
+    reports the space reclaimed since the last sweep. The sweeper never deletes Supabase
+    rows or storage objects, skips data younger than CLEANUP_ORPHAN_GRACE_S, and queues
+    nothing when a lookup fails or reports more than CLEANUP_MAX_ORPHAN_RATIO missing.
+    """
+
+    def __init__(
+        self,
+        journal: Optional[CleanupJournal] = None,
+        batch_size: int = CLEANUP_BATCH_SIZE,
+        sweep_interval: float = CLEANUP_SWEEP_INTERVAL_S,
+    ):
+        self.journal = journal or CleanupJournal()
+        self.batch_size = max(1, batch_size)
+        self.sweep_interval = sweep_interval
+        self._sweep_lock = FileLock(f"{self.journal.db_path}.sweep.lock")
+        self._sweeper: Optional[threading.Thread] = None
+        self._last_sweep_at = time.time()
+        self.last_report: Dict[str, Any] = {}
+
+    # ---------- public API ----------
+
+    def delete_file(self, user_id: str, chat_history_id: str, file_id: str, storage_path: Optional[str] = None) -> bool:
+        """Queue removal of everything derived from a file"""
+        return self._submit("cleanup_file", user_id, chat_history_id, file_id, storage_path)
+
+    def delete_chat(self, user_id: str, chat_history_id: str) -> bool:
+        """Queue removal of everything stored for a chat"""
+        return self._submit("cleanup_chat", user_id, chat_history_id, "", None)
+
+    def start(self):
+        """Start the periodic orphan sweeper (idempotent)"""
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="cleanup-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def run(self, kind: str, user_id: str, chat_history_id: str, file_id: str):
+        """Run (or resume) a task's remaining steps; called by the artifact scheduler"""
+        task_id = _task_id(kind, chat_history_id, file_id)
+        task = self.journal.get(task_id)
+        if task is None:
+            # Job được khôi phục nhưng journal đã bị xoá: làm lại từ đầu
+            self.journal.create(self._new_task(kind, user_id, chat_history_id, file_id, None))
+            task = self.journal.get(task_id)
+        if task["finished_at"] is not None:
+            return
+
+        steps = TASK_STEPS[kind]
+        prefix = "cleanup_file" if kind == "cleanup_file" else "cleanup_chat"
+        done = list(task["steps_done"])
+        started = time.time()
+        try:
+            for step in steps:
+                if step in done:
+                    continue
+                reclaimed = getattr(self, f"_{prefix}_{step}")(task) or 0
+                done.append(step)
+                self.journal.step_done(task_id, done, reclaimed)
+        except Exception as e:
+            self.journal.finish(task_id, error=f"{step}: {e}")
+            raise
+        self.journal.finish(task_id)
+        reclaimed_total = self.journal.get(task_id)["reclaimed_bytes"]
+        logger.info(f"🧹 {task_id} cleaned up in {time.time() - started:.1f}s ({reclaimed_total} bytes reclaimed)")
+
+    def sweep(self) -> Optional[Dict[str, Any]]:
+        """Resume stalled tasks and queue cleanup for orphaned chats/files; None if another process is sweeping"""
+        try:
+            with self._sweep_lock.acquire(timeout=0):
+                return self._sweep()
+        except Timeout:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.journal.summary(since=0), "last_sweep": self.last_report}
+
+    # ---------- file steps ----------
+
+    def _cleanup_file_vectors(self, task: Dict[str, Any]) -> int:
+        if not os.path.exists(task["persist_dir"]):
+            return 0
+        # Chỉ bước này (và bước vectors của chat) mới mở Chroma, qua collection writer
+        collection = collection_name(task["user_id"], task["chat_history_id"])
+        removed = 0
+        while True:
+            batch = delete_file_chunks(task["persist_dir"], collection, task["file_id"], limit=self.batch_size).result()
+            removed += batch
+            if batch < self.batch_size:
+                break
+        if removed:
+            logger.info(f"🧹 Removed {removed} chunks of file {task['file_id']}")
+        return 0
+
+    def _cleanup_file_chunk_logs(self, task: Dict[str, Any]) -> int:
+        return _remove_chunk_logs(task["persist_dir"], [task["file_id"]])
+
+    def _cleanup_file_catalog(self, task: Dict[str, Any]) -> int:
+        file_catalog.remove(task["chat_history_id"], task["file_id"])
+        return 0
+
+    def _cleanup_file_storage(self, task: Dict[str, Any]) -> int:
+        if not task["storage_path"]:
+            return 0
+        removed = get_supabase().storage.from_(STORAGE_BUCKET).remove([task["storage_path"]])
+        return sum(_object_size(item) for item in removed or [])
+
+    def _cleanup_file_caches(self, task: Dict[str, Any]) -> int:
+        read_cache.invalidate_chat(task["chat_history_id"])
+        return 0
+
+    def _cleanup_file_compact(self, task: Dict[str, Any]) -> int:
+        if not os.path.exists(task["persist_dir"]):
+            return 0
+        return (vacuum_store(task["persist_dir"]) or {}).get("reclaimed_bytes", 0)
+
+    # ---------- chat steps ----------
+
+    def _cleanup_chat_vectors(self, task: Dict[str, Any]) -> int:
+        if not os.path.exists(task["persist_dir"]):
+            return 0
+        collection = collection_name(task["user_id"], task["chat_history_id"])
+        dropped = delete_collection(task["persist_dir"], collection).result()
+        if dropped:
+            logger.info(f"🧹 Dropped {dropped} chunks of chat {task['chat_history_id']}")
+        return 0
+
+    def _cleanup_chat_chunk_logs(self, task: Dict[str, Any]) -> int:
+        file_ids = list(file_catalog.list_files(task["chat_history_id"]).keys())
+        return _remove_chunk_logs(task["persist_dir"], file_ids)
+
+    def _cleanup_chat_catalog(self, task: Dict[str, Any]) -> int:
+        file_catalog.forget_chat(task["chat_history_id"])
+        return 0
+
+    def _cleanup_chat_storage(self, task: Dict[str, Any]) -> int:
+        bucket = get_supabase().storage.from_(STORAGE_BUCKET)
+        folder = f"{task['user_id']}/{task['chat_history_id']}"
+        reclaimed = 0
+        while True:
+            # Luôn đọc từ offset 0: lô trước đã bị xoá
+            objects = [item for item in bucket.list(folder, {"limit": self.batch_size, "offset": 0}) if item.get("id")]
+            if not objects:
+                return reclaimed
+            bucket.remove([f"{folder}/{item['name']}" for item in objects])
+            reclaimed += sum(_object_size(item) for item in objects)
+
+    def _cleanup_chat_rows(self, task: Dict[str, Any]) -> int:
+        supabase = get_supabase()
+        for table, key in (("chats", "chat_id"), ("mindmapnotes", "mindmap_note_id"), ("files", "file_id")):
+            while True:
+                rows = (supabase.table(table).select(key)
+                        .eq("chat_history_id", task["chat_history_id"])
+                        .limit(self.batch_size).execute().data) or []
+                if not rows:
+                    break
+                supabase.table(table).delete().in_(key, [row[key] for row in rows]).execute()
+        return 0
+
+    def _cleanup_chat_caches(self, task: Dict[str, Any]) -> int:
+        read_cache.invalidate(user_scope(task["user_id"]), chat_scope(task["chat_history_id"]))
+        return 0
+
+    def _cleanup_chat_directory(self, task: Dict[str, Any]) -> int:
+        if is_dedicated_dir(task["user_id"], task["chat_history_id"], task["persist_dir"]):
+            return remove_tree(task["persist_dir"])
+        if not os.path.exists(task["persist_dir"]):
+            return 0
+        # Thư mục dùng chung với chat khác: chỉ compact lại SQLite
+        return (vacuum_store(task["persist_dir"], min_free_ratio=0) or {}).get("reclaimed_bytes", 0)
+
+    # ---------- internals ----------
+
+    def _new_task(self, kind: str, user_id: str, chat_history_id: str, file_id: str, storage_path: Optional[str]) -> Dict[str, Any]:
+        return {
+            "task_id": _task_id(kind, chat_history_id, file_id),
+            "kind": kind,
+            "user_id": user_id,
+            "chat_history_id": chat_history_id,
+            "file_id": file_id,
+            # Ghi lại thư mục ngay: bước catalog xoá bản đăng ký thư mục của chat
+            "persist_dir": resolve_store_dir(user_id, chat_history_id),
+            "storage_path": storage_path,
+        }
+
+    def _submit(self, kind: str, user_id: str, chat_history_id: str, file_id: str, storage_path: Optional[str]) -> bool:
+        task = self.journal.get(_task_id(kind, chat_history_id, file_id))
+        if task is None or task["finished_at"] is not None:
+            self.journal.create(self._new_task(kind, user_id, chat_history_id, file_id, storage_path))
+        return artifact_scheduler.submit(kind, user_id, chat_history_id, file_id)
+
+    def _sweep(self) -> Dict[str, Any]:
+        started = time.time()
+        resumed = 0
+        for task in self.journal.stalled(older_than=started - CLEANUP_RESUME_AFTER_S):
+            resumed += artifact_scheduler.submit(task["kind"], task["user_id"], task["chat_history_id"], task["file_id"])
+
+        chats = file_catalog.list_chats()
+        chats.update({chat_history_id: user_id for chat_history_id, user_id in _chat_dirs_on_disk().items() if chat_history_id not in chats})
+        grace_cutoff = started - CLEANUP_ORPHAN_GRACE_S
+        supabase = get_supabase()
+
+        chat_ids = list(chats)
+        live_chats = _existing_ids(lambda: supabase.table("chat_histories").select("chat_history_id"), "chat_history_id", chat_ids)
+
+        orphan_chats = 0
+        candidates = [chat_history_id for chat_history_id in chat_ids if chat_history_id not in live_chats]
+        if _suspicious("chats", len(candidates), len(chat_ids)):
+            candidates = []
+        for chat_history_id in candidates:
+            if _chat_last_activity(chats[chat_history_id], chat_history_id) > grace_cutoff:
+                continue
+            orphan_chats += self._submit("sweep_chat", chats[chat_history_id], chat_history_id, "", None)
+
+        orphan_files = 0
+        for chat_history_id in live_chats:
+            files = file_catalog.list_files(chat_history_id)
+            file_ids = list(files)
+            live_files = _existing_ids(
+                lambda: supabase.table("files").select("file_id").eq("chat_history_id", chat_history_id), "file_id", file_ids,
+            )
+            candidates = [file_id for file_id in file_ids if file_id not in live_files]
+            if _suspicious(f"files of chat {chat_history_id}", len(candidates), len(file_ids)):
+                continue
+            for file_id in candidates:
+                if (files[file_id]["added_at"] or 0) > grace_cutoff:
+                    continue
+                # Không có storage_path: chỉ xoá vectors/catalog/chunk log, không đụng Storage
+                orphan_files += self.delete_file(chats[chat_history_id], chat_history_id, file_id)
+
+        summary = self.journal.summary(since=self._last_sweep_at)
+        pruned = self.journal.prune(finished_before=started - CLEANUP_KEEP_FINISHED_S)
+        self._last_sweep_at = started
+        self.last_report = {
+            "swept_at": started,
+            "duration_s": round(time.time() - started, 3),
+            "chats_checked": len(chat_ids),
+            "orphan_chats_queued": orphan_chats,
+            "orphan_files_queued": orphan_files,
+            "stalled_tasks_resumed": resumed,
+            "tasks_finished": summary["finished"],
+            "reclaimed_bytes": summary["reclaimed_bytes"],
+            "tasks_pending": summary["pending"],
+            "tasks_pruned": pruned,
+        }
+        logger.info(
+            f"🧹 Orphan sweep: {orphan_chats} chats and {orphan_files} files queued, {resumed} tasks resumed; "
+            f"{summary['finished']} tasks reclaimed {summary['reclaimed_bytes']} bytes since last sweep"
+        )
+        return self.last_report
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"❌ Orphan sweep failed: {e}")
+
+
+def _remove_chunk_logs(persist_dir: str, file_ids: List[str]) -> int:
+    chunk_log_dir = os.path.join(persist_dir, "chunk_logs")
+    reclaimed = 0
+    for file_id in file_ids:
+        for path in glob.glob(os.path.join(chunk_log_dir, f"{file_id}_*")):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                reclaimed += size
+            except FileNotFoundError:
+                pass
+    return reclaimed
+
+
+def _object_size(item: Dict[str, Any]) -> int:
+    return int(((item or {}).get("metadata") or {}).get("size") or 0)
+
+
+def _existing_ids(make_query, key: str, ids: List[str]) -> set:
+    """Which of ids Supabase has; raises instead of returning a partial answer"""
+    found = set()
+    for i in range(0, len(ids), SUPABASE_FILTER_BATCH):
+        response = make_query().in_(key, ids[i:i + SUPABASE_FILTER_BATCH]).execute()
+        if response.data is None:
+            raise RuntimeError(f"Supabase lookup of {key} returned no data")
+        found.update(row[key] for row in response.data)
+    return found
+
+
+def _suspicious(what: str, orphans: int, checked: int) -> bool:
+    # Supabase trả rỗng (sai project, lỗi RLS...) sẽ làm mọi thứ trông như mồ côi
+    if checked >= ORPHAN_RATIO_MIN_CHECKED and orphans > CLEANUP_MAX_ORPHAN_RATIO * checked:
+        logger.warning(f"⚠️ Orphan sweep: {orphans}/{checked} {what} missing in Supabase, skipping as suspicious")
+        return True
+    return False
+
+
+def _chat_last_activity(user_id: str, chat_history_id: str) -> float:
+    """Newest catalog row or dedicated store write of a chat (0 if none)"""
+    latest = max((info["added_at"] or 0 for info in file_catalog.list_files(chat_history_id).values()), default=0)
+    try:
+        latest = max(latest, os.path.getmtime(shard_dir(user_id, chat_history_id, "chat")))
+    except OSError:
+        pass
+    return latest
+
+
+def _chat_dirs_on_disk() -> Dict[str, str]:
+    """chat_history_id -> user_id of per-chat store directories (CHROMA_SHARDING=chat)"""
+    found = {}
+    for path in glob.glob(os.path.join(CHROMA_ROOT, "*", "chats", "*")):
+        if os.path.isdir(path):
+            user_id = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            found[os.path.basename(path)] = user_id
+    return found
+
+
+cleanup_pipeline = CleanupPipeline()
+
+
+def run_cleanup_file_job(user_id: str, chat_history_id: str, file_id: str):
+    cleanup_pipeline.run("cleanup_file", user_id, chat_history_id, file_id)
+
+
+def run_cleanup_chat_job(user_id: str, chat_history_id: str, file_id: str):
+    cleanup_pipeline.run("cleanup_chat", user_id, chat_history_id, file_id)
+
+
+def run_sweep_chat_job(user_id: str, chat_history_id: str, file_id: str):
+    cleanup_pipeline.run("sweep_chat", user_id, chat_history_id, file_id)
+
+
+artifact_scheduler.register("cleanup_file", run_cleanup_file_job, PRIORITY_MAINTENANCE)
+artifact_scheduler.register("cleanup_chat", run_cleanup_chat_job, PRIORITY_MAINTENANCE)
+artifact_scheduler.register("sweep_chat", run_sweep_chat_job, PRIORITY_MAINTENANCE)
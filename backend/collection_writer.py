@@ -0,0 +1,212 @@
+import os
+import shutil
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from filelock import FileLock
+from langchain_core.documents import Document
+
+from chroma_layout import writer_lock_path
+
+from vector_index import (
+    get_sidecar, needs_sidecar, truncate_vectors,
+    EMBEDDING_DIMENSIONS, EMBEDDING_FULL_DIMENSIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Số chunk tối đa gộp vào một lần commit, và số chunk mỗi lời gọi upsert của Chroma
+COLLECTION_WRITE_BATCH = int(os.getenv("COLLECTION_WRITE_BATCH", "2000"))
+CHROMA_UPSERT_BATCH = int(os.getenv("CHROMA_UPSERT_BATCH", "500"))
+# Writer không có việc trong khoảng này thì tự dừng thread
+COLLECTION_WRITER_IDLE_S = float(os.getenv("COLLECTION_WRITER_IDLE_S", "60"))
+
+
+def sidecar_dir(persist_dir: str, collection_name: str) -> str:
+    return os.path.join(persist_dir, "vectors", collection_name)
+
+
+class CollectionWriter:
+    """Single writer thread for one Chroma collection.
+
+    Uploads embed their chunks in their own threads and hand the vectors here. The writer
+    drains everything queued, commits it to Chroma (and the vector sidecar) in one batch
+    while holding a file lock, so writers in other worker processes take turns instead of
+    failing on SQLite locks, then resolves each caller's Future.
+    """
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[str, Dict[str, Any], Future]] = []
+        self._closed = False
+        self._store = None
+        self._sidecar = get_sidecar(sidecar_dir(persist_dir, collection_name)) if needs_sidecar() else None
+        os.makedirs(persist_dir, exist_ok=True)
+        self._file_lock = FileLock(writer_lock_path(persist_dir, collection_name))
+        self.commits = 0
+        self.chunks_written = 0
+        threading.Thread(target=self._run, name=f"collection-writer-{collection_name}", daemon=True).start()
+
+    def _submit(self, op: str, **payload) -> Optional[Future]:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                return None
+            self._queue.append((op, payload, future))
+            self._cond.notify()
+        return future
+
+    def _store_handle(self):
+        if self._store is None:
+            # chromadb nặng: chỉ import khi writer thực sự ghi lần đầu
+            from langchain_community.vectorstores import Chroma
+            self._store = Chroma(persist_directory=self.persist_dir, collection_name=self.collection_name)
+        return self._store
+
+    def _take(self) -> List[Tuple[str, Dict[str, Any], Future]]:
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout=COLLECTION_WRITER_IDLE_S)
+            if not self._queue:
+                return []
+            # Gộp các upsert liên tiếp đến khi đủ batch; xoá chạy riêng theo thứ tự
+            batch, rows = [], 0
+            while self._queue:
+                op, payload, future = self._queue[0]
+                if batch and (op != "upsert" or batch[0][0] != "upsert" or rows + len(payload["ids"]) > COLLECTION_WRITE_BATCH):
+                    break
+                batch.append(self._queue.pop(0))
+                rows += len(payload.get("ids", []))
+                if op != "upsert":
+                    break
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                if _retire(self):
+                    return
+                continue
+            try:
+                with self._file_lock:
+                    if batch[0][0] == "upsert":
+                        results = self._commit_upserts([payload for _, payload, _ in batch])
+                    else:
+                        op, payload, _ = batch[0]
+                        results = [self._apply(op, payload)]
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"❌ Error writing to collection {self.collection_name}: {e}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+    def _commit_upserts(self, payloads: List[Dict[str, Any]]) -> List[int]:
+        ids = [chunk_id for payload in payloads for chunk_id in payload["ids"]]
+        docs = [doc for payload in payloads for doc in payload["docs"]]
+        vectors = [vector for payload in payloads for vector in payload["vectors"]]
+
+        index_vectors = vectors
+        if EMBEDDING_DIMENSIONS < EMBEDDING_FULL_DIMENSIONS:
+            index_vectors = truncate_vectors(np.asarray(vectors), EMBEDDING_DIMENSIONS).tolist()
+
+        collection = self._store_handle()._collection
+        for i in range(0, len(ids), CHROMA_UPSERT_BATCH):
+            collection.upsert(
+                ids=ids[i:i + CHROMA_UPSERT_BATCH],
+                embeddings=index_vectors[i:i + CHROMA_UPSERT_BATCH],
+                metadatas=[doc.metadata for doc in docs[i:i + CHROMA_UPSERT_BATCH]],
+                documents=[doc.page_content for doc in docs[i:i + CHROMA_UPSERT_BATCH]],
+            )
+        if self._sidecar is not None:
+            self._sidecar.add(ids, [doc.metadata.get("file_id") for doc in docs], vectors)
+
+        self.commits += 1
+        self.chunks_written += len(ids)
+        if len(payloads) > 1:
+            logger.info(f"✅ Committed {len(ids)} chunks from {len(payloads)} uploads to {self.collection_name} in one batch")
+        return [len(payload["ids"]) for payload in payloads]
+
+    def _apply(self, op: str, payload: Dict[str, Any]) -> int:
+        if op == "delete_file":
+            store = self._store_handle()
+            limit = payload.get("limit")
+            existing = store.get(where={"file_id": payload["file_id"]}, limit=limit, include=[])
+            if existing["ids"]:
+                store.delete(ids=existing["ids"])
+            # Xoá theo lô: sidecar chỉ cần dọn một lần ở lô cuối
+            if self._sidecar is not None and (limit is None or len(existing["ids"]) < limit):
+                self._sidecar.remove(file_id=payload["file_id"])
+            return len(existing["ids"])
+
+        if op == "sidecar_add":
+            if self._sidecar is not None and self._sidecar.count() == 0:
+                self._sidecar.add(payload["ids"], payload["file_ids"], payload["vectors"])
+            return len(payload["ids"])
+
+        if op == "drop_collection":
+            store = self._store_handle()
+            count = store._collection.count()
+            store.delete_collection()
+            self._store = None
+            directory = sidecar_dir(self.persist_dir, self.collection_name)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+            return count
+
+        raise ValueError(f"Unknown collection write op: {op}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"queued": len(self._queue), "commits": self.commits, "chunks_written": self.chunks_written}
+
+
+_writers: Dict[Tuple[str, str], CollectionWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def _retire(writer: CollectionWriter) -> bool:
+    """Stop an idle writer; False if work arrived in the meantime"""
+    with _writers_lock:
+        with writer._cond:
+            if writer._queue:
+                return False
+            writer._closed = True
+        if _writers.get((writer.persist_dir, writer.collection_name)) is writer:
+            del _writers[(writer.persist_dir, writer.collection_name)]
+        return True
+
+
+def submit_write(persist_dir: str, collection_name: str, op: str, **payload) -> Future:
+    """Queue a write for the collection's writer thread (started on demand)"""
+    key = (persist_dir, collection_name)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = CollectionWriter(persist_dir, collection_name)
+        return writer._submit(op, **payload)
+
+
+def upsert_chunks(persist_dir: str, collection_name: str, ids: List[str], docs: List[Document], vectors: List[List[float]]) -> Future:
+    return submit_write(persist_dir, collection_name, "upsert", ids=ids, docs=docs, vectors=vectors)
+
+
+def delete_file_chunks(persist_dir: str, collection_name: str, file_id: str, limit: Optional[int] = None) -> Future:
+    """Delete a file's chunks (at most `limit` per call); the Future resolves to the number removed"""
+    return submit_write(persist_dir, collection_name, "delete_file", file_id=file_id, limit=limit)
+
+
+def delete_collection(persist_dir: str, collection_name: str) -> Future:
+    return submit_write(persist_dir, collection_name, "drop_collection")
+
+
+def writer_stats() -> Dict[str, Any]:
+    with _writers_lock:
+        writers = list(_writers.values())
+    return {writer.collection_name: writer.stats() for writer in writers}
@@ -0,0 +1,183 @@
+import os
+import math
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Số token (ước lượng theo tokenizer của Gemini) tối đa dành cho phần context trong prompt chat
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Hệ số an toàn: token Gemini ≈ token gpt2 × hệ số. Hiệu chỉnh bằng cách so chat.prompt_tokens
+# với prompt_token_count Gemini trả về trong usage_metadata
+CONTEXT_TOKEN_SAFETY_MARGIN = float(os.getenv("CONTEXT_TOKEN_SAFETY_MARGIN", "1.2"))
+# Không chèn đoạn bị cắt nếu phần còn lại của budget quá nhỏ
+MIN_SEGMENT_TOKENS = 50
+# Độ dài tối đa (ký tự) của phần overlap giữa hai chunk liên tiếp cần dò
+MAX_OVERLAP_CHARS = 4000
+MIN_OVERLAP_CHARS = 20
+
+SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """Approximate Gemini token counts.
+
+    Gemini's tokenizer is not available offline, and calling count_tokens for every
+    segment would add a network round trip per chat. Counts are the gpt2 tiktoken count
+    the chunker uses (or ~4 chars/token without tiktoken) multiplied by `safety_margin`,
+    so the budget errs on the side of a shorter context.
+    """
+
+    def __init__(self, encoding_name: str = "gpt2", safety_margin: float = CONTEXT_TOKEN_SAFETY_MARGIN):
+        self.safety_margin = max(safety_margin, 0.1)
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f"⚠️ tiktoken unavailable, estimating tokens from length: {e}")
+            self._encoding = None
+
+    def _raw_count(self, text: str) -> int:
+        if self._encoding is None:
+            return (len(text) + 3) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count(self, text: str) -> int:
+        return math.ceil(self._raw_count(text) * self.safety_margin)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        max_tokens = int(max_tokens / self.safety_margin)
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is None:
+            return text[:max_tokens * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self._encoding.decode(tokens[:max_tokens])
+
+
+def _merge_overlap(first: str, second: str) -> str:
+    """Join two consecutive chunks, dropping the text the splitter repeated in both"""
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a prompt context of about `token_budget` Gemini tokens.
+
+    The budget is approximate: token counts come from TokenCounter's estimate, not from
+    Gemini's tokenizer.
+
+    Chunks are deduplicated (same chunk or text contained in another chunk), consecutive
+    chunks of the same file are merged into one segment without their overlap, and
+    segments are emitted in order of their best retrieval rank until the budget is full.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, counter: Optional[TokenCounter] = None):
+        self.token_budget = token_budget
+        self.counter = counter or TokenCounter()
+
+    def _dedupe(self, docs: List[Any]) -> List[Dict[str, Any]]:
+        items = []
+        seen_keys = set()
+        for rank, doc in enumerate(docs):
+            text = doc.page_content.strip()
+            file_id = doc.metadata.get('file_id', 'unknown')
+            chunk_id = doc.metadata.get('chunk_id')
+            key = (file_id, chunk_id) if chunk_id is not None else (file_id, text)
+            if not text or key in seen_keys:
+                continue
+            seen_keys.add(key)
+            items.append({
+                "rank": rank,
+                "file_id": file_id,
+                "filename": doc.metadata.get('filename', 'Unknown File'),
+                "chunk_id": chunk_id,
+                "text": text,
+            })
+
+        # Bỏ chunk có nội dung nằm trọn trong một chunk khác (xếp hạng cao hơn được giữ khi trùng hệt)
+        kept = []
+        for item in items:
+            contained = any(
+                other is not item
+                and len(other["text"]) >= len(item["text"])
+                and item["text"] in other["text"]
+                and (len(other["text"]) > len(item["text"]) or other["rank"] < item["rank"])
+                for other in items
+            )
+            if not contained:
+                kept.append(item)
+        return kept
+
+    def _merge_adjacent(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        by_file: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            by_file.setdefault(item["file_id"], []).append(item)
+
+        segments = []
+        for file_items in by_file.values():
+            with_ids = sorted((i for i in file_items if isinstance(i["chunk_id"], int)), key=lambda i: i["chunk_id"])
+            without_ids = [i for i in file_items if not isinstance(i["chunk_id"], int)]
+
+            current = None
+            for item in with_ids:
+                if current is not None and item["chunk_id"] == current["last_chunk_id"] + 1:
+                    current["text"] = _merge_overlap(current["text"], item["text"])
+                    current["last_chunk_id"] = item["chunk_id"]
+                    current["rank"] = min(current["rank"], item["rank"])
+                    current["chunks"] += 1
+                    continue
+                current = dict(item, last_chunk_id=item["chunk_id"], chunks=1)
+                segments.append(current)
+
+            segments.extend(dict(item, last_chunk_id=None, chunks=1) for item in without_ids)
+
+        segments.sort(key=lambda segment: segment["rank"])
+        return segments
+
+    def build(self, docs: List[Any]) -> Dict[str, Any]:
+        """Return {"context", "context_tokens", "chunks_used", "segments", ...} for the given ranked docs"""
+        segments = self._merge_adjacent(self._dedupe(docs))
+        separator_tokens = self.counter.count(SEPARATOR)
+
+        parts = []
+        used_tokens = 0
+        chunks_used = 0
+        for segment in segments:
+            text = f"[From {segment['filename']}]: {segment['text']}"
+            cost = self.counter.count(text) + (separator_tokens if parts else 0)
+            remaining = self.token_budget - used_tokens
+
+            if cost <= remaining:
+                parts.append(text)
+                used_tokens += cost
+                chunks_used += segment["chunks"]
+                continue
+
+            # Đoạn không vừa: cắt cho đầy budget rồi dừng
+            room = remaining - (separator_tokens if parts else 0)
+            if room >= MIN_SEGMENT_TOKENS:
+                parts.append(self.counter.truncate(text, room))
+                chunks_used += segment["chunks"]
+            break
+
+        context = SEPARATOR.join(parts)
+        context_tokens = self.counter.count(context)
+        # BPE ở chỗ nối có thể lệch vài token so với tổng từng phần
+        if context_tokens > self.token_budget:
+            context = self.counter.truncate(context, self.token_budget)
+            context_tokens = self.counter.count(context)
+
+        return {
+            "context": context,
+            "context_tokens": context_tokens,
+            "token_budget": self.token_budget,
+            "chunks_retrieved": len(docs),
+            "chunks_used": chunks_used,
+            "segments": len(parts),
+        }
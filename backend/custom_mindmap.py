@@ -2,12 +2,15 @@ import dotenv
 import os
 import re
 from typing import List, Tuple
-import google.generativeai as genai
+from llm_client import llm_client, configure_genai, LLM_PRIORITY_INTERACTIVE, LLM_INTERACTIVE_DEADLINE
 
 dotenv.load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY_MINDMAP")
 
-genai.configure(api_key=API_KEY)
+configure_genai(API_KEY)
+
+# Tăng khi thay đổi prompt để các kết quả cũ trong generation cache không còn được dùng
+PROMPT_VERSION = "1"
 
 def generate_dynamic_system_prompt(
     content: str,
@@ -148,7 +151,7 @@ Return only valid JSON. No additional explanation is needed.
 
 class CustomMindmap:
     def __init__(self, model_name: str = "gemini-2.5-pro"):
-        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
 
     def createCustomMindmap(
         self,
@@ -168,26 +171,15 @@ class CustomMindmap:
 
         full_prompt = system_prompt
 
-        response = ""
-        if stream:
-            in_think_block = False
-            for chunk in self.model.generate_content(full_prompt, stream=True):
-                if chunk.text:
-                    part = chunk.text
-
-                    # Remove think blocks if any
-                    if "<think>" in part:
-                        in_think_block = True
-                        part = part.split("<think>")[0]
-
-                    if "</think>" in part:
-                        in_think_block = False
-                        part = part.split("</think>")[-1]
-
-                    if not in_think_block and part.strip():
-                        response += part
-        else:
-            response = self.model.generate_content(full_prompt).text
-            response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
+        # Người dùng đang chờ: ưu tiên cao, trả lỗi sớm nếu hàng đợi quá dài
+        response = llm_client.generate(
+            self.model_name,
+            full_prompt,
+            priority=LLM_PRIORITY_INTERACTIVE,
+            deadline_s=LLM_INTERACTIVE_DEADLINE,
+            stream=stream,
+        )
+        # Loại bỏ think blocks nếu có
+        response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
 
         return response.strip()
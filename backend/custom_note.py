@@ -2,12 +2,15 @@ import dotenv
 import os
 import re
 from typing import List, Tuple
-import google.generativeai as genai
+from llm_client import llm_client, configure_genai, LLM_PRIORITY_INTERACTIVE, LLM_INTERACTIVE_DEADLINE
 
 dotenv.load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY_NOTE")
 
-genai.configure(api_key=API_KEY)
+configure_genai(API_KEY)
+
+# Tăng khi thay đổi prompt để các kết quả cũ trong generation cache không còn được dùng
+PROMPT_VERSION = "1"
 
 def generate_dynamic_system_prompt(note_target: str, note_language: str, note_detailed_level: str) -> str:
     """
@@ -203,7 +206,7 @@ def generate_dynamic_system_prompt(note_target: str, note_language: str, note_de
 
 class CustomNote:
     def __init__(self, model_name: str = "gemini-2.5-pro"):
-        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
 
     def createCustomNote(self, content: str, note_target: str, note_language: str, note_detailed_level: str, stream: bool = True) -> str:
         """
@@ -235,29 +238,16 @@ CONTENT TO SUMMARIZE:
 
         full_prompt = f"{system_prompt}\n\n{user_requirements}"
         
-        response = ""
-        if stream:
-            response = ""
-            in_think_block = False
-            for chunk in self.model.generate_content(full_prompt, stream=True):
-                if chunk.text:
-                    part = chunk.text
-
-                    # Loại bỏ think blocks nếu có
-                    if "<think>" in part:
-                        in_think_block = True
-                        part = part.split("<think>")[0]
-
-                    if "</think>" in part:
-                        in_think_block = False
-                        part = part.split("</think>")[-1]
-
-                    if not in_think_block and part.strip():
-                        response += part
-        else:
-            response = self.model.generate_content(full_prompt).text
-            # Loại bỏ think blocks
-            response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
+        # Người dùng đang chờ: ưu tiên cao, trả lỗi sớm nếu hàng đợi quá dài
+        response = llm_client.generate(
+            self.model_name,
+            full_prompt,
+            priority=LLM_PRIORITY_INTERACTIVE,
+            deadline_s=LLM_INTERACTIVE_DEADLINE,
+            stream=stream,
+        )
+        # Loại bỏ think blocks nếu có
+        response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
 
         return response.strip()
 
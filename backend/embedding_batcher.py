@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+QUERY_BATCHING = os.getenv("QUERY_BATCHING", "true").lower() == "true"
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+# Số batch được embed cùng lúc: một batch chậm (Jina timeout) không chặn các batch sau
+QUERY_BATCH_WORKERS = int(os.getenv("QUERY_BATCH_WORKERS", "4"))
+
+
+class QueryEmbeddingBatcher:
+    """Collects concurrent query-embedding requests and sends them as one batch.
+
+    The first request opens a window of at most max_wait_ms; every request that arrives
+    in that window (up to max_batch_size) is embedded in the same call to `embed_many`.
+    The collecting thread hands each batch to a pool of `workers` threads, so a slow
+    batch only holds its own callers. Callers get a Future, so both threads and
+    coroutines can wait on the result.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = QUERY_BATCH_MAX_SIZE,
+        max_wait_ms: float = QUERY_BATCH_MAX_WAIT_MS,
+        workers: int = QUERY_BATCH_WORKERS,
+    ):
+        self.embed_many = embed_many
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[str, Future]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="query-embed")
+        self.batches_sent = 0
+        self.queries_embedded = 0
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="query-embed-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((text, future))
+            self._cond.notify()
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _take_batch(self) -> List[Tuple[str, Future]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Chờ thêm request trong cửa sổ ngắn, hoặc đến khi đủ batch
+            window_end = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = window_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            return batch
+
+    def _run(self):
+        while True:
+            self._executor.submit(self._send, self._take_batch())
+
+    def _send(self, batch: List[Tuple[str, Future]]):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self.embed_many(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        with self._cond:
+            self.batches_sent += 1
+            self.queries_embedded += len(texts)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """Wraps an embedding backend so that embed_query goes through a shared micro-batcher"""
+
+    def __init__(self, inner: Embeddings, batcher: Optional[QueryEmbeddingBatcher] = None):
+        self.inner = inner
+        self.batcher = batcher or QueryEmbeddingBatcher(inner.embed_queries)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.batcher.aembed(text)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FILE_CATALOG_PATH = os.getenv("FILE_CATALOG_PATH", "./chroma_store/file_catalog.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    chat_history_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    filename TEXT,
+    file_type TEXT,
+    added_at REAL NOT NULL,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_history_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS idx_files_user_chat ON files (user_id, chat_history_id);
+CREATE INDEX IF NOT EXISTS idx_files_file_id ON files (file_id);
+CREATE TABLE IF NOT EXISTS migrated_chats (
+    chat_history_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS chat_stores (
+    chat_history_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    persist_dir TEXT NOT NULL
+);
+"""
+
+
+class FileCatalog:
+    """SQLite (WAL) registry of the files stored in every chat's vector collection.
+
+    One database is shared by all chats and worker processes. Each thread gets its own
+    connection; writes are single statements (upserts/deletes) so they are atomic, and
+    SQLite's locking plus busy_timeout serialises concurrent writers across processes.
+    Legacy per-chat ``chat_<id>_files.json`` files are imported on first access.
+    """
+
+    def __init__(self, db_path: str = FILE_CATALOG_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._migrated = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                        init = sqlite3.connect(self.db_path, timeout=30)
+                        init.execute("PRAGMA journal_mode=WAL")
+                        init.executescript(_SCHEMA)
+                        init.close()
+                        self._initialized = True
+            # autocommit: mỗi câu lệnh là một transaction
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def migrate_legacy_json(self, user_id: str, chat_history_id: str):
+        """Import ./chroma_store/<user>/chat_<id>_files.json once, then rename it"""
+        if chat_history_id in self._migrated:
+            return
+        conn = self._connect()
+        done = conn.execute("SELECT 1 FROM migrated_chats WHERE chat_history_id = ?", (chat_history_id,)).fetchone()
+        legacy_path = f"./chroma_store/{user_id}/chat_{chat_history_id}_files.json"
+        if not done and os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    files_info = json.load(f)
+                rows = [
+                    (chat_history_id, file_id, user_id, info.get("filename"), info.get("file_type"),
+                     info.get("added_at") or time.time(), info.get("chunk_count") or 0)
+                    for file_id, info in files_info.items()
+                ]
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR IGNORE INTO files (chat_history_id, file_id, user_id, filename, file_type, added_at, chunk_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("INSERT OR IGNORE INTO migrated_chats (chat_history_id) VALUES (?)", (chat_history_id,))
+                conn.execute("COMMIT")
+                os.replace(legacy_path, f"{legacy_path}.migrated")
+                logger.info(f"📂 Migrated {len(rows)} file entries of chat {chat_history_id} to the file catalog")
+            except FileNotFoundError:
+                # Process khác vừa migrate xong
+                pass
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logger.error(f"❌ Error migrating files info: {e}")
+                return
+        self._migrated.add(chat_history_id)
+
+    def upsert(self, user_id: str, chat_history_id: str, file_id: str, filename: str,
+               file_type: Optional[str] = None, chunk_count: int = 0):
+        self._connect().execute(
+            """
+            INSERT INTO files (chat_history_id, file_id, user_id, filename, file_type, added_at, chunk_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_history_id, file_id) DO UPDATE SET
+                filename = excluded.filename,
+                file_type = excluded.file_type,
+                chunk_count = excluded.chunk_count
+            """,
+            (chat_history_id, file_id, user_id, filename, file_type, time.time(), chunk_count),
+        )
+
+    def remove(self, chat_history_id: str, file_id: str) -> bool:
+        cursor = self._connect().execute(
+            "DELETE FROM files WHERE chat_history_id = ? AND file_id = ?", (chat_history_id, file_id)
+        )
+        return cursor.rowcount > 0
+
+    def register_store(self, user_id: str, chat_history_id: str, persist_dir: str):
+        """Remember where a chat's vectors live (first writer wins)"""
+        self._connect().execute(
+            "INSERT OR IGNORE INTO chat_stores (chat_history_id, user_id, persist_dir) VALUES (?, ?, ?)",
+            (chat_history_id, user_id, persist_dir),
+        )
+
+    def store_dir(self, chat_history_id: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT persist_dir FROM chat_stores WHERE chat_history_id = ?", (chat_history_id,)
+        ).fetchone()
+        return row["persist_dir"] if row else None
+
+    def has_files(self, chat_history_id: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM files WHERE chat_history_id = ? LIMIT 1", (chat_history_id,)
+        ).fetchone() is not None
+
+    def list_chats(self) -> Dict[str, str]:
+        """chat_history_id -> user_id of every chat with files or a registered store"""
+        rows = self._connect().execute(
+            "SELECT chat_history_id, user_id FROM files UNION SELECT chat_history_id, user_id FROM chat_stores"
+        ).fetchall()
+        return {row["chat_history_id"]: row["user_id"] for row in rows}
+
+    def forget_chat(self, chat_history_id: str):
+        """Drop every catalog row of a deleted chat"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM files WHERE chat_history_id = ?", (chat_history_id,))
+            conn.execute("DELETE FROM chat_stores WHERE chat_history_id = ?", (chat_history_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, chat_history_id: str, file_id: str) -> Dict:
+        row = self._connect().execute(
+            "SELECT filename, file_type, added_at, chunk_count FROM files WHERE chat_history_id = ? AND file_id = ?",
+            (chat_history_id, file_id),
+        ).fetchone()
+        return dict(row) if row else {}
+
+    def list_files(self, chat_history_id: str) -> Dict[str, Dict]:
+        rows = self._connect().execute(
+            "SELECT file_id, filename, file_type, added_at, chunk_count FROM files "
+            "WHERE chat_history_id = ? ORDER BY added_at",
+            (chat_history_id,),
+        ).fetchall()
+        return {row["file_id"]: {key: row[key] for key in ("filename", "file_type", "added_at", "chunk_count")} for row in rows}
+
+
+file_catalog = FileCatalog()
+
+
+class FileManager:
+    """Quản lý thông tin file và mapping (view của một chat trên file catalog dùng chung)"""
+
+    def __init__(self, user_id: str, chat_history_id: str, catalog: FileCatalog = file_catalog):
+        self.user_id = user_id
+        self.chat_history_id = chat_history_id
+        self.catalog = catalog
+        self.catalog.migrate_legacy_json(user_id, chat_history_id)
+
+    @property
+    def files_info(self) -> Dict[str, Dict]:
+        """Snapshot of file_id -> info for this chat"""
+        return self.catalog.list_files(self.chat_history_id)
+
+    def add_file(self, file_id: str, filename: str, file_type: str = None, chunk_count: int = 0):
+        """Add or update file information"""
+        self.catalog.upsert(self.user_id, self.chat_history_id, file_id, filename, file_type, chunk_count)
+
+    def remove_file(self, file_id: str):
+        """Remove file information"""
+        self.catalog.remove(self.chat_history_id, file_id)
+
+    def get_all_files(self) -> List[str]:
+        """Get all file IDs"""
+        return list(self.files_info.keys())
+
+    def get_file_info(self, file_id: str) -> Dict:
+        """Get specific file info"""
+        return self.catalog.get(self.chat_history_id, file_id)
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from tracing import count
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", "./generation_cache")
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "2000"))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Chỉ quét lại thư mục để evict sau mỗi N lần ghi
+EVICT_EVERY_N_WRITES = 50
+
+
+def content_hash(content: str) -> str:
+    """SHA-256 of the document text used as input for generation"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Disk cache cho kết quả sinh note/mindmap, dùng chung giữa các user.
+
+    Key = (content hash, generator, option tuple, prompt version, model), nên hai
+    request giống hệt nhau trên cùng một tài liệu sẽ trả về ngay mà không gọi lại LLM.
+    Eviction theo LRU (mtime được cập nhật khi đọc) với giới hạn số entry và dung lượng.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = GENERATION_CACHE_DIR,
+        max_entries: int = GENERATION_CACHE_MAX_ENTRIES,
+        max_bytes: int = GENERATION_CACHE_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._writes_since_evict = EVICT_EVERY_N_WRITES
+
+    @staticmethod
+    def make_key(doc_hash: str, generator: str, options: Dict[str, Any], prompt_version: str, model: str) -> str:
+        """Build a stable cache key from the generation inputs"""
+        option_tuple = sorted((name, str(value).strip().lower()) for name, value in options.items())
+        raw = json.dumps([doc_hash, generator, option_tuple, prompt_version, model], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"❌ Error reading generation cache entry {key}: {e}")
+            return None
+
+        try:
+            # Đánh dấu vừa được dùng để LRU không evict entry này
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("value")
+
+    def set(self, key: str, value: Any, meta: Optional[Dict[str, Any]] = None):
+        """Store a value atomically (write to temp file then rename)"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        entry = {"value": value, "meta": meta or {}, "created_at": time.time()}
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"❌ Error writing generation cache entry {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= EVICT_EVERY_N_WRITES
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def get_or_create(self, key: str, factory: Callable[[], Any], meta: Optional[Dict[str, Any]] = None) -> Tuple[Any, bool]:
+        """Return (value, cache_hit). Concurrent identical requests only call factory once."""
+        value = self.get(key)
+        if value is not None:
+            count("cache.hits", cache="generation")
+            return value, True
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                # Một request khác có thể vừa sinh xong trong lúc chờ lock
+                value = self.get(key)
+                if value is not None:
+                    count("cache.hits", cache="generation")
+                    return value, True
+
+                count("cache.misses", cache="generation")
+                value = factory()
+                self.set(key, value, meta)
+                return value, False
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def evict(self):
+        """Remove least recently used entries until under the entry/size limits"""
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        if len(entries) <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if len(entries) - removed <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total_bytes -= size
+            except OSError:
+                pass
+        logger.info(f"🧹 Evicted {removed} generation cache entries")
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,118 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from supabase import create_client, Client
+
+# Số host giữ pool riêng và số kết nối keep-alive tối đa mỗi host
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_httpx_client: Optional[httpx.Client] = None
+_supabase: Optional[Client] = None
+_httpx_requests = 0
+
+
+def get_http_session() -> requests.Session:
+    """Process-wide requests session with a bounded keep-alive pool (Jina, storage checks)"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    pool_block=False,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _count_request(request: httpx.Request):
+    global _httpx_requests
+    _httpx_requests += 1
+
+
+def get_httpx_client() -> httpx.Client:
+    """Process-wide httpx client (HTTP/2 when h2 is installed) used by the Supabase client"""
+    global _httpx_client
+    if _httpx_client is None:
+        with _lock:
+            if _httpx_client is None:
+                try:
+                    import h2  # noqa: F401
+                    http2 = HTTP2_ENABLED
+                except ImportError:
+                    http2 = False
+                _httpx_client = httpx.Client(
+                    http2=http2,
+                    timeout=HTTP_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=HTTP_POOL_MAXSIZE,
+                        max_keepalive_connections=HTTP_POOL_MAXSIZE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                    event_hooks={"request": [_count_request]},
+                )
+    return _httpx_client
+
+
+def _supabase_options():
+    # supabase-py mới cho phép truyền httpx client dùng chung; bản cũ thì mỗi
+    # sub-client (postgrest/storage) tự giữ một client HTTP/2 riêng trong client dùng chung
+    try:
+        from supabase.lib.client_options import SyncClientOptions
+        return SyncClientOptions(httpx_client=get_httpx_client())
+    except (ImportError, TypeError):
+        return None
+
+
+def get_supabase() -> Client:
+    """Shared service-role Supabase client; building one per write opens new TLS connections each time"""
+    global _supabase
+    if _supabase is None:
+        options = _supabase_options()
+        with _lock:
+            if _supabase is None:
+                url = os.getenv("SUPABASE_URL")
+                key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
+                _supabase = create_client(url, key, options) if options is not None else create_client(url, key)
+    return _supabase
+
+
+def connection_stats() -> Dict[str, Any]:
+    """Connection reuse: requests sent vs TCP/TLS connections opened"""
+    pools = []
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                opened, sent = pool.num_connections, pool.num_requests
+                pools.append({
+                    "host": pool.host,
+                    "connections_opened": opened,
+                    "requests": sent,
+                    "reuse_ratio": round(1 - opened / sent, 3) if sent else None,
+                })
+
+    httpx_stats = None
+    if _httpx_client is not None:
+        # httpcore không có API công khai cho số kết nối đang mở
+        pool = getattr(getattr(_httpx_client, "_transport", None), "_pool", None)
+        open_connections = len(getattr(pool, "connections", []) or []) if pool is not None else None
+        httpx_stats = {"requests": _httpx_requests, "open_connections": open_connections}
+
+    return {"requests_pools": pools, "httpx": httpx_stats}
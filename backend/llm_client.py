@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+from tracing import span, count, observe
+
+logger = logging.getLogger(__name__)
+
+# Priority classes: số nhỏ được cấp quota trước
+LLM_PRIORITY_INTERACTIVE = 0
+LLM_PRIORITY_BACKGROUND = 1
+LLM_PRIORITY_BULK = 2
+
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "60"))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "1000000"))
+# Ví dụ: {"gemini-2.5-pro": {"rpm": 150, "tpm": 2000000}}
+LLM_MODEL_BUDGETS = json.loads(os.getenv("LLM_MODEL_BUDGETS", "{}"))
+# Thời gian chờ tối đa (giây) cho request tương tác trước khi trả lỗi 503
+LLM_INTERACTIVE_DEADLINE = float(os.getenv("LLM_INTERACTIVE_DEADLINE", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+WINDOW_SECONDS = 60.0
+# Gemini tính một ảnh ~258 token
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+_genai = None
+_genai_api_key: Optional[str] = None
+_genai_lock = threading.Lock()
+
+
+def configure_genai(api_key: Optional[str]):
+    """genai.configure(), deferred until the SDK is first loaded"""
+    global _genai_api_key
+    with _genai_lock:
+        _genai_api_key = api_key
+        if _genai is not None:
+            _genai.configure(api_key=api_key)
+
+
+def load_genai():
+    """Import google.generativeai on first use (grpc/protobuf make it slow to import)"""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=_genai_api_key)
+            _genai = genai
+        return _genai
+
+
+class LLMBusyError(Exception):
+    """Raised when a request cannot be admitted before its deadline"""
+
+    def __init__(self, model: str, retry_after: float, reason: str, deadline_exceeded: bool = False):
+        self.model = model
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.reason = reason
+        # True khi lỗi do deadline của chính caller (không phải provider trả 429)
+        self.deadline_exceeded = deadline_exceeded
+        super().__init__(f"LLM {model} is busy ({reason}), retry after {self.retry_after}s")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return "429" in str(error) or "quota" in str(error).lower() or "resource exhausted" in str(error).lower()
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Cheap prompt-size estimate (~4 chars per token), no network call"""
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    return IMAGE_TOKEN_ESTIMATE
+
+
+class _ModelBudget:
+    """Sliding one-minute window of requests and tokens for one model"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = max(1, rpm)
+        self.tpm = max(1, tpm)
+        self.window = deque()  # [timestamp, tokens]
+        self.waiting: List[tuple] = []  # heap of (priority, seq)
+        self.cooldown_until = 0.0
+
+    def _prune(self, now: float):
+        while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+            self.window.popleft()
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Seconds until a request of `tokens` fits in both the RPM and TPM budget"""
+        self._prune(now)
+        delay = max(0.0, self.cooldown_until - now)
+
+        if len(self.window) >= self.rpm:
+            oldest_blocking = self.window[len(self.window) - self.rpm][0]
+            delay = max(delay, oldest_blocking + WINDOW_SECONDS - now)
+
+        tokens = min(tokens, self.tpm)
+        used = sum(entry[1] for entry in self.window)
+        excess = used + tokens - self.tpm
+        if excess > 0:
+            freed = 0
+            for timestamp, entry_tokens in self.window:
+                freed += entry_tokens
+                if freed >= excess:
+                    delay = max(delay, timestamp + WINDOW_SECONDS - now)
+                    break
+        return delay
+
+
+class _InflightCall:
+    """A text prompt being generated, shared by the leader and coalesced followers"""
+
+    __slots__ = ("future", "priority")
+
+    def __init__(self, priority: int):
+        self.future = Future()
+        # Ưu tiên cao nhất trong số leader và follower đang chờ
+        self.priority = priority
+
+
+class LLMGovernor:
+    """Process-wide Gemini client with per-model quota and priority admission.
+
+    Every call goes through one queue per model: the highest-priority waiter is
+    admitted once the request and token budget of the last minute allows it. A 429
+    puts the whole model into a shared cooldown instead of each caller sleeping on its
+    own. Callers with a deadline fail fast with LLMBusyError when the estimated queue
+    wait would exceed it. Identical in-flight text prompts are coalesced into one call:
+    a follower with a higher priority raises the shared call's place in the queue, and
+    if the leader gives up on its own deadline, followers with time left run the call
+    themselves instead of failing with it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._budgets: Dict[str, _ModelBudget] = {}
+        self._models: Dict[str, Any] = {}
+        self._inflight: Dict[str, _InflightCall] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _budget(self, model_name: str) -> _ModelBudget:
+        budget = self._budgets.get(model_name)
+        if budget is None:
+            config = LLM_MODEL_BUDGETS.get(model_name, {})
+            budget = _ModelBudget(config.get("rpm", LLM_DEFAULT_RPM), config.get("tpm", LLM_DEFAULT_TPM))
+            self._budgets[model_name] = budget
+            self._stats[model_name] = {"calls": 0, "tokens": 0, "rate_limited": 0, "rejected": 0, "coalesced": 0}
+        return budget
+
+    def _model(self, model_name: str):
+        model = self._models.get(model_name)
+        if model is None:
+            model = load_genai().GenerativeModel(model_name)
+            self._models[model_name] = model
+        return model
+
+    def _acquire(self, model_name: str, tokens: int, priority: int, deadline: Optional[float], call: Optional[_InflightCall] = None) -> list:
+        """Block until admitted; returns the window entry so actual usage can be recorded"""
+        with self._cond:
+            budget = self._budget(model_name)
+            ticket = (priority, next(self._seq))
+            heapq.heappush(budget.waiting, ticket)
+            try:
+                while True:
+                    if call is not None and call.priority < ticket[0]:
+                        # Follower ưu tiên cao hơn vừa tham gia: chuyển lên trước trong hàng đợi
+                        budget.waiting.remove(ticket)
+                        ticket = (call.priority, ticket[1])
+                        budget.waiting.append(ticket)
+                        heapq.heapify(budget.waiting)
+                    now = time.monotonic()
+                    delay = budget.delay(tokens, now)
+                    if budget.waiting[0] == ticket and delay <= 0:
+                        heapq.heappop(budget.waiting)
+                        entry = [now, min(tokens, budget.tpm)]
+                        budget.window.append(entry)
+                        # Người kế tiếp trong hàng đợi có thể được cấp ngay
+                        self._cond.notify_all()
+                        return entry
+
+                    ahead = sum(1 for waiting in budget.waiting if waiting < ticket)
+                    estimated_wait = delay + ahead * (WINDOW_SECONDS / budget.rpm)
+                    if deadline is not None and now + estimated_wait > deadline:
+                        self._stats[model_name]["rejected"] += 1
+                        raise LLMBusyError(model_name, estimated_wait, f"{ahead} requests queued ahead", deadline_exceeded=True)
+
+                    timeout = delay if budget.waiting[0] == ticket else 1.0
+                    if deadline is not None:
+                        timeout = min(timeout, deadline - now)
+                    self._cond.wait(timeout=max(timeout, 0.01))
+            except BaseException:
+                if ticket in budget.waiting:
+                    budget.waiting.remove(ticket)
+                    heapq.heapify(budget.waiting)
+                    self._cond.notify_all()
+                raise
+
+    def _call(self, model_name: str, contents: Any, stream: bool):
+        model = self._model(model_name)
+        usage = None
+        if stream:
+            parts = []
+            for chunk in model.generate_content(contents, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk không có text (ví dụ chỉ có safety metadata)
+                    continue
+                if text:
+                    parts.append(text)
+                usage = getattr(chunk, "usage_metadata", None) or usage
+            return "".join(parts), usage
+
+        response = model.generate_content(contents)
+        return response.text, getattr(response, "usage_metadata", None)
+
+    def _generate_uncoalesced(
+        self, model_name: str, contents: Any, priority: int, deadline: Optional[float], stream: bool,
+        call: Optional[_InflightCall] = None,
+    ) -> str:
+        tokens = estimate_tokens(contents)
+        # LLM_MAX_RETRIES=0 vẫn gọi một lần
+        attempts = max(1, LLM_MAX_RETRIES)
+        for attempt in range(attempts):
+            if call is not None:
+                priority = min(priority, call.priority)
+            queued = time.perf_counter()
+            entry = self._acquire(model_name, tokens, priority, deadline, call)
+            observe("llm.queue_wait_ms", (time.perf_counter() - queued) * 1000, model=model_name, priority=priority)
+            if attempt:
+                count("llm.retries", model=model_name)
+            try:
+                with span("llm.generate", model=model_name, priority=priority, stream=stream, attempt=attempt):
+                    text, usage = self._call(model_name, contents, stream)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    count("llm.errors", model=model_name)
+                    raise
+                backoff = min(5 * (2 ** attempt), 60)
+                with self._cond:
+                    budget = self._budget(model_name)
+                    budget.cooldown_until = max(budget.cooldown_until, time.monotonic() + backoff)
+                    self._stats[model_name]["rate_limited"] += 1
+                count("llm.rate_limited", model=model_name)
+                logger.warning(f"⏳ Rate limit hit on {model_name}, cooling down {backoff}s (attempt {attempt + 1}/{attempts})")
+                if attempt == attempts - 1:
+                    raise LLMBusyError(model_name, backoff, "rate limited by provider") from e
+                continue
+
+            with self._cond:
+                total_tokens = getattr(usage, "total_token_count", None) if usage is not None else None
+                if total_tokens:
+                    entry[1] = total_tokens
+                stats = self._stats[model_name]
+                stats["calls"] += 1
+                stats["tokens"] += entry[1]
+            count("llm.calls", model=model_name)
+            count("llm.tokens", entry[1], model=model_name)
+            return text
+
+    def generate(
+        self,
+        model_name: str,
+        contents: Any,
+        priority: int = LLM_PRIORITY_BACKGROUND,
+        deadline_s: Optional[float] = None,
+        stream: bool = False,
+    ) -> str:
+        """Generate text, waiting for quota. Raises LLMBusyError if deadline_s cannot be met."""
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+
+        if not isinstance(contents, str):
+            return self._generate_uncoalesced(model_name, contents, priority, deadline, stream)
+
+        key = hashlib.sha256(f"{model_name}\0{contents}".encode("utf-8")).hexdigest()
+        while True:
+            with self._cond:
+                call = self._inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = _InflightCall(priority)
+                    self._inflight[key] = call
+                else:
+                    self._budget(model_name)
+                    self._stats[model_name]["coalesced"] += 1
+                    if priority < call.priority:
+                        call.priority = priority
+                        self._cond.notify_all()
+
+            if leader:
+                break
+            count("llm.coalesced", model=model_name)
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            try:
+                return call.future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise LLMBusyError(model_name, deadline_s or 1, "identical request still running", deadline_exceeded=True)
+            except LLMBusyError as e:
+                # Leader hết deadline của nó; follower còn thời gian thì tự chạy lại
+                if not e.deadline_exceeded or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+
+        try:
+            text = self._generate_uncoalesced(model_name, contents, priority, deadline, stream, call)
+        except BaseException as e:
+            # Gỡ khỏi _inflight trước khi báo follower, để follower chạy lại không gặp lại call đã lỗi
+            self._finish(key, call)
+            call.future.set_exception(e)
+            raise
+        self._finish(key, call)
+        call.future.set_result(text)
+        return text
+
+    def _finish(self, key: str, call: _InflightCall):
+        with self._cond:
+            if self._inflight.get(key) is call:
+                del self._inflight[key]
+
+    async def agenerate(self, model_name: str, contents: Any, **kwargs) -> str:
+        """Async variant: waits for quota in a worker thread, not on the event loop"""
+        return await asyncio.to_thread(self.generate, model_name, contents, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._cond:
+            return {
+                model_name: dict(stats, queued=len(self._budgets[model_name].waiting))
+                for model_name, stats in self._stats.items()
+            }
+
+
+llm_client = LLMGovernor()
@@ -1,24 +1,24 @@
 from PyPDF2 import PdfReader
-from pdf2image import convert_from_path
-import google.generativeai as genai
 import re
 import subprocess
-import fitz
-from PIL import Image
 import io
 import base64
 from io import BytesIO
-from langchain.schema import Document
-from langchain.text_splitter import TokenTextSplitter
+from langchain_core.documents import Document
 import dotenv
 import os
 import tempfile
-import easyocr
-import numpy as np
+import mmap
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from multiprocessing import cpu_count
 import threading
+import time
+import logging
 from functools import partial
+from llm_client import llm_client, configure_genai, LLM_PRIORITY_BULK
+from tracing import span, count, observe
+
+logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv()
 
@@ -26,19 +26,69 @@ CHUNKSIZE = 2000
 CHUNKOVERLAP = 100
 MAX_WORKERS = min(4, cpu_count())  # Giới hạn số worker để tránh quá tải
 
-def is_scanned_PDF(file_bytes: bytes, threshold=50):
-    reader = PdfReader(io.BytesIO(file_bytes))
+class PDFSource:
+    """A PDF given as bytes or as a file path.
+
+    For a path the file is memory-mapped for PyPDF2 and opened by path in PyMuPDF,
+    so parsing never needs a second in-memory copy of the upload.
+    """
+
+    def __init__(self, file_content: bytes = None, file_path: str = None):
+        if file_content is None and file_path is None:
+            raise ValueError("file_content or file_path is required")
+        self.file_content = file_content
+        self.file_path = file_path
+        self._file = None
+        self._mmap = None
+
+    def stream(self):
+        """Seekable stream for PdfReader"""
+        if self.file_path is None:
+            return io.BytesIO(self.file_content)
+        if self._mmap is None:
+            self._file = open(self.file_path, "rb")
+            if os.fstat(self._file.fileno()).st_size == 0:
+                # mmap không nhận file rỗng
+                self._file.close()
+                self._file = None
+                raise ValueError("PDF file is empty")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmap.seek(0)
+        return self._mmap
+
+    def open_fitz(self):
+        import fitz
+        if self.file_path is not None:
+            return fitz.open(self.file_path)
+        return fitz.open(stream=self.file_content, filetype="pdf")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap, self._file = None, None
+
+
+def as_pdf_source(source) -> PDFSource:
+    return source if isinstance(source, PDFSource) else PDFSource(file_content=source)
+
+
+def is_scanned_PDF(file_bytes, threshold=50):
+    reader = PdfReader(as_pdf_source(file_bytes).stream())
     total_chars = 0
     for page in reader.pages:
         text = page.extract_text()
         if text:
             total_chars += len(text)
+            # Đủ chữ thì không cần đọc hết các trang còn lại
+            if total_chars >= threshold:
+                break
     return total_chars < threshold
 
 def extract_text_from_image_batch(images_batch, batch_id):
     """Xử lý một batch các images với Gemini API để extract text"""
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    configure_genai(os.getenv("GEMINI_API_KEY"))
+    model_name = 'gemini-2.0-flash-exp'
     
     prompt = """
 Extract all text content from this document image.
@@ -57,19 +107,24 @@ Extract the text:
     results = []
     for idx, image in enumerate(images_batch):
         try:
-            print(f"Processing batch {batch_id}, image {idx + 1}/{len(images_batch)}")
+            logger.debug(f"Processing batch {batch_id}, image {idx + 1}/{len(images_batch)}")
+            started = time.perf_counter()
             image = image.convert("RGB")
-            response = model.generate_content([prompt, image])
-            results.append((batch_id * len(images_batch) + idx, response.text))
+            # OCR hàng loạt có độ ưu tiên thấp nhất để không chiếm quota của chat
+            text = llm_client.generate(model_name, [prompt, image], priority=LLM_PRIORITY_BULK)
+            results.append((batch_id * len(images_batch) + idx, text))
+            count("ocr.pages", engine="gemini")
+            observe("ocr.page_ms", (time.perf_counter() - started) * 1000, engine="gemini")
         except Exception as e:
-            print(f"Error processing image {idx} in batch {batch_id}: {e}")
+            count("ocr.page_errors", engine="gemini")
+            logger.error(f"Error processing image {idx} in batch {batch_id}: {e}")
             results.append((batch_id * len(images_batch) + idx, ""))
     
     return results
 
 def extract_text_from_images_parallel(images, batch_size=4):
     """Xử lý nhiều images song song với batching để tránh rate limiting"""
-    print(f"Processing {len(images)} images with batch size {batch_size}...")
+    logger.info(f"Processing {len(images)} images with batch size {batch_size}...")
     
     # Chia images thành các batch nhỏ
     batches = []
@@ -92,11 +147,13 @@ def extract_text_from_images_parallel(images, batch_size=4):
     
     return text_results
 
-def convert_pdf_to_images_parallel(file_bytes: bytes, dpi=300):
+def convert_pdf_to_images_parallel(file_bytes, dpi=300):
     """Convert PDF to images với xử lý song song"""
-    print("Converting PDF to images...")
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    print(f"PDF opened with {doc.page_count} pages.")
+    import fitz
+    from PIL import Image
+    logger.info("Converting PDF to images...")
+    doc = as_pdf_source(file_bytes).open_fitz()
+    logger.info(f"PDF opened with {doc.page_count} pages.")
     
     zoom = dpi / 72
     mat = fitz.Matrix(zoom, zoom)
@@ -120,13 +177,17 @@ def convert_pdf_to_images_parallel(file_bytes: bytes, dpi=300):
         for future in as_completed(future_to_page):
             page_num, image = future.result()
             images[page_num] = image
-            print(f"Processed page {page_num + 1}/{doc.page_count}")
+            logger.debug(f"Processed page {page_num + 1}/{doc.page_count}")
     
     doc.close()
     return images
 
 def process_page_ocr(page_data):
     """Xử lý OCR cho một trang"""
+    # easyocr kéo theo torch: chỉ nạp trong worker OCR, không nạp ở process web
+    import easyocr
+    import numpy as np
+    from PIL import Image
     page_num, img_bytes = page_data
     reader = easyocr.Reader(['vi', 'en'], gpu=False, verbose=False)
     
@@ -137,27 +198,31 @@ def process_page_ocr(page_data):
         text = '\n'.join(results)
         return page_num, text
     except Exception as e:
-        print(f"Error processing page {page_num}: {e}")
+        logger.error(f"Error processing page {page_num}: {e}")
         return page_num, ""
 
 def image_to_text_parallel(file_bytes):
     """OCR song song cho PDF scanned"""
-    print("Starting parallel OCR processing...")
-    pdf_doc = fitz.open("pdf", file_bytes)
+    import fitz
+    logger.info("Starting parallel OCR processing...")
+    pdf_doc = as_pdf_source(file_bytes).open_fitz()
     
     # Chuẩn bị dữ liệu cho tất cả các trang
     page_data = []
-    for page_num in range(pdf_doc.page_count):
-        page = pdf_doc[page_num]
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-        img_bytes = pix.tobytes("png")
-        page_data.append((page_num, img_bytes))
+    with span("render_pages", pages=pdf_doc.page_count):
+        for page_num in range(pdf_doc.page_count):
+            page = pdf_doc[page_num]
+            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
+            img_bytes = pix.tobytes("png")
+            page_data.append((page_num, img_bytes))
     
     pdf_doc.close()
     
     # Xử lý song song với ProcessPoolExecutor (CPU-bound)
     text_results = [None] * len(page_data)
     
+    # Worker process không có tracer của process cha -> đếm/đo ở đây, khi từng trang xong
+    started = time.perf_counter()
     with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
         future_to_page = {
             executor.submit(process_page_ocr, data): data[0]
@@ -169,10 +234,14 @@ def image_to_text_parallel(file_bytes):
             try:
                 page_num, text = future.result()
                 text_results[page_num] = text
-                print(f"OCR completed for page {page_num + 1}/{len(page_data)}")
+                count("ocr.pages", engine="easyocr")
+                logger.debug(f"OCR completed for page {page_num + 1}/{len(page_data)}")
             except Exception as e:
-                print(f"Error processing page {page_num}: {e}")
+                count("ocr.page_errors", engine="easyocr")
+                logger.error(f"Error processing page {page_num}: {e}")
                 text_results[page_num] = ""
+    if page_data:
+        observe("ocr.page_ms", (time.perf_counter() - started) * 1000 / len(page_data), engine="easyocr")
     
     # Kết hợp kết quả
     full_text = ""
@@ -181,10 +250,10 @@ def image_to_text_parallel(file_bytes):
     
     return full_text
 
-def pdf_to_text(file_bytes: bytes):
+def pdf_to_text(file_bytes):
     """Extract text from PDF using PyPDF2"""
     try:
-        reader = PdfReader(io.BytesIO(file_bytes))
+        reader = PdfReader(as_pdf_source(file_bytes).stream())
         text = ""
         for page in reader.pages:
             page_text = page.extract_text()
@@ -192,7 +261,7 @@ def pdf_to_text(file_bytes: bytes):
                 text += page_text + "\n\n"
         return text
     except Exception as e:
-        print(f"Error extracting text with PyPDF2: {e}")
+        logger.error(f"Error extracting text with PyPDF2: {e}")
         return ""
 
 def clean_text(text):
@@ -214,6 +283,7 @@ def clean_text(text):
 
 def split_text_parallel(text, chunk_size=CHUNKSIZE, chunk_overlap=CHUNKOVERLAP):
     """Chia text thành chunks song song"""
+    from langchain_text_splitters import TokenTextSplitter
     text_splitter = TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     
     # Chia text thành các phần nhỏ hơn để xử lý song song
@@ -241,76 +311,93 @@ def split_text_parallel(text, chunk_size=CHUNKSIZE, chunk_overlap=CHUNKOVERLAP):
     return [chunk[1] for chunk in all_chunks]
 
 class ParallelLoader:
-    def __init__(self, file_content: bytes, max_workers=None):
-        self.file_content = file_content
+    def __init__(self, file_content: bytes = None, max_workers=None, file_path: str = None):
+        # file_path: đọc trực tiếp từ file đã spool (mmap), không giữ thêm bản copy bytes
+        self.file_content = PDFSource(file_content=file_content, file_path=file_path)
         self.max_workers = max_workers or MAX_WORKERS
     
     def load_chunks(self):
         text_content = ""
         
-        print(f"Using {self.max_workers} workers for parallel processing")
+        logger.debug(f"Using {self.max_workers} workers for parallel processing")
 
-        if is_scanned_PDF(self.file_content):
-            print("Scanned PDF detected - using parallel OCR processing")
-            text_content = image_to_text_parallel(self.file_content)
-        else:
-            print("PDF is not scanned - extracting text directly")
-            text_content = pdf_to_text(self.file_content)
+        try:
+            with span("detect_scanned"):
+                scanned = is_scanned_PDF(self.file_content)
+            if scanned:
+                logger.info("Scanned PDF detected - using parallel OCR processing")
+                with span("ocr", engine="easyocr"):
+                    text_content = image_to_text_parallel(self.file_content)
+            else:
+                logger.info("PDF is not scanned - extracting text directly")
+                with span("extract_text"):
+                    text_content = pdf_to_text(self.file_content)
+        finally:
+            self.file_content.close()
         
-        print("Cleaning text...")
-        cleaned_text = clean_text(text_content)
+        with span("clean_text", chars=len(text_content)):
+            cleaned_text = clean_text(text_content)
         
         if not cleaned_text.strip():
-            print("Warning: No text extracted from PDF")
+            logger.warning("Warning: No text extracted from PDF")
             return []
         
-        print("Splitting text into chunks...")
-        text_chunks = split_text_parallel(cleaned_text)
+        with span("chunk"):
+            text_chunks = split_text_parallel(cleaned_text)
         
         document_chunks = [
             Document(page_content=chunk, metadata={"source": "uploaded_file", "chunk_id": idx})
             for idx, chunk in enumerate(text_chunks)
         ]
         
-        print(f"Generated {len(document_chunks)} chunks")
+        logger.info(f"Generated {len(document_chunks)} chunks")
         return document_chunks
 
 # Alternative method using Gemini for scanned PDFs (more accurate but slower)
 class ParallelLoaderWithGemini:
-    def __init__(self, file_content: bytes, max_workers=None):
-        self.file_content = file_content
+    def __init__(self, file_content: bytes = None, max_workers=None, file_path: str = None):
+        # file_path: đọc trực tiếp từ file đã spool (mmap), không giữ thêm bản copy bytes
+        self.file_content = PDFSource(file_content=file_content, file_path=file_path)
         self.max_workers = max_workers or MAX_WORKERS
     
     def load_chunks(self):
         text_content = ""
         
-        print(f"Using {self.max_workers} workers for parallel processing")
+        logger.debug(f"Using {self.max_workers} workers for parallel processing")
 
-        if is_scanned_PDF(self.file_content):
-            print("Scanned PDF detected - using Gemini for text extraction")
-            images = convert_pdf_to_images_parallel(self.file_content)
-            text_results = extract_text_from_images_parallel(images)
-            text_content = "\n\n".join(text_results)
-        else:
-            print("PDF is not scanned - extracting text directly")
-            text_content = pdf_to_text(self.file_content)
+        try:
+            with span("detect_scanned"):
+                scanned = is_scanned_PDF(self.file_content)
+            if scanned:
+                logger.info("Scanned PDF detected - using Gemini for text extraction")
+                with span("ocr", engine="gemini"):
+                    with span("render_pages"):
+                        images = convert_pdf_to_images_parallel(self.file_content)
+                    text_results = extract_text_from_images_parallel(images)
+                text_content = "\n\n".join(text_results)
+            else:
+                logger.info("PDF is not scanned - extracting text directly")
+                with span("extract_text"):
+                    text_content = pdf_to_text(self.file_content)
+        finally:
+            self.file_content.close()
         
-        print("Cleaning text...")
-        cleaned_text = clean_text(text_content)
+        with span("clean_text", chars=len(text_content)):
+            cleaned_text = clean_text(text_content)
         
         if not cleaned_text.strip():
-            print("Warning: No text extracted from PDF")
+            logger.warning("Warning: No text extracted from PDF")
             return []
         
-        print("Splitting text into chunks...")
-        text_chunks = split_text_parallel(cleaned_text)
+        with span("chunk"):
+            text_chunks = split_text_parallel(cleaned_text)
         
         document_chunks = [
             Document(page_content=chunk, metadata={"source": "uploaded_file", "chunk_id": idx})
             for idx, chunk in enumerate(text_chunks)
         ]
         
-        print(f"Generated {len(document_chunks)} chunks")
+        logger.info(f"Generated {len(document_chunks)} chunks")
         return document_chunks
 
 # Usage examples:
@@ -0,0 +1,78 @@
+import os
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from onnx_model import OnnxModel
+
+# Model embedding đa ngôn ngữ (vi/en/ja) đã export sang ONNX: model.onnx + tokenizer.json
+# Ví dụ: intfloat/multilingual-e5-small (dùng prefix "query: " / "passage: ")
+LOCAL_EMBEDDING_MODEL_DIR = os.getenv("LOCAL_EMBEDDING_MODEL_DIR", "./models/multilingual-e5-small")
+# Số chiều vector model trả về (e5-small: 384); đặt lại khi đổi sang model khác
+LOCAL_EMBEDDING_DIMENSIONS = int(os.getenv("LOCAL_EMBEDDING_DIMENSIONS", "384"))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "16"))
+LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "512"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", str(os.cpu_count() or 1)))
+LOCAL_EMBEDDING_POOLING = os.getenv("LOCAL_EMBEDDING_POOLING", "mean")  # mean | cls
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "query: ")
+LOCAL_EMBEDDING_PASSAGE_PREFIX = os.getenv("LOCAL_EMBEDDING_PASSAGE_PREFIX", "passage: ")
+
+
+class OnnxEmbeddings(Embeddings):
+    """Offline embedding backend running a sentence-embedding model on CPU with ONNX Runtime.
+
+    Session setup and length-sorted concurrent batching come from onnx_model.OnnxModel.
+    Output vectors are L2-normalised.
+    """
+
+    def __init__(
+        self,
+        model_dir: str = LOCAL_EMBEDDING_MODEL_DIR,
+        batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+        max_length: int = LOCAL_EMBEDDING_MAX_LENGTH,
+        threads: int = LOCAL_EMBEDDING_THREADS,
+        pooling: str = LOCAL_EMBEDDING_POOLING,
+    ):
+        self.model = OnnxModel(model_dir, max_length, threads, thread_name_prefix="embed")
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.pooling = pooling
+        self._dimension: Optional[int] = None
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = len(self._embed_batch(["dimension probe"])[0])
+        return self._dimension
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        np = self.model.np
+        hidden, attention_mask = self.model.run(texts)
+        if hidden.ndim == 2:
+            # Model đã tự pooling (output là sentence embedding)
+            pooled = hidden
+        elif self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(float).tolist()
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.model.map_batches(texts, self.batch_size, lambda batch: self._embed_batch([texts[i] for i in batch]))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed multiple documents"""
+        return self._embed([LOCAL_EMBEDDING_PASSAGE_PREFIX + text for text in texts])
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries at once (used by the query micro-batcher)"""
+        return self._embed([LOCAL_EMBEDDING_QUERY_PREFIX + text for text in texts])
@@ -1,10 +1,13 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
+from supabase import Client
+from http_clients import get_supabase, get_http_session, connection_stats, HTTP_TIMEOUT
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import logging
 from dotenv import load_dotenv
-from auth import get_current_user
+from auth import AuthUser, get_authenticated_user, require_admin
 from fastapi import Header, Body
 from pydantic import BaseModel
 import uuid
@@ -16,14 +19,31 @@ import unicodedata
 import re
 import requests
 import tempfile
+import hashlib
+import time
+from urllib.parse import quote
 from storage import MultiFileRAGSystem
 from fastapi import BackgroundTasks
 from custom_note import CustomNote
+from custom_note import PROMPT_VERSION as NOTE_PROMPT_VERSION
 from custom_mindmap import CustomMindmap
+from custom_mindmap import PROMPT_VERSION as MINDMAP_PROMPT_VERSION
+from generation_cache import generation_cache, content_hash
+from artifact_scheduler import artifact_scheduler, ARTIFACT_INTERACTIVE_TIMEOUT_S
+from cleanup import cleanup_pipeline
+from write_behind import write_behind
+from read_cache import read_cache, invalidate_on_flush, user_scope, chat_scope
+from llm_client import LLMBusyError
+from metrics import MetricsMiddleware, metrics_exporter, INGESTIONS_ACTIVE
+from profiler import ProfilingMiddleware, request_profiler
+from warmup import start_warmup
+from tracing import configure_logging
 from typing import Optional
 from transform_json_to_hierarchy import transform_json_to_hierarchy
 import json
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 app = FastAPI()
@@ -36,31 +56,64 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
-# Supabase client
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
-)
+# Supabase client (dùng chung với storage.py, giữ kết nối keep-alive)
+supabase: Client = get_supabase()
 
 token_auth_scheme = HTTPBearer()
 
-@app.post("/sync_user")
-def sync_user(
-    authorization: str = Header(...),
-):
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-
-    token = authorization.split(" ")[1]
+# Số cặp query/response mỗi trang khi phân trang transcript
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_PAGE_MAX = int(os.getenv("CHAT_PAGE_MAX", "500"))
+
+@app.exception_handler(LLMBusyError)
+async def llm_busy_handler(request: Request, exc: LLMBusyError):
+    # Hàng đợi LLM quá dài: báo client thử lại sau thay vì treo request
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "model": exc.model, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
-    # Gọi Supabase để lấy thông tin người dùng từ token
-    resp = supabase.auth.get_user(token)
-    user = resp.user
+async def run_interactive(fn, *args, **kwargs):
+    """Run fn on the artifact scheduler's interactive workers; 503 if it does not finish in time"""
+    future = artifact_scheduler.submit_interactive(fn, *args, **kwargs)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=ARTIFACT_INTERACTIVE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        # Job chưa chạy thì bị huỷ; đang chạy thì chạy tiếp và kết quả vẫn vào generation cache
+        future.cancel()
+        raise HTTPException(
+            status_code=503,
+            detail="Generation is taking too long, please retry shortly",
+            headers={"Retry-After": "30"},
+        )
 
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+@app.on_event("startup")
+def start_artifact_scheduler():
+    # Log qua hàng đợi (QueueHandler) để request không bị chặn khi ghi stdout
+    configure_logging()
+    # Chạy lại các job summary/mindmap còn dang dở từ lần chạy trước
+    artifact_scheduler.start()
+    # Ghi lại các thao tác Supabase còn trong journal của process đã dừng
+    write_behind.on_flush(invalidate_on_flush)
+    write_behind.start()
+    # Quét định kỳ dữ liệu của chat/file đã bị xoá
+    cleanup_pipeline.start()
+    metrics_exporter.start(asyncio.get_running_loop())
+    # Nạp trước OCR/LLM/Chroma trong nền nếu WARMUP_ON_STARTUP bật
+    start_warmup()
+
+@app.on_event("shutdown")
+def flush_pending_writes():
+    write_behind.flush()
 
+@app.post("/sync_user")
+def sync_user(
+    user: AuthUser = Depends(get_authenticated_user),
+):
     user_id = user.id
     email = user.email
     name = user.user_metadata.get("name", "")
@@ -69,45 +122,40 @@ def sync_user(
     existing = supabase.table("users").select("*").eq("id", user_id).execute()
     if len(existing.data) == 0:
         supabase.table("users").insert({"id": user_id, "email": email, "name": name}).execute()
-        print(f"User {user_id} inserted into 'users'")
+        logger.info(f"User {user_id} inserted into 'users'")
     else:
-        print(f"User {user_id} already exists")
+        logger.info(f"User {user_id} already exists")
 
     return {"message": "Synced"}
 
 
 @app.get("/getChatsHistory")
 def get_chats_history(
-    authorization: str = Header(...),
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-
-    token = authorization.split(" ")[1]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
     user_id = user.id
 
-    chat_history = (supabase.table("chat_histories")
-                    .select("chat_history_title", "chat_history_id")
-                    .eq("user_id", user_id)
-                    .order("last_edited_at", desc=True)
-                    .execute())
+    def load_chat_histories():
+        return (supabase.table("chat_histories")
+                .select("chat_history_title", "chat_history_id")
+                .eq("user_id", user_id)
+                .order("last_edited_at", desc=True)
+                .execute()).data
 
-    if not chat_history.data:
+    chat_history_data = read_cache.get_or_load(user_id, "chat_histories", user_scope(user_id), load_chat_histories)
+
+    if not chat_history_data:
         return {"chatsHistory": []}
 
+    read_cache.remember_chat_owner([item["chat_history_id"] for item in chat_history_data], user_id)
+
     # Tạo danh sách đúng cấu trúc
     chatsHistory = [
         {
             "id": item["chat_history_id"],
             "title": item["chat_history_title"]
         }
-        for item in chat_history.data
+        for item in chat_history_data
     ]
 
     return {"chatsHistory": chatsHistory}
@@ -118,18 +166,8 @@ class CreateChatRequest(BaseModel):
 @app.post("/createChatHistory")
 def create_chat_history(
     request: CreateChatRequest,
-    authorization: str = Header(...)
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-
-    token = authorization.split(" ")[1]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
     user_id = user.id
     new_chat_id = str(uuid.uuid4())
 
@@ -138,6 +176,8 @@ def create_chat_history(
         "user_id": user_id,
         "chat_history_title": request.title,
     }).execute()
+    read_cache.remember_chat_owner([new_chat_id], user_id)
+    read_cache.invalidate(user_scope(user_id))
 
     return {"message": "New chat history created", "chat_history_id": new_chat_id}
 
@@ -148,20 +188,9 @@ class RenameChatTitleRequest(BaseModel):
 
 @app.put("/renameChatHistoryTitle")
 async def rename_chat_history(
-    body: RenameChatTitleRequest, request: Request
+    body: RenameChatTitleRequest, request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
     # Cập nhật nội dung
     try:
@@ -174,6 +203,7 @@ async def rename_chat_history(
             .eq("user_id", user_id)
             .execute()
         )
+        read_cache.invalidate(user_scope(user_id))
         return {"message": "Cập nhật thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -187,101 +217,166 @@ class CreateChatContentRequest(BaseModel):
 @app.post("/createChatContent")
 async def createChatContent(
     request: Request,  # ✅ Đặt request trước để tránh lỗi syntax
-    body: CreateChatContentRequest
+    body: CreateChatContentRequest,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # ✅ Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]  # Bỏ "Bearer "
-    try:
-        resp = supabase.auth.get_user(token)
-        user = resp.user
-    except Exception as e:
-        raise HTTPException(status_code=403, detail=f"Invalid token: {str(e)}")
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     try:
-        # ✅ Insert bản ghi mới vào bảng chats
-        supabase.table("chats").insert({
+        # ✅ Insert bản ghi mới vào bảng chats (ghi nền qua write-behind, gộp batch)
+        write_behind.insert("chats", {
             "chat_id": str(uuid.uuid4()),
             "chat_history_id": body.chat_history_id,
             "query": body.query,
             "response": body.response,
             "created_at": datetime.utcnow().isoformat(),
-        }).execute()
+        })
 
         # ✅ Update bảng chat_histories để cập nhật thời gian chỉnh sửa
-        supabase.table("chat_histories").update({
-            "last_edited_at": datetime.utcnow().isoformat()
-        }).eq("chat_history_id", body.chat_history_id).execute()
+        write_behind.update(
+            "chat_histories",
+            {"chat_history_id": body.chat_history_id},
+            {"last_edited_at": datetime.utcnow().isoformat()},
+        )
+        read_cache.remember_chat_owner([body.chat_history_id], user.id)
+        read_cache.invalidate(user_scope(user.id))
 
         return {"message": "Lưu nội dung chat và cập nhật thành công"}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi ghi database: {str(e)}")
 
-@app.get("/getAllChatContent")
-async def getAllChatContent(
-    chat_history_id: str, request: Request
-):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
+def _chat_messages(rows):
+    messages = []
+    for item in rows:
+        messages.append({"role": "user", "content": item["query"]})
+        messages.append({"role": "bot", "content": item["response"]})
+    return messages
+
+def _pending_chats(chat_history_id: str, saved_ids):
+    # Tin nhắn vừa lưu nhưng chưa ghi xuống Supabase
+    return [
+        row for row in write_behind.pending_inserts("chats", chat_history_id=chat_history_id)
+        if row["chat_id"] not in saved_ids
+    ]
 
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
+def _page_cursor(row) -> str:
+    # created_at trùng nhau (insert theo batch của write-behind) nên con trỏ kèm chat_id
+    return f"{row['created_at']}|{row['chat_id']}"
+
+def _parse_cursor(cursor: str):
+    """(created_at, chat_id) of a page cursor; chat_id is None for older created_at-only cursors"""
+    created_at, _, chat_id = cursor.partition("|")
+    return created_at, chat_id or None
+
+def _cursor_filter(query, op: str, cursor: str):
+    created_at, chat_id = _parse_cursor(cursor)
+    if chat_id is None:
+        return getattr(query, op)("created_at", created_at)
+    return query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",chat_id.{op}."{chat_id}")')
+
+def _beyond_cursor(row, op: str, cursor: str) -> bool:
+    created_at, chat_id = _parse_cursor(cursor)
+    if chat_id is None:
+        return row["created_at"] > created_at if op == "gt" else row["created_at"] < created_at
+    key = (row["created_at"], row["chat_id"])
+    return key > (created_at, chat_id) if op == "gt" else key < (created_at, chat_id)
+
+def load_chat_page(chat_history_id: str, limit: int, before: Optional[str] = None, since: Optional[str] = None):
+    """One page of a transcript, oldest first.
+
+    Rows are ordered by (created_at, chat_id) and cursors carry both, so rows sharing a
+    created_at are neither skipped nor repeated across pages.
+    before: the `limit` newest rows older than this cursor (None = newest page).
+    since: rows newer than this cursor, for polling only what was added.
+    """
+    query = (supabase.table("chats")
+             .select("chat_id", "query", "response", "created_at")
+             .eq("chat_history_id", chat_history_id))
+    if since:
+        query = _cursor_filter(query, "gt", since).order("created_at", desc=False).order("chat_id", desc=False)
+    else:
+        if before:
+            query = _cursor_filter(query, "lt", before)
+        query = query.order("created_at", desc=True).order("chat_id", desc=True)
+    rows = query.limit(limit).execute().data
+
+    pending = [
+        row for row in _pending_chats(chat_history_id, {row["chat_id"] for row in rows})
+        if (not since or _beyond_cursor(row, "gt", since)) and (not before or _beyond_cursor(row, "lt", before))
+    ]
+    rows = sorted(rows + pending, key=lambda row: (row["created_at"], row["chat_id"]), reverse=not since)[:limit]
+    rows.sort(key=lambda row: (row["created_at"], row["chat_id"]))
 
-    if not user:    
-        raise HTTPException(status_code=403, detail="Invalid token")
+    if since:
+        # Con trỏ cho lần poll tiếp theo
+        cursor = _page_cursor(rows[-1]) if rows else since
+    else:
+        # Con trỏ để lấy trang cũ hơn (None = đã hết)
+        cursor = _page_cursor(rows[0]) if len(rows) == limit else None
+    return rows, cursor
+
+def _transcript_lines(chat_history_id: str, limit: int, before: Optional[str]):
+    # Trang mới nhất gửi trước: client hiển thị ngay, các trang cũ hơn đến sau
+    while True:
+        rows, cursor = load_chat_page(chat_history_id, limit, before=before)
+        yield json.dumps({"messages": _chat_messages(rows), "next_cursor": cursor}, ensure_ascii=False) + "\n"
+        if cursor is None:
+            break
+        before = cursor
 
+@app.get("/getAllChatContent")
+async def getAllChatContent(
+    chat_history_id: str, request: Request,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    stream: bool = False,
+    user: AuthUser = Depends(get_authenticated_user),
+):
     try:
-        response = (
-            supabase.table("chats")
-           .select("query", "response")
-           .eq("chat_history_id", chat_history_id)
-           .order("created_at", desc=False)
-           .execute()
-        )
-        messages = []
-        for item in response.data:
-            messages.append({"role": "user", "content": item["query"]})
-            messages.append({"role": "bot", "content": item["response"]})
+        if stream:
+            # NDJSON: mỗi dòng là một trang {"messages", "next_cursor"}, mới nhất trước
+            page_size = min(limit or CHAT_PAGE_SIZE, CHAT_PAGE_MAX)
+            return StreamingResponse(
+                _transcript_lines(chat_history_id, page_size, before),
+                media_type="application/x-ndjson",
+            )
 
-        return {"messages": messages}
+        if limit is not None or before is not None or since is not None:
+            page_size = min(limit or CHAT_PAGE_SIZE, CHAT_PAGE_MAX)
+            rows, cursor = await asyncio.to_thread(load_chat_page, chat_history_id, page_size, before, since)
+            return {"messages": _chat_messages(rows), "next_cursor": cursor}
+
+        def load_chats():
+            return (
+                supabase.table("chats")
+               .select("chat_id", "query", "response")
+               .eq("chat_history_id", chat_history_id)
+               .order("created_at", desc=False)
+               .execute()
+            ).data
+
+        saved = read_cache.get_or_load(user.id, "chats", chat_scope(chat_history_id), load_chats)
+        pending = _pending_chats(chat_history_id, {item.get("chat_id") for item in saved})
+        return {"messages": _chat_messages(saved + sorted(pending, key=lambda row: row["created_at"]))}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))     
 
 
 @app.get("/getAllFiles")
 async def getAllFiles(
-    chat_history_id: str, request: Request
+    chat_history_id: str, request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     try:
-        response = (
-           supabase.table("files")
-          .select("file_name", "file_id")
-          .eq("chat_history_id", chat_history_id)
-          .execute()    
-        )
-        return {"files": response.data}
+        def load_files():
+            return (
+               supabase.table("files")
+              .select("file_name", "file_id")
+              .eq("chat_history_id", chat_history_id)
+              .execute()
+            ).data
+
+        return {"files": read_cache.get_or_load(user.id, "files", chat_scope(chat_history_id), load_files)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -290,6 +385,23 @@ MAX_FILE_SIZE = 10 * 1024 * 1024 * 1024  # 10MB
 ALLOWED_FILE_TYPES = {
     'application/pdf',
 }
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Thư mục spool file upload (mặc định: thư mục tạm của hệ thống)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+async def spool_upload(file: UploadFile, spool) -> tuple:
+    """Copy the upload into `spool` chunk by chunk; returns (size, sha256 hex)"""
+    file_size = 0
+    digest = hashlib.sha256()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        file_size += len(chunk)
+        if file_size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail="File too large")
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.flush()
+    return file_size, digest.hexdigest()
+
 def sanitize_filename(filename):
     # Loại bỏ dấu
     name = unicodedata.normalize('NFD', filename).encode('ascii', 'ignore').decode("utf-8")
@@ -297,41 +409,100 @@ def sanitize_filename(filename):
     name = re.sub(r"[^\w\.-]", "-", name)
     return name
 
+def upload_to_storage(path: str, spool_path: str, file_type: str, max_retries: int = 3):
+    """Upload the spooled file, retrying; the last attempt overwrites if the object already exists"""
+    for attempt in range(max_retries):
+        try:
+            logger.info("Uploading file to storage...")
+            with open(spool_path, "rb") as upload_stream:
+                return supabase.storage.from_("usersfiles").upload(
+                    path=path,
+                    file=upload_stream,
+                    file_options={
+                        "content-type": file_type,
+                        "cache-control": "3600",
+                        "upsert": "false"
+                    }
+                )
+        except Exception as storage_error:
+            if attempt == max_retries - 1:  # Last attempt
+                if "already exists" in str(storage_error).lower():
+                    # Try one final time with upsert=true
+                    with open(spool_path, "rb") as upload_stream:
+                        return supabase.storage.from_("usersfiles").upload(
+                            path=path,
+                            file=upload_stream,
+                            file_options={
+                                "content-type": file_type,
+                                "cache-control": "3600",
+                                "upsert": "true"
+                            }
+                        )
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Storage upload failed after {max_retries} attempts: {storage_error}"
+                )
+            logger.warning(f"Upload attempt {attempt + 1} failed, retrying...")
+            time.sleep(1)  # Wait 1 second before retry
+
+def verify_storage_object(path: str) -> bool:
+    """HEAD the single uploaded object instead of listing the whole folder"""
+    try:
+        logger.info("Verifying file upload...")
+        service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        resp = get_http_session().head(
+            f"{os.getenv('SUPABASE_URL')}/storage/v1/object/usersfiles/{quote(path)}",
+            headers={"Authorization": f"Bearer {service_key}", "apikey": service_key},
+            timeout=HTTP_TIMEOUT,
+        )
+        if resp.status_code != 200:
+            logger.warning(f"Upload verification warning: HEAD returned {resp.status_code}")
+            return False
+        return True
+    except Exception as verify_error:
+        # Don't fail completely if verification fails, just log warning
+        logger.warning(f"Upload verification warning: {verify_error}")
+        return False
+
+def create_file_url(path: str) -> str:
+    """Signed URL for the object, falling back to the public URL"""
+    public_url = f"{os.getenv('SUPABASE_URL')}/storage/v1/object/public/usersfiles/{path}"
+    try:
+        logger.info("Generating signed URL...")
+        signed_url_resp = supabase.storage.from_("usersfiles").create_signed_url(
+            path, 3600  # URL valid for 1 hour
+        )
+        if hasattr(signed_url_resp, 'get') and signed_url_resp.get('signedURL'):
+            logger.info("Signed URL generated successfully")
+            return signed_url_resp['signedURL']
+        logger.warning("Failed to generate signed URL, using public URL instead 1")
+        return public_url
+    except Exception:
+        logger.warning("Failed to generate signed URL, using public URL instead 2")
+        return public_url
+
 @app.post("/uploadFile")
 async def uploadFile(
     request: Request,
     chat_history_id: str = Form(...),
-    file: UploadFile = File(...),  
+    file: UploadFile = File(...),
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-    
     user_id = user.id
+    spool = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".pdf", dir=UPLOAD_SPOOL_DIR, delete=False)
+    ingest_task = None
 
     try:
         # 1. Validate file before reading
         if not file.filename:
             raise HTTPException(status_code=400, detail="No filename provided")
             
-        # 2. Check file size before reading content
-        file_size = 0
-        contents = b""
-        while chunk := await file.read(8192):  # Read in chunks to handle large files
-            contents += chunk
-            file_size += len(chunk)
-            if file_size > MAX_FILE_SIZE:
-                raise HTTPException(status_code=413, detail="File too large")
+        # 2. Spool the upload to disk, checking size and hashing as it streams in
+        file_size, file_sha256 = await spool_upload(file, spool)
         
-        print(f"File size: {file_size} bytes")
+        logger.info(f"File size: {file_size} bytes")
+        if file_size == 0:
+            raise HTTPException(status_code=400, detail="File is empty")
         
         # 3. Validate file type
         if file.content_type not in ALLOWED_FILE_TYPES:
@@ -360,79 +531,57 @@ async def uploadFile(
         file_id = str(uuid.uuid4())
         path = f"{user_id}/{chat_history_id}/{file_name}"
         
-        print(f"Sanitized filename: {file_name}")
-        print(f"Upload path: {path}")
+        logger.info(f"Sanitized filename: {file_name}")
+        logger.info(f"Upload path: {path}")
         
-        # 6. Upload with retry logic
-        max_retries = 3
-        for attempt in range(max_retries):
+        # 6. Chạy song song theo đồ thị phụ thuộc:
+        #    storage upload -> (HEAD verify || signed URL) -> insert files
+        #    extraction + embedding chạy song song với toàn bộ nhánh storage
+        timings = {}
+        upload_started = time.perf_counter()
+
+        async def timed(name, func, *args, **kwargs):
+            started = time.perf_counter()
             try:
-                print(f"Uploading file to storage...")
-                storage_resp = supabase.storage.from_("usersfiles").upload(
-                    path=path,
-                    file=contents,
-                    file_options={
-                        "content-type": file_type,
-                        "cache-control": "3600",
-                        "upsert": "false"
-                    }
-                )
-                break  # Success, exit retry loop
-            except Exception as storage_error:
-                if attempt == max_retries - 1:  # Last attempt
-                    if "already exists" in str(storage_error).lower():
-                        # Try one final time with upsert=true
-                        storage_resp = supabase.storage.from_("usersfiles").upload(
-                            path=path,
-                            file=contents,
-                            file_options={
-                                "content-type": file_type,
-                                "cache-control": "3600",
-                                "upsert": "true"
-                            }
-                        )
-                    else:
-                        raise HTTPException(
-                            status_code=500, 
-                            detail=f"Storage upload failed after {max_retries} attempts: {storage_error}"
-                        )
-                else:
-                    print(f"Upload attempt {attempt + 1} failed, retrying...")
-                    await asyncio.sleep(1)  # Wait 1 second before retry
-        
-        # 7. Verify upload by checking if file exists
-        try:
-            print(f"Verifying file upload...")
-            list_resp = supabase.storage.from_("usersfiles").list(f"{user_id}/{chat_history_id}")
-            uploaded_files = [f['name'] for f in list_resp]
-            if file_name not in uploaded_files:
-                raise HTTPException(status_code=500, detail="File upload verification failed")
-        except Exception as verify_error:
-            print(f"Upload verification warning: {verify_error}")
-            # Don't fail completely if verification fails, just log warning
-        
-        # 8. Generate signed URL instead of public URL for better security (optional)
+                return await asyncio.to_thread(func, *args, **kwargs)
+            finally:
+                timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+        ragsystem = MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id)
+        logger.info(f"Storing documents... (file ID: {file_id}, name: {file_name}, type: {file_type})")
+        ingest_task = asyncio.create_task(timed(
+            "ingestion_ms", ragsystem.store_documents,
+            file_id=file_id, filename=file_name, file_type=file_type,
+            file_path=spool.name, schedule_artifacts=False,
+        ))
+        INGESTIONS_ACTIVE.inc()
+        ingest_task.add_done_callback(lambda _: INGESTIONS_ACTIVE.dec())
+        uploaded = inserted = False
+
+        async def rollback():
+            # Upload không hoàn tất: xoá vector, row files và object đã ghi để không còn file "ma"
+            await asyncio.wait([ingest_task])
+            steps = [asyncio.to_thread(ragsystem.remove_file_documents, file_id)]
+            if inserted:
+                steps.append(asyncio.to_thread(lambda: supabase.table("files").delete().eq("file_id", file_id).execute()))
+            if uploaded:
+                steps.append(asyncio.to_thread(lambda: supabase.storage.from_("usersfiles").remove([path])))
+            for result in await asyncio.gather(*steps, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.warning(f"⚠️ Rollback of upload {file_id} incomplete: {result}")
+            if inserted:
+                read_cache.invalidate(chat_scope(chat_history_id))
+
         try:
-            print(f"Generating signed URL...")
-            signed_url_resp = supabase.storage.from_("usersfiles").create_signed_url(
-                path, 3600  # URL valid for 1 hour
+            await timed("storage_upload_ms", upload_to_storage, path, spool.name, file_type)
+            uploaded = True
+            _, file_url = await asyncio.gather(
+                timed("verify_ms", verify_storage_object, path),
+                timed("signed_url_ms", create_file_url, path),
             )
-            if hasattr(signed_url_resp, 'get') and signed_url_resp.get('signedURL'):
-                print(f"Signed URL generated successfully")
-                file_url = signed_url_resp['signedURL']
-            else:
-                # Fallback to public URL
-                print(f"Failed to generate signed URL, using public URL instead 1")
-                file_url = f"{os.getenv('SUPABASE_URL')}/storage/v1/object/public/usersfiles/{path}"
-        except:
-            print(f"Failed to generate signed URL, using public URL instead 2")
-            # Fallback to public URL if signed URL creation fails
-            file_url = f"{os.getenv('SUPABASE_URL')}/storage/v1/object/public/usersfiles/{path}"
-        
-        # ... rest of database insertion code ...
-        try:
-            print(f"Inserting file metadata to DB...")
-            insert_resp = supabase.table("files").insert({
+
+            logger.info("Inserting file metadata to DB...")
+            await timed("db_insert_ms", lambda: supabase.table("files").insert({
                 "file_id": file_id,
                 "chat_history_id": chat_history_id,
                 "file_name": file.filename,
@@ -440,24 +589,31 @@ async def uploadFile(
                 "file_size": file_size,
                 "file_type": file_type,
                 "uploaded_at": datetime.utcnow().isoformat()
-            }).execute()
-        except Exception as db_error:
-            print(f"Insert file metadata failed: {db_error}")
-            raise HTTPException(status_code=500, detail=f"Insert to DB failed: {str(db_error)}")
+            }).execute())
+            inserted = True
+            read_cache.invalidate(chat_scope(chat_history_id))
+        except Exception as e:
+            # Nhánh storage/DB lỗi: đợi ingestion xong rồi xoá vector (và object đã upload) của file này
+            await rollback()
+            if isinstance(e, HTTPException):
+                raise
+            logger.error(f"Insert file metadata failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Insert to DB failed: {str(e)}")
 
         try:
-            print(f"Loading chunks...")
-            ragsystem = MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id)
-            print(f"Storing documents...")
-            print(f"File ID: {file_id}")
-            print(f"File name: {file_name}")
-            print(f"File type: {file_type}")
-            ragsystem.store_documents(contents=contents, file_id=file_id, filename=file_name, file_type=file_type)
-            print(f"Documents stored successfully")
-
+            stored = await ingest_task
         except Exception as e:
-            print(f"Error loading chunks: {e}")
+            logger.error(f"Error loading chunks: {e}")
+            await rollback()
             raise HTTPException(status_code=500, detail=f"Error loading chunks: {str(e)}")
+        if not stored:
+            await rollback()
+            raise HTTPException(status_code=500, detail="Error loading chunks")
+        logger.info("Documents stored successfully")
+
+        # Summary/mindmap ghi vào row files, nên chỉ xếp lịch sau khi row đã được insert
+        ragsystem.schedule_default_artifacts(file_id)
+        timings["total_ms"] = round((time.perf_counter() - upload_started) * 1000, 1)
 
         return {
             "success": True,
@@ -466,13 +622,15 @@ async def uploadFile(
             "file_name": file.filename,
             "file_size": file_size,
             "file_type": file_type,
-            "uploaded_at": datetime.utcnow().isoformat()
+            "sha256": file_sha256,
+            "uploaded_at": datetime.utcnow().isoformat(),
+            "timings": timings,
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Unexpected error in uploadFile: {e}")
+        logger.error(f"Unexpected error in uploadFile: {e}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
     finally:
         # Cleanup
@@ -480,6 +638,14 @@ async def uploadFile(
             await file.seek(0)
         except:
             pass
+        if ingest_task is not None and not ingest_task.done():
+            # Ingestion vẫn đọc file spool trong thread (không huỷ được): đợi xong mới xoá
+            await asyncio.wait([ingest_task])
+        spool.close()
+        try:
+            os.remove(spool.name)
+        except OSError:
+            pass
 
 class DeleteChatRequest(BaseModel):
     chat_history_id: str
@@ -487,19 +653,8 @@ class DeleteChatRequest(BaseModel):
 async def delete_chat_history(
     data: DeleteChatRequest,
     request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:    
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
     # Truy vấn để kiểm tra xem chat có thuộc về user không
     existing = (
@@ -524,6 +679,9 @@ async def delete_chat_history(
         .eq("user_id", user_id)
         .execute()
     )
+    read_cache.invalidate(user_scope(user_id), chat_scope(data.chat_history_id))
+    # Xoá vectors, file, note, cache... của chat ở nền (theo lô, chạy tiếp được sau restart)
+    cleanup_pipeline.delete_chat(user_id, data.chat_history_id)
 
     return {"message": "Chat deleted successfully"}
 
@@ -532,28 +690,23 @@ async def getResponseFromQuery(
     query: str,
     chat_history_id: str,
     request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]  
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-    
     user_id = user.id
 
     try:
-        ragsystem = MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id)
-        response = ragsystem.chat(query)
-        
+        def answer():
+            ragsystem = MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id)
+            return ragsystem.chat(query)
+
+        # Mở store, embed, chờ quota Gemini đều là thao tác chặn: chạy ngoài event loop
+        response = await asyncio.to_thread(answer)
+
         return {"response": response}
+    except LLMBusyError:
+        raise
     except Exception as e:
-        print(f"Error in getResponseFromQuery: {e}")
+        logger.error(f"Error in getResponseFromQuery: {e}")
     
 
 class RenameFileRequest(BaseModel):
@@ -565,19 +718,8 @@ class RenameFileRequest(BaseModel):
 async def renameFile(
     request: Request,
     data: RenameFileRequest,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     bucket_path = f"{user_id}/{data.chat_history_id}/{data.old_name}"
@@ -587,6 +729,7 @@ async def renameFile(
     update_res = supabase.table("files").update({"file_name": data.new_name}).eq("file_id", data.file_id).execute()
     if update_res.data is None:
         raise HTTPException(status_code=500, detail="Database update failed")
+    read_cache.invalidate(chat_scope(data.chat_history_id))
 
     # # Step 4: Rename file in Supabase Storage (copy then delete)
     copy_res = supabase.storage.from_("usersfiles").move(bucket_path, new_path)
@@ -609,29 +752,19 @@ class DeleteFileRequest(BaseModel):
 async def deleteFile(
     request: Request,
     data: DeleteFileRequest,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:   
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     # Xóa file trong bảng files
     delete_res = supabase.table("files").delete().eq("file_id", data.file_id).execute()
     if delete_res.data is None:
         raise HTTPException(status_code=500, detail="Database delete failed")
+    read_cache.invalidate(chat_scope(data.chat_history_id))
 
-    # Xóa file trong Supabase Storage
+    # Xóa file trong Supabase Storage cùng vectors/catalog/chunk logs ở nền
     bucket_path = f"{user_id}/{data.chat_history_id}/{data.file_name}"
-    remove_res = supabase.storage.from_("usersfiles").remove([bucket_path])
+    cleanup_pipeline.delete_file(user_id, data.chat_history_id, data.file_id, bucket_path)
 
     return {
         "message": "File deleted successfully",
@@ -641,24 +774,47 @@ async def deleteFile(
 async def getAllMindmapNotes(
     chat_history_id: str,
     request: Request,
+    include_content: bool = True,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = user.id
+
+    # include_content=false: chỉ lấy id/tên/loại cho sidebar, nội dung lấy sau qua /getMindmapNote
+    if include_content:
+        columns = ("mindmap_note_name", "mindmap_note_id", "type", "mindmap_content", "note_content")
+        resource = "mindmap_notes"
+    else:
+        columns = ("mindmap_note_name", "mindmap_note_id", "type")
+        resource = "mindmap_notes_list"
 
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
+    def load_mindmap_notes():
+        return supabase.table("mindmapnotes").select(*columns).eq("chat_history_id", chat_history_id).execute().data
 
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
+    mindmap_notes = read_cache.get_or_load(user_id, resource, chat_scope(chat_history_id), load_mindmap_notes)
+    return {"mindmap_notes": mindmap_notes}
 
+@app.get("/getMindmapNote")
+async def getMindmapNote(
+    chat_history_id: str,
+    mindmap_note_id: str,
+    request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
+):
     user_id = user.id
 
-    # Lấy danh sách tất cả các chat_history_id của người dùng
-    mindmap_notes = supabase.table("mindmapnotes").select("mindmap_note_name", "mindmap_note_id", "type", "mindmap_content", "note_content").eq("chat_history_id", chat_history_id).execute()
-    return {"mindmap_notes": mindmap_notes.data}
+    def load_mindmap_note():
+        note = (supabase.table("mindmapnotes")
+                .select("mindmap_note_name", "mindmap_note_id", "type", "mindmap_content", "note_content")
+                .eq("mindmap_note_id", mindmap_note_id)
+                .eq("chat_history_id", chat_history_id)
+                .execute())
+        return note.data[0] if note.data else None
+
+    note = read_cache.get_or_load(user_id, f"mindmap_note:{mindmap_note_id}", chat_scope(chat_history_id), load_mindmap_note)
+    if note is None:
+        raise HTTPException(status_code=404, detail="Mindmap note not found")
+
+    return {"mindmap_note": note}
 
 class DeleteMindmapNoteRequest(BaseModel):
     chat_history_id: str
@@ -667,25 +823,15 @@ class DeleteMindmapNoteRequest(BaseModel):
 async def deleteMindmapNote(
     request: Request,
     data: DeleteMindmapNoteRequest,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:   
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     # Xóa file trong bảng mindmapnotes
     delete_res = supabase.table("mindmapnotes").delete().eq("mindmap_note_id", data.mindmap_note_id).execute()
     if delete_res.data is None:
         raise HTTPException(status_code=500, detail="Database delete failed")
+    read_cache.invalidate(chat_scope(data.chat_history_id))
 
     return {
         "message": "Mindmap Note deleted successfully",
@@ -695,13 +841,14 @@ async def deleteMindmapNote(
 def update_mindmap_note_name_task(chat_history_id: str, mindmap_note_id: str, new_name: str):
     try:
         update_res = (supabase.table("mindmapnotes").update({"mindmap_note_name": new_name}).eq("mindmap_note_id", mindmap_note_id).eq("chat_history_id", chat_history_id).execute())
+        read_cache.invalidate(chat_scope(chat_history_id))
 
         if update_res.data is None:
-            print("❌ Update failed")
+            logger.error("❌ Update failed")
         else:
-            print("✅ Mindmap note name updated in background.")
+            logger.info("✅ Mindmap note name updated in background.")
     except Exception as e:
-        print("❌ Exception in background task:", e)
+        logger.error(f"❌ Exception in background task: {e}")
 
 class RenameMindmapNoteRequest(BaseModel):
     chat_history_id: str
@@ -712,19 +859,8 @@ async def renameMindmapNote(
     request: Request,
     data: RenameMindmapNoteRequest,
     background_tasks: BackgroundTasks,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     background_tasks.add_task(update_mindmap_note_name_task, data.chat_history_id, data.mindmap_note_id, data.new_name)
@@ -739,19 +875,8 @@ async def getFileSummary(
     chat_history_id: str,
     file_id: str,
     request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:    
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     # Lấy thông tin file từ bảng files
@@ -773,11 +898,11 @@ def update_summary_task(chat_history_id: str, file_id: str, new_summary: str):
             .execute()
         )
         if update_res.data is None:
-            print("❌ Update failed")
+            logger.error("❌ Update failed")
         else:
-            print("✅ File summary updated in background.")
+            logger.info("✅ File summary updated in background.")
     except Exception as e:
-        print("❌ Exception in background task:", e)
+        logger.error(f"❌ Exception in background task: {e}")
 
 class FileSummaryUpdateRequest(BaseModel):
     chat_history_id: str
@@ -788,19 +913,8 @@ async def updateFileSummary(
     data: FileSummaryUpdateRequest,
     request: Request,
     background_tasks: BackgroundTasks,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     background_tasks.add_task(update_summary_task, data.chat_history_id, data.file_id, data.new_summary)
@@ -847,38 +961,48 @@ class CustomNoteCreateRequest(BaseModel):
 async def createCustomNote(
     data: CustomNoteCreateRequest,
     request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:    
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     # Lấy thông tin file từ bảng files
     file_content = supabase.table("files").select("file_content").eq("file_id", data.file_id).eq("chat_history_id", data.chat_history_id).single().execute()
 
-    if file_content.data is None:
+    if file_content.data is None or not file_content.data["file_content"]:
         raise HTTPException(status_code=404, detail="File content not found")
 
     note_content = file_content.data["file_content"]
 
     note_generator = CustomNote()
 
-    custom_note_content = note_generator.createCustomNote(
-        content=note_content,
-        note_target=data.note_target,
-        note_language=data.note_language,
-        note_detailed_level=data.note_detailed_level,
-        stream=True
+    # Cùng tài liệu + cùng tùy chọn thì dùng lại kết quả đã sinh (kể cả từ user khác)
+    cache_key = generation_cache.make_key(
+        content_hash(note_content),
+        "custom_note",
+        {
+            "note_target": data.note_target,
+            "note_language": data.note_language,
+            "note_detailed_level": data.note_detailed_level,
+        },
+        NOTE_PROMPT_VERSION,
+        note_generator.model_name,
     )
+    custom_note_content = generation_cache.get(cache_key)
+    cache_hit = custom_note_content is not None
+    if not cache_hit:
+        # Chạy trên scheduler với độ ưu tiên tương tác, không chặn event loop
+        custom_note_content, cache_hit = await run_interactive(
+            generation_cache.get_or_create,
+            cache_key,
+            lambda: note_generator.createCustomNote(
+                content=note_content,
+                note_target=data.note_target,
+                note_language=data.note_language,
+                note_detailed_level=data.note_detailed_level,
+                stream=True
+            ),
+            meta={"generator": "custom_note"},
+        )
 
     # Save the custom note content to the supabase
     mindmap_note_id = str(uuid.uuid4())
@@ -894,9 +1018,11 @@ async def createCustomNote(
 
     if insert_res.data is None:
         raise HTTPException(status_code=500, detail="Database insert failed")
+    read_cache.invalidate(chat_scope(data.chat_history_id))
     
     return {
         "message": "Custom note created successfully",
+        "cache_hit": cache_hit,
     }
 
 class CustomMindmapCreateRequest(BaseModel):
@@ -910,44 +1036,54 @@ class CustomMindmapCreateRequest(BaseModel):
 async def createCustomMindmap(
     data: CustomMindmapCreateRequest,
     request: Request,
+    user: AuthUser = Depends(get_authenticated_user),
 ):
-    # Xác thực token
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    token = token[7:]
-    resp = supabase.auth.get_user(token)
-    user = resp.user
-
-    if not user:    
-        raise HTTPException(status_code=403, detail="Invalid token")
-
     user_id = user.id
 
     # Lấy thông tin file từ bảng files
     file_content = supabase.table("files").select("file_content").eq("file_id", data.file_id).eq("chat_history_id", data.chat_history_id).single().execute()
 
-    if file_content.data is None:
+    if file_content.data is None or not file_content.data["file_content"]:
         raise HTTPException(status_code=404, detail="File content not found")
 
     mindmap_content = file_content.data["file_content"]
 
     mindmap_generator = CustomMindmap()
 
-    custom_mindmap_content = mindmap_generator.createCustomMindmap(
-        content=mindmap_content,
-        mindmap_target=data.mindmap_target,
-        mindmap_language=data.mindmap_language,
-        mindmap_detailed_level=data.mindmap_detailed_level,
-        stream=True
-    )
+    def generate_mindmap():
+        custom_mindmap_content = mindmap_generator.createCustomMindmap(
+            content=mindmap_content,
+            mindmap_target=data.mindmap_target,
+            mindmap_language=data.mindmap_language,
+            mindmap_detailed_level=data.mindmap_detailed_level,
+            stream=True
+        )
 
-    json_text = custom_mindmap_content[custom_mindmap_content.find('{'):custom_mindmap_content.rfind('}') + 1]
-                
-    mindmap = json.loads(json_text)
+        json_text = custom_mindmap_content[custom_mindmap_content.find('{'):custom_mindmap_content.rfind('}') + 1]
 
-    mindmap = transform_json_to_hierarchy(mindmap)
+        # Chỉ cache khi parse JSON thành công
+        return transform_json_to_hierarchy(json.loads(json_text))
+
+    cache_key = generation_cache.make_key(
+        content_hash(mindmap_content),
+        "custom_mindmap",
+        {
+            "mindmap_target": data.mindmap_target,
+            "mindmap_language": data.mindmap_language,
+            "mindmap_detailed_level": data.mindmap_detailed_level,
+        },
+        MINDMAP_PROMPT_VERSION,
+        mindmap_generator.model_name,
+    )
+    mindmap = generation_cache.get(cache_key)
+    cache_hit = mindmap is not None
+    if not cache_hit:
+        mindmap, cache_hit = await run_interactive(
+            generation_cache.get_or_create,
+            cache_key,
+            generate_mindmap,
+            meta={"generator": "custom_mindmap"},
+        )
 
     # Save the custom note content to the supabase
     mindmap_note_id = str(uuid.uuid4())
@@ -963,11 +1099,44 @@ async def createCustomMindmap(
 
     if insert_res.data is None:
         raise HTTPException(status_code=500, detail="Database insert failed")
+    read_cache.invalidate(chat_scope(data.chat_history_id))
     
     return {
         "message": "Custom mindmap created successfully",
+        "cache_hit": cache_hit,
     }
 
 
 
-    
\ No newline at end of file
+    
+
+@app.get("/connectionStats", dependencies=[Depends(require_admin)])
+def get_connection_stats():
+    # Theo dõi tỉ lệ tái sử dụng kết nối tới Jina/Supabase
+    return connection_stats()
+
+@app.get("/cleanupStats", dependencies=[Depends(require_admin)])
+def get_cleanup_stats():
+    # Task dọn dẹp đang chờ/lỗi và dung lượng thu hồi ở lần quét gần nhất
+    return cleanup_pipeline.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus scrape: request latency, hàng đợi, số lần gọi Gemini/Jina của mọi worker
+    body, content_type = metrics_exporter.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def list_request_profiles(limit: int = 50):
+    # Profile của các request chậm/được lấy mẫu (PROFILE_ENABLED), mới nhất trước
+    return {"enabled": request_profiler.enabled, "profiles": request_profiler.list_profiles(limit=min(max(limit, 1), 500))}
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_request_profile(profile_id: str, format: str = "json"):
+    report = request_profiler.load(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        # Nạp thẳng vào flamegraph.pl / speedscope
+        return PlainTextResponse("\n".join(f"{entry['stack']} {entry['samples']}" for entry in report["stacks"]))
+    return report
@@ -0,0 +1,162 @@
+import os
+import time
+import atexit
+import asyncio
+import threading
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from tracing import tracer
+from artifact_scheduler import artifact_scheduler
+from write_behind import write_behind
+from llm_client import llm_client
+from collection_writer import writer_stats
+
+logger = logging.getLogger(__name__)
+
+# Đặt trong start.sh trước khi uvicorn khởi động: các worker ghi số liệu vào thư mục chung,
+# /metrics ở bất kỳ worker nào cũng trả về tổng của cả nhóm
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_REFRESH_INTERVAL_S = float(os.getenv("METRICS_REFRESH_INTERVAL_S", "5"))
+
+LATENCY_BUCKETS_S = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HTTP_REQUESTS = Counter("docwhiz_http_requests", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("docwhiz_http_request_duration_seconds", "HTTP request latency", ["method", "route"], buckets=LATENCY_BUCKETS_S)
+HTTP_IN_PROGRESS = Gauge("docwhiz_http_requests_in_progress", "HTTP requests being served", multiprocess_mode="livesum")
+INGESTIONS_ACTIVE = Gauge("docwhiz_ingestions_active", "Uploads currently being extracted and embedded", multiprocess_mode="livesum")
+QUEUE_DEPTH = Gauge("docwhiz_queue_depth", "Items waiting in a background queue", ["queue"], multiprocess_mode="livesum")
+
+# Tên counter/histogram của tracing -> metric Prometheus. Chỉ giữ các label có số giá trị nhỏ.
+_COUNTERS = {
+    "llm.calls": Counter("docwhiz_llm_calls", "Gemini calls", ["model"]),
+    "llm.tokens": Counter("docwhiz_llm_tokens", "Gemini tokens (prompt + output)", ["model"]),
+    "llm.rate_limited": Counter("docwhiz_llm_rate_limited", "Gemini 429 / quota errors", ["model"]),
+    "llm.retries": Counter("docwhiz_llm_retries", "Gemini calls retried after a rate limit", ["model"]),
+    "llm.errors": Counter("docwhiz_llm_errors", "Gemini calls failed with a non-quota error", ["model"]),
+    "llm.coalesced": Counter("docwhiz_llm_coalesced", "Gemini requests served by an identical in-flight call", ["model"]),
+    "jina.calls": Counter("docwhiz_jina_calls", "Jina embedding requests", ["task"]),
+    "jina.tokens": Counter("docwhiz_jina_tokens", "Jina embedding tokens", ["task"]),
+    "jina.rate_limited": Counter("docwhiz_jina_rate_limited", "Jina 429 responses", ["task"]),
+    "jina.errors": Counter("docwhiz_jina_errors", "Jina requests failed with another error", ["task"]),
+    "ingest.files": Counter("docwhiz_ingested_files", "Files extracted and embedded"),
+    "ingest.chunks": Counter("docwhiz_ingested_chunks", "Chunks extracted from uploads"),
+    "ocr.pages": Counter("docwhiz_ocr_pages", "Scanned pages OCRed", ["engine"]),
+    "cache.hits": Counter("docwhiz_cache_hits", "Cache hits", ["cache"]),
+    "cache.misses": Counter("docwhiz_cache_misses", "Cache misses", ["cache"]),
+    "supabase.rows_written": Counter("docwhiz_supabase_rows_written", "Rows flushed to Supabase", ["table", "op"]),
+    "supabase.write_errors": Counter("docwhiz_supabase_write_errors", "Supabase writes rejected", ["table", "op"]),
+    "supabase.dead_lettered": Counter("docwhiz_supabase_dead_lettered", "Supabase writes given up on and moved to the dead-letter log", ["table", "op"]),
+}
+_HISTOGRAMS = {
+    "span.duration_ms": Histogram("docwhiz_stage_duration_seconds", "Pipeline stage latency (tracing spans)", ["span"], buckets=LATENCY_BUCKETS_S),
+    "llm.queue_wait_ms": Histogram("docwhiz_llm_queue_wait_seconds", "Time waiting for Gemini quota", ["model"], buckets=LATENCY_BUCKETS_S),
+}
+
+
+def _labelled(metric, attributes: Dict[str, Any]):
+    if not metric._labelnames:
+        return metric
+    return metric.labels(*(str(attributes.get(label, "")) for label in metric._labelnames))
+
+
+class _TracingBridge:
+    """Tracer sink: mirrors the tracing counters/histograms listed above into Prometheus"""
+
+    def count(self, name: str, value: float, attributes: Dict[str, Any]):
+        metric = _COUNTERS.get(name)
+        if metric is not None:
+            _labelled(metric, attributes).inc(value)
+
+    def observe(self, name: str, value: float, attributes: Dict[str, Any]):
+        metric = _HISTOGRAMS.get(name)
+        if metric is not None:
+            _labelled(metric, attributes).observe(value / 1000)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, latency and in-flight requests per route.
+
+    Routes are labelled with their path template (e.g. /getMindmapNote), unmatched
+    paths as "unmatched", so label cardinality stays bounded. Latency runs until the
+    last body chunk is sent, so streamed responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            # Router của FastAPI ghi route đã khớp vào scope
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.labels(scope["method"], path).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(scope["method"], path, str(status)).inc()
+
+
+class MetricsExporter:
+    """Keeps this worker's queue-depth gauges fresh and renders /metrics"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        if self._thread is not None:
+            return
+        self._loop = loop
+        tracer.add_sink(_TracingBridge())
+        if PROMETHEUS_MULTIPROC_DIR:
+            # Gauge "livesum" của worker đã dừng phải được xoá, nếu không sẽ bị cộng mãi
+            atexit.register(multiprocess.mark_process_dead, os.getpid())
+        self._thread = threading.Thread(target=self._run, name="metrics-refresh", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        scheduler = artifact_scheduler.stats()
+        QUEUE_DEPTH.labels("artifact_scheduler").set(scheduler["queued"] + scheduler["interactive_pending"])
+        QUEUE_DEPTH.labels("write_behind").set(write_behind.stats()["pending"])
+        QUEUE_DEPTH.labels("llm").set(sum(stats["queued"] for stats in llm_client.stats().values()))
+        QUEUE_DEPTH.labels("collection_writers").set(sum(stats["queued"] for stats in writer_stats().values()))
+        # Thread pool mặc định của event loop: nơi chạy asyncio.to_thread (ingestion, Supabase)
+        executor = getattr(self._loop, "_default_executor", None)
+        work_queue = getattr(executor, "_work_queue", None)
+        QUEUE_DEPTH.labels("threadpool").set(work_queue.qsize() if work_queue is not None else 0)
+
+    def render(self) -> Tuple[bytes, str]:
+        self.refresh()
+        if PROMETHEUS_MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(), CONTENT_TYPE_LATEST
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"⚠️ Metrics refresh failed: {e}")
+            time.sleep(METRICS_REFRESH_INTERVAL_S)
+
+
+metrics_exporter = MetricsExporter()
@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+
+class OnnxModel:
+    """A transformer exported to ONNX (model.onnx + tokenizer.json) run on CPU with ONNX Runtime.
+
+    Shared by the local embedding backend and the reranker. Inputs are sorted by length
+    before batching so each batch pads to similar lengths, and batches run concurrently
+    on a thread pool sized to the CPU count (one ONNX intra-op thread per batch).
+    """
+
+    def __init__(self, model_dir: str, max_length: int, threads: int, thread_name_prefix: str):
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.np = np
+        self.model_dir = model_dir
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix=thread_name_prefix)
+
+    def run(self, inputs: List[Any]) -> Tuple[Any, Any]:
+        """Tokenize a batch (texts or (query, passage) pairs); returns (first model output, attention mask)"""
+        np = self.np
+        encodings = self.tokenizer.encode_batch(inputs)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds: Dict[str, Any] = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            # Câu đơn: toàn 0; cặp (query, passage): phân biệt hai đoạn
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        return self.session.run(None, feeds)[0], attention_mask
+
+    def map_batches(self, texts: Sequence[str], batch_size: int, fn: Callable[[List[int]], List[Any]]) -> List[Any]:
+        """Call fn(indices) on length-sorted batches concurrently; results come back in input order"""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        futures = [self.executor.submit(fn, batch) for batch in batches]
+
+        results: List[Any] = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for index, result in zip(batch, future.result()):
+                results[index] = result
+        return results
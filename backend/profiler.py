@@ -0,0 +1,270 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Tắt mặc định; bật để lấy profile của request chậm hoặc được lấy mẫu
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Tỉ lệ request được profile dù không chậm (0.01 = 1%)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Request chạy lâu hơn ngưỡng này thì luôn được ghi lại (0 = chỉ theo tỉ lệ lấy mẫu)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "10000"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# Số request được theo dõi cùng lúc trong một worker; request vượt quá thì bỏ qua
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "4"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./chroma_store/profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_MAX_AGE_S = float(os.getenv("PROFILE_MAX_AGE_S", str(3 * 24 * 3600)))
+
+MAX_STACK_DEPTH = 64
+MAX_STACKS_SAVED = 500
+MAX_STAGES_SAVED = 500
+# Luồng đang chờ (lock, queue, selector) không tốn CPU, bỏ khỏi profile
+IDLE_LEAF_FILES = ("threading.py", "selectors.py", "queue.py")
+# Worker của ThreadPoolExecutor chờ việc trong SimpleQueue.get (hàm C, không có frame Python)
+IDLE_LEAF_FUNCTIONS = ("thread.py:_worker",)
+SKIPPED_PATHS = ("/metrics", "/admin")
+
+_PROFILE_ID = re.compile(r"^[0-9]+_[0-9]+_[0-9]+$")
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """Stack samples and stage timings collected while one request runs"""
+
+    __slots__ = ("method", "path", "sampled", "wall_start", "started", "stages", "samples", "ticks", "peak_concurrency")
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.wall_start = time.time()
+        self.started = time.perf_counter()
+        self.stages: List[tuple] = []
+        self.samples: Counter = Counter()
+        self.ticks = 0
+        self.peak_concurrency = 1
+
+
+class RequestProfiler:
+    """Opt-in request profiler: wall-clock stack sampling plus a per-stage timing breakdown.
+
+    A request is watched when it is picked by PROFILE_SAMPLE_RATE, or, with PROFILE_SLOW_MS
+    set, always (up to PROFILE_MAX_CONCURRENT at once per worker). While at least one
+    request is watched a sampler thread reads sys._current_frames() every
+    PROFILE_INTERVAL_MS and adds the busy threads' stacks to every watched request; with
+    nothing watched it sleeps. Samples therefore cover the whole worker during the
+    request, and peak_concurrency in the saved profile tells how many requests shared it.
+    Stage timings come from the tracing spans finished inside the request's context.
+
+    Sampled requests, and requests slower than PROFILE_SLOW_MS, are written as JSON to
+    PROFILE_DIR, keeping at most PROFILE_MAX_FILES files younger than PROFILE_MAX_AGE_S.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, enabled: bool = PROFILE_ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._active: List[RequestProfile] = []
+        self._seq = 0
+        self._thread: Optional[threading.Thread] = None
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            # Nhận thời gian của các span tracing (auth, open_store, embed_query, generation...)
+            tracer.add_sink(self)
+
+    # ---------- tracer sink ----------
+
+    def count(self, name: str, value: float, attributes: Dict[str, Any]):
+        pass
+
+    def observe(self, name: str, value: float, attributes: Dict[str, Any]):
+        if name != "span.duration_ms":
+            return
+        profile = _current_profile.get()
+        if profile is not None and len(profile.stages) < MAX_STAGES_SAVED:
+            ended_ms = (time.perf_counter() - profile.started) * 1000
+            profile.stages.append((attributes.get("span"), round(ended_ms - value, 2), round(value, 2)))
+
+    # ---------- request lifecycle ----------
+
+    def begin(self, method: str, path: str) -> Optional[RequestProfile]:
+        if not self.enabled or path.startswith(SKIPPED_PATHS):
+            return None
+        sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not sampled and PROFILE_SLOW_MS <= 0:
+            return None
+        with self._cond:
+            if len(self._active) >= PROFILE_MAX_CONCURRENT:
+                return None
+            profile = RequestProfile(method, path, sampled)
+            self._active.append(profile)
+            for other in self._active:
+                other.peak_concurrency = max(other.peak_concurrency, len(self._active))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return profile
+
+    def end(self, profile: RequestProfile, status: int) -> Optional[Dict[str, Any]]:
+        """Stop watching; returns the report when the request has to be saved"""
+        duration_ms = (time.perf_counter() - profile.started) * 1000
+        with self._cond:
+            self._active.remove(profile)
+        slow = PROFILE_SLOW_MS > 0 and duration_ms >= PROFILE_SLOW_MS
+        if not (profile.sampled or slow):
+            return None
+        return self._report(profile, status, duration_ms, "slow" if slow else "sampled")
+
+    def save(self, report: Dict[str, Any]):
+        with self._cond:
+            self._seq += 1
+            profile_id = f"{int(report['started_at'] * 1000)}_{os.getpid()}_{self._seq}"
+        report["id"] = profile_id
+        path = os.path.join(self.directory, f"{profile_id}.json")
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+            self.prune()
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save request profile: {e}")
+
+    # ---------- stored profiles ----------
+
+    def prune(self):
+        """Drop profiles older than PROFILE_MAX_AGE_S, then the oldest beyond PROFILE_MAX_FILES"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except FileNotFoundError:
+                    continue
+        entries.sort(reverse=True)
+        cutoff = time.time() - PROFILE_MAX_AGE_S
+        for index, (mtime, name) in enumerate(entries):
+            if index >= PROFILE_MAX_FILES or mtime < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest stored profiles (summary fields only)"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted((name for name in os.listdir(self.directory) if name.endswith(".json")), reverse=True)
+        summaries = []
+        for name in names[:limit]:
+            report = self.load(name[:-len(".json")])
+            if report is not None:
+                summaries.append({key: report.get(key) for key in ("id", "method", "path", "status", "trigger", "started_at", "duration_ms")})
+        return summaries
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    # ---------- internals ----------
+
+    def _report(self, profile: RequestProfile, status: int, duration_ms: float, trigger: str) -> Dict[str, Any]:
+        stage_totals: Dict[str, Dict[str, float]] = {}
+        for name, _, stage_ms in profile.stages:
+            total = stage_totals.setdefault(name, {"count": 0, "total_ms": 0.0})
+            total["count"] += 1
+            total["total_ms"] = round(total["total_ms"] + stage_ms, 2)
+        return {
+            "method": profile.method,
+            "path": profile.path,
+            "status": status,
+            "trigger": trigger,
+            "started_at": profile.wall_start,
+            "duration_ms": round(duration_ms, 2),
+            "peak_concurrency": profile.peak_concurrency,
+            "stages": stage_totals,
+            "timeline": [{"name": name, "start_ms": start, "duration_ms": stage_ms} for name, start, stage_ms in sorted(profile.stages, key=lambda stage: stage[1])],
+            "sample_interval_ms": PROFILE_INTERVAL_MS,
+            "sample_ticks": profile.ticks,
+            # Định dạng "collapsed stack": dùng trực tiếp với flamegraph.pl / speedscope
+            "stacks": [{"stack": stack, "samples": samples} for stack, samples in profile.samples.most_common(MAX_STACKS_SAVED)],
+        }
+
+    def _sample(self) -> List[str]:
+        own = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            leaf_file = os.path.basename(frame.f_code.co_filename)
+            if thread_id == own or leaf_file in IDLE_LEAF_FILES or f"{leaf_file}:{frame.f_code.co_name}" in IDLE_LEAF_FUNCTIONS:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stacks.append(";".join(reversed(names)))
+        return stacks
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                watched = list(self._active)
+            stacks = self._sample()
+            for profile in watched:
+                profile.ticks += 1
+                profile.samples.update(stacks)
+            time.sleep(interval)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware feeding requests to the profiler; a pass-through while profiling is off"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        profile = request_profiler.begin(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_profile.reset(token)
+            report = request_profiler.end(profile, status)
+            if report is not None:
+                await asyncio.to_thread(request_profiler.save, report)
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,131 @@
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from cachetools import TTLCache
+from filelock import FileLock
+
+from tracing import count
+
+logger = logging.getLogger(__name__)
+
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "300"))
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "20000"))
+# Mỗi scope bị invalidate có một file "epoch" chứa bộ đếm; các worker khác so bộ đếm để biết cache đã cũ
+READ_CACHE_EPOCH_DIR = os.getenv("READ_CACHE_EPOCH_DIR", "./chroma_store/read_cache")
+
+
+def user_scope(user_id: str) -> str:
+    return f"user-{user_id}"
+
+
+def chat_scope(chat_history_id: str) -> str:
+    return f"chat-{chat_history_id}"
+
+
+class ReadCache:
+    """Per-user read-through cache for sidebar/listing queries.
+
+    Entries are keyed by (user_id, resource, scope) where scope is a user or a chat.
+    `invalidate(scope)` drops every entry of that scope in this process and increments
+    the counter in the scope's epoch file, so other worker processes treat their copies
+    as stale on the next read (one small file read per hit) instead of serving them
+    until the TTL expires. Entries remember the counter read before loading, so an
+    invalidation that lands while the loader runs is never missed, however close
+    together the two happen.
+    """
+
+    def __init__(
+        self,
+        ttl: float = READ_CACHE_TTL,
+        max_entries: int = READ_CACHE_MAX_ENTRIES,
+        epoch_dir: str = READ_CACHE_EPOCH_DIR,
+    ):
+        self.epoch_dir = epoch_dir
+        self._entries: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        # chat_history_id -> user_id, để invalidate danh sách chat khi chỉ biết chat id.
+        # Cùng TTL với cache: danh sách chat của user không sống lâu hơn bản ghi owner của nó
+        self._chat_owner: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.epoch_dir, exist_ok=True)
+
+    def _epoch_path(self, scope: str) -> str:
+        return os.path.join(self.epoch_dir, scope)
+
+    def _epoch(self, scope: str) -> int:
+        try:
+            with open(self._epoch_path(scope), "r") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_epoch(self, scope: str):
+        path = self._epoch_path(scope)
+        with FileLock(f"{path}.lock"):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(self._epoch(scope) + 1))
+            # Thay file nguyên tử: worker đang đọc không thấy file rỗng
+            os.replace(tmp_path, path)
+
+    def get_or_load(self, user_id: str, resource: str, scope: str, loader: Callable[[], Any]) -> Any:
+        """Return the cached value, or call loader() and cache its result"""
+        key = (user_id, resource, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == self._epoch(scope):
+            self.hits += 1
+            count("cache.hits", cache="read", resource=resource)
+            return entry[1]
+
+        self.misses += 1
+        count("cache.misses", cache="read", resource=resource)
+        # Đọc epoch trước khi load: invalidate xảy ra trong lúc load làm entry này cũ ngay
+        epoch = self._epoch(scope)
+        value = loader()
+        with self._lock:
+            self._entries[key] = (epoch, value)
+        return value
+
+    def remember_chat_owner(self, chat_history_ids: List[str], user_id: str):
+        with self._lock:
+            for chat_history_id in chat_history_ids:
+                self._chat_owner[chat_history_id] = user_id
+
+    def chat_owner(self, chat_history_id: str) -> Optional[str]:
+        with self._lock:
+            return self._chat_owner.get(chat_history_id)
+
+    def invalidate(self, *scopes: str):
+        """Drop every cached entry of the given scopes, in this and other processes"""
+        with self._lock:
+            for key in [key for key in self._entries.keys() if key[2] in scopes]:
+                self._entries.pop(key, None)
+        for scope in scopes:
+            try:
+                self._bump_epoch(scope)
+            except OSError as e:
+                logger.warning(f"⚠️ Could not bump cache epoch for {scope}: {e}")
+
+    def invalidate_chat(self, chat_history_id: str):
+        """A chat's files/messages/notes changed; its position in the owner's list may too"""
+        owner = self.chat_owner(chat_history_id)
+        if owner:
+            self.invalidate(chat_scope(chat_history_id), user_scope(owner))
+        else:
+            self.invalidate(chat_scope(chat_history_id))
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+read_cache = ReadCache()
+
+
+def invalidate_on_flush(table: str, rows: List[Dict[str, Any]]):
+    """write_behind flush hook: rows just reached Supabase, cached listings are stale"""
+    for chat_history_id in {row.get("chat_history_id") for row in rows if row.get("chat_history_id")}:
+        read_cache.invalidate_chat(chat_history_id)
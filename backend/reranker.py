@@ -0,0 +1,76 @@
+import os
+import logging
+import threading
+from typing import Any, List, Optional, Tuple
+
+from onnx_model import OnnxModel
+
+logger = logging.getLogger(__name__)
+
+# Thư mục chứa model cross-encoder đã export sang ONNX: model.onnx + tokenizer.json
+# (ví dụ jina-reranker-v2-base-multilingual hoặc bge-reranker-base cho vi/en/ja)
+RERANKER_MODEL_DIR = os.getenv("RERANKER_MODEL_DIR")
+# Số ứng viên lấy từ vector search trước khi rerank xuống còn k
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", str(os.cpu_count() or 1)))
+
+
+class OnnxReranker:
+    """Local cross-encoder that scores (query, passage) pairs on CPU with ONNX Runtime.
+
+    Session setup and length-sorted concurrent batching come from onnx_model.OnnxModel.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        batch_size: int = RERANK_BATCH_SIZE,
+        max_length: int = RERANK_MAX_LENGTH,
+        threads: int = RERANK_THREADS,
+    ):
+        self.model = OnnxModel(model_dir, max_length, threads, thread_name_prefix="rerank")
+        self.batch_size = batch_size
+
+    def _score_batch(self, query: str, passages: List[str]) -> List[float]:
+        logits, _ = self.model.run([(query, passage) for passage in passages])
+        # Model 1 logit: điểm liên quan; model 2 lớp: lấy logit của lớp "relevant"
+        if logits.ndim == 2:
+            logits = logits[:, -1]
+        return logits.astype(float).tolist()
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        """Relevance score for each passage (higher is better)"""
+        return self.model.map_batches(passages, self.batch_size, lambda batch: self._score_batch(query, [passages[i] for i in batch]))
+
+    def rerank(self, query: str, docs: List[Any], top_k: int) -> List[Tuple[Any, float]]:
+        """Return the top_k (doc, score) pairs, best first"""
+        if not docs:
+            return []
+        scores = self.score(query, [doc.page_content for doc in docs])
+        ranked = sorted(zip(docs, scores), key=lambda pair: pair[1], reverse=True)
+        return ranked[:top_k]
+
+
+_reranker: Optional[OnnxReranker] = None
+_reranker_lock = threading.Lock()
+_reranker_failed = False
+
+
+def get_reranker() -> Optional[OnnxReranker]:
+    """Shared reranker instance, or None when RERANKER_MODEL_DIR is not configured"""
+    global _reranker, _reranker_failed
+    if not RERANKER_MODEL_DIR or _reranker_failed:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None and not _reranker_failed:
+                try:
+                    _reranker = OnnxReranker(RERANKER_MODEL_DIR)
+                    logger.info(f"✅ Reranker loaded from {RERANKER_MODEL_DIR}")
+                except Exception as e:
+                    # Không có model thì vẫn chạy retrieval bình thường
+                    logger.error(f"❌ Error loading reranker, reranking disabled: {e}")
+                    _reranker_failed = True
+    return _reranker
@@ -1,3 +1,9 @@
 #!/bin/bash
 
-uvicorn main:app --host 0.0.0.0 --port 10000
\ No newline at end of file
+# Các worker uvicorn ghi metrics vào thư mục chung để /metrics trả về số liệu của cả nhóm;
+# xoá số liệu của lần chạy trước khi khởi động
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/docwhiz_metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+uvicorn main:app --host 0.0.0.0 --port 10000 --workers ${WEB_CONCURRENCY:-1}
@@ -1,42 +1,50 @@
 import os
 import time
 import json
+import logging
 import requests
 from typing import List, Dict, Any, Optional
 from loader import ParallelLoader
-from langchain_community.vectorstores import Chroma
 from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
-import google.generativeai as genai
 import threading
 from uuid import uuid4
 from datetime import datetime
-from supabase import create_client, Client
+from http_clients import get_supabase, get_http_session, HTTP_TIMEOUT
+from write_behind import write_behind
+from file_catalog import FileManager, file_catalog
+from chroma_layout import collection_name, resolve_store_dir, vacuum_store
+from collection_writer import upsert_chunks, delete_file_chunks, submit_write, sidecar_dir
 from summary import Summarizer
 from fastapi import BackgroundTasks
 from transform_json_to_hierarchy import transform_json_to_hierarchy
+from artifact_scheduler import artifact_scheduler, PRIORITY_SUMMARY, PRIORITY_MINDMAP, PRIORITY_MAINTENANCE
+from context_builder import ContextBuilder
+from reranker import get_reranker, RERANK_CANDIDATES
+from embedding_batcher import BatchedQueryEmbeddings, QUERY_BATCHING
+from vector_index import (
+    get_sidecar, needs_sidecar,
+    EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS, EMBEDDING_FULL_DIMENSIONS, JINA_EMBEDDING_DIMENSIONS, RESCORE_CANDIDATES,
+)
+from llm_client import llm_client, configure_genai, LLMBusyError, LLM_PRIORITY_INTERACTIVE, LLM_PRIORITY_BACKGROUND, LLM_INTERACTIVE_DEADLINE
+from tracing import span, count, observe, traced
+
+logger = logging.getLogger(__name__)
 
 # Configure Gemini API for generation only
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+configure_genai(os.environ["GEMINI_API_KEY"])
 
 def update_file_content_to_files(chat_history_id: str, file_id: str, file_content: str):
-    """Hàm chạy trong luồng riêng để update content"""
+    """Queue the extracted content for the files table (written in the background)"""
     try:
-        # Supabase client
-        supabase: Client = create_client(
-            os.getenv("SUPABASE_URL"),
-            os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
+        write_behind.update(
+            "files",
+            {"chat_history_id": chat_history_id, "file_id": file_id},
+            {"file_content": file_content},
         )
-
-        # update summary content to table files
-        data = {
-            "file_content": file_content,
-        }
-
-        response = supabase.table("files").update(data).eq("chat_history_id", chat_history_id).eq("file_id", file_id).execute()
-        print("✅ Content saved to Supabase")
+        logger.debug("✅ Content queued for Supabase")
     except Exception as e:
-        print(f"❌ Error in update thread: {e}")
+        logger.error(f"❌ Error queueing file content: {e}")
 
 class JinaEmbeddings(Embeddings):
     def __init__(self, api_key: Optional[str] = None):
@@ -56,26 +64,31 @@ class JinaEmbeddings(Embeddings):
         payload = {
             "model": self.model,
             "task": task,
-            "dimensions": 1024,  # Jina v3 supports up to 8192, but 1024 is efficient
+            "dimensions": JINA_EMBEDDING_DIMENSIONS,  # Jina v3 supports up to 8192, but 1024 is efficient
             "input": texts
         }
         
+        count("jina.calls", task=task)
         try:
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            data = response.json()
+            with span("jina.embed", task=task, inputs=len(texts)):
+                response = get_http_session().post(
+                    self.base_url,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=HTTP_TIMEOUT
+                )
+                response.raise_for_status()
+
+                data = response.json()
+            count("jina.tokens", data.get("usage", {}).get("total_tokens", 0), task=task)
             return [item["embedding"] for item in data["data"]]
             
         except requests.exceptions.RequestException as e:
-            print(f"❌ Error making request to Jina AI: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response: {e.response.text}")
+            status = e.response.status_code if getattr(e, "response", None) is not None else None
+            count("jina.rate_limited" if status == 429 else "jina.errors", task=task)
+            logger.error(f"❌ Error making request to Jina AI: {e}")
+            if status is not None:
+                logger.error(f"Response: {e.response.text}")
             raise e
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
@@ -83,6 +96,11 @@ class JinaEmbeddings(Embeddings):
         embeddings = []
         batch_size = 10  # Process in batches to avoid rate limits
         
+        with span("embed_documents", backend="jina", texts=len(texts)):
+            self._embed_batches(texts, batch_size, embeddings)
+        return embeddings
+
+    def _embed_batches(self, texts: List[str], batch_size: int, embeddings: List[List[float]]):
         for i in range(0, len(texts), batch_size):
             batch = texts[i:i + batch_size]
             try:
@@ -94,87 +112,81 @@ class JinaEmbeddings(Embeddings):
                     time.sleep(0.5)
                     
             except Exception as e:
-                print(f"❌ Error embedding batch {i//batch_size + 1}: {e}")
+                logger.error(f"❌ Error embedding batch {i//batch_size + 1}: {e}")
+                count("jina.failed_batches")
                 # Add zero vectors for failed embeddings
                 for _ in batch:
-                    embeddings.append([0.0] * 1024)
-        
-        return embeddings
+                    embeddings.append([0.0] * JINA_EMBEDDING_DIMENSIONS)
 
     def embed_query(self, text: str) -> List[float]:
         """Embed a single query"""
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one request (used by the query micro-batcher)"""
         try:
-            result = self._make_request([text], task="retrieval.query")
-            return result[0]
+            return self._make_request(texts, task="retrieval.query")
         except Exception as e:
-            print(f"❌ Error embedding query: {e}")
-            return [0.0] * 1024
-
-class FileManager:
-    """Quản lý thông tin file và mapping"""
-    
-    def __init__(self, user_id: str, chat_history_id: str):
-        self.user_id = user_id
-        self.chat_history_id = chat_history_id
-        self.metadata_file = f"./chroma_store/{user_id}/chat_{chat_history_id}_files.json"
-        self.files_info = self.load_files_info()
-    
-    def load_files_info(self) -> Dict:
-        """Load file metadata"""
-        if os.path.exists(self.metadata_file):
-            try:
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"❌ Error loading files info: {e}")
-        return {}
-    
-    def save_files_info(self):
-        """Save file metadata"""
-        os.makedirs(os.path.dirname(self.metadata_file), exist_ok=True)
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(self.files_info, f, ensure_ascii=False, indent=2)
-    
-    def add_file(self, file_id: str, filename: str, file_type: str = None):
-        """Add file information"""
-        self.files_info[file_id] = {
-            'filename': filename,
-            'file_type': file_type,
-            'added_at': time.time(),
-            'chunk_count': 0
-        }
-        self.save_files_info()
-    
-    def remove_file(self, file_id: str):
-        """Remove file information"""
-        if file_id in self.files_info:
-            del self.files_info[file_id]
-            self.save_files_info()
-    
-    def get_all_files(self) -> List[str]:
-        """Get all file IDs"""
-        return list(self.files_info.keys())
-    
-    def get_file_info(self, file_id: str) -> Dict:
-        """Get specific file info"""
-        return self.files_info.get(file_id, {})
+            logger.error(f"❌ Error embedding query: {e}")
+            return [[0.0] * JINA_EMBEDDING_DIMENSIONS for _ in texts]
+
+_shared_embeddings = None
+_shared_embeddings_lock = threading.Lock()
+
+def create_embedding_model(jina_api_key: Optional[str] = None) -> Embeddings:
+    """Return the embedding backend selected by EMBEDDING_BACKEND.
+
+    The default instance is shared by the whole process so concurrent embed_query
+    calls from different requests can be micro-batched together.
+    """
+    global _shared_embeddings
+    if EMBEDDING_BACKEND not in ("jina", "local"):
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+    if EMBEDDING_BACKEND == "jina" and jina_api_key:
+        # Key riêng: không dùng chung batcher với key mặc định
+        return JinaEmbeddings(api_key=jina_api_key)
+
+    with _shared_embeddings_lock:
+        if _shared_embeddings is None:
+            if EMBEDDING_BACKEND == "local":
+                # Model local nặng nên chỉ load một lần cho cả process
+                from local_embeddings import OnnxEmbeddings
+                embeddings = OnnxEmbeddings()
+                if embeddings.dimension != EMBEDDING_FULL_DIMENSIONS:
+                    # Collection/sidecar được đặt tên và cắt theo số chiều khai báo: sai thì hỏng index
+                    raise ValueError(
+                        f"Local embedding model returns {embeddings.dimension}-d vectors but "
+                        f"LOCAL_EMBEDDING_DIMENSIONS is {EMBEDDING_FULL_DIMENSIONS}"
+                    )
+                logger.info(f"✅ Local embedding model loaded from {embeddings.model_dir}")
+            else:
+                embeddings = JinaEmbeddings()
+            _shared_embeddings = BatchedQueryEmbeddings(embeddings) if QUERY_BATCHING else embeddings
+    return _shared_embeddings
 
 class MultiFileRAGSystem:
+    @traced("rag_init")
     def __init__(self, user_id: str, chat_history_id: str, jina_api_key: Optional[str] = None):
         self.user_id = user_id
         self.chat_history_id = chat_history_id
         
-        self.embedding_model = JinaEmbeddings(api_key=jina_api_key)
-        self.persist_dir = f"./chroma_store/{user_id}"
-        # Sử dụng 1 collection cho tất cả files của user trong chat này
-        self.collection_name = f"{user_id}_{chat_history_id}"
+        self.embedding_model = create_embedding_model(jina_api_key)
+        # Thư mục Chroma theo layout CHROMA_SHARDING (chat cũ giữ nguyên chỗ đã ghi)
+        self.persist_dir = resolve_store_dir(user_id, chat_history_id)
+        self.collection_name = collection_name(user_id, chat_history_id)
         self.chroma = None
+
+        # Index rút gọn (Matryoshka/int8/binary) + vector đầy đủ để chấm lại
+        self.vector_sidecar = None
+        if needs_sidecar():
+            self.vector_sidecar = get_sidecar(sidecar_dir(self.persist_dir, self.collection_name))
+        self.last_retrieval_timings = {}
         
         # File manager
-        self.file_manager = FileManager(user_id, chat_history_id)
+        self._file_manager = None
         
-        # Generation model
-        self.generation_model = genai.GenerativeModel('gemini-2.5-pro')
+        # Generation model (mọi lời gọi đi qua llm_client để chia sẻ quota)
+        self.generation_model_name = 'gemini-2.5-pro'
     
     def save_summary_to_mindmapnote(self, chat_history_id: str, file_id: str, file_summary: str):
         try:
@@ -182,59 +194,36 @@ class MultiFileRAGSystem:
             created_at = datetime.utcnow().isoformat()
 
             # Take filename from supabase
-            supabase: Client = create_client(
-                os.getenv("SUPABASE_URL"),
-                os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
-            )
+            supabase = get_supabase()
             file_name = supabase.table("files").select("file_name").eq("file_id", file_id).eq("chat_history_id", chat_history_id).execute()
 
             if file_name.data is None or not file_name.data:
-                print("❌ File name not found")
+                logger.error("❌ File name not found")
                 return
 
             file_name = file_name.data[0]["file_name"]
             if '.pdf' in file_name:
                 file_name = file_name.replace('.pdf', '')
                 
-            update_res = (
-                supabase
-                .table("mindmapnotes")
-                .insert({"mindmap_note_id": mindmapnote_id, "chat_history_id": chat_history_id, "note_content": file_summary, "mindmap_note_name": file_name, "note_content": file_summary, "created_at": created_at, "type": "note"})
-                .execute()
-            )
-            if update_res.data is None:
-                print("❌ Update failed")
-            else:
-                print("✅ File summary updated in mindmapnotes.")
+            write_behind.insert("mindmapnotes", {"mindmap_note_id": mindmapnote_id, "chat_history_id": chat_history_id, "note_content": file_summary, "mindmap_note_name": file_name, "created_at": created_at, "type": "note"})
+            logger.debug("✅ File summary queued for mindmapnotes.")
         except Exception as e:
-            print("❌ Exception in background task:", e)
+            logger.error(f"❌ Exception in background task: {e}")
 
     
     def save_summary_to_files(self, chat_history_id: str, file_id: str, summary: str):
         try:
-            # Supabase client
-            supabase: Client = create_client(
-                os.getenv("SUPABASE_URL"),
-                os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
-            )
-
             # update summary content to table files
             data = {
                 "file_summary": summary,
             }
 
-            response = supabase.table("files").update(data).eq("chat_history_id", chat_history_id).eq("file_id", file_id).execute()
-            print("✅ Summary saved to Supabase")
+            write_behind.update("files", {"chat_history_id": chat_history_id, "file_id": file_id}, data)
+            logger.debug("✅ Summary queued for Supabase")
         except Exception as e:
-            print(f"❌ Error saving summary to Supabase: {e}")
+            logger.error(f"❌ Error saving summary to Supabase: {e}")
     def save_mindmap_to_supabase(self, chat_history_id: str, mindmap_name: str, mindmap_content: dict):
         try:
-            # Supabase client
-            supabase: Client = create_client(
-                os.getenv("SUPABASE_URL"),
-                os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # sử dụng service role để ghi
-            )
-
             mindmap_id = str(uuid4())
             created_at = datetime.utcnow().isoformat()
 
@@ -247,11 +236,11 @@ class MultiFileRAGSystem:
                 "created_at": created_at
             }
 
-            response = supabase.table("mindmapnotes").insert(data).execute()
-            print("✅ Mindmap saved to Supabase")
-            return response
+            write_behind.insert("mindmapnotes", data)
+            logger.debug("✅ Mindmap queued for Supabase")
+            return data
         except Exception as e:
-            print(f"❌ Error saving mindmap to Supabase: {e}")
+            logger.error(f"❌ Error saving mindmap to Supabase: {e}")
             return None
 
     def generate_summary_from_chunks(self, chat_history_id: str, file_id: str):
@@ -259,26 +248,21 @@ class MultiFileRAGSystem:
         if self.chroma is None:
             self.load_existing_store()
         if self.chroma is None:
-            print("❌ No vector store found for summary generation.")
+            logger.error("❌ No vector store found for summary generation.")
             return
 
         try:
             # Lấy các chunks liên quan đến file_id
             results = self.chroma.get(where={"file_id": file_id})
             if not results["documents"]:
-                print(f"⚠️ No chunks found for file_id {file_id}")
+                logger.warning(f"⚠️ No chunks found for file_id {file_id}")
                 return
 
             # Nối nội dung
             content = "\n".join(results["documents"]) 
 
-            # Tạo luồng riêng để thực hiện update content lên bảng files của supabase
-            update_content_thread = threading.Thread(
-                target=update_file_content_to_files,
-                args=(chat_history_id, file_id, content),
-                daemon=True
-            )
-            update_content_thread.start()
+            # Ghi content lên bảng files qua hàng đợi write-behind (gộp với summary cùng row)
+            update_file_content_to_files(chat_history_id, file_id, content)
 
             try:
                 summarizer = Summarizer()
@@ -288,10 +272,10 @@ class MultiFileRAGSystem:
                 self.save_summary_to_mindmapnote(chat_history_id, file_id, summary)
 
             except Exception as e:
-                print(f"❌ Error generating summary: {e}")
+                logger.error(f"❌ Error generating summary: {e}")
 
         except Exception as e:
-            print(f"❌ Error in background summary generation: {e}")
+            logger.error(f"❌ Error in background summary generation: {e}")
 
 
     def generate_mindmap_from_chunks(self, chat_history_id: str, file_id: str):
@@ -299,14 +283,14 @@ class MultiFileRAGSystem:
         if self.chroma is None:
             self.load_existing_store()
         if self.chroma is None:
-            print("❌ No vector store found for mindmap generation.")
+            logger.error("❌ No vector store found for mindmap generation.")
             return
 
         try:
             # Lấy các chunks liên quan đến file_id
             results = self.chroma.get(where={"file_id": file_id})
             if not results["documents"]:
-                print(f"⚠️ No chunks found for file_id {file_id}")
+                logger.warning(f"⚠️ No chunks found for file_id {file_id}")
                 return
             
             # Nối các page_content lại thành content
@@ -347,8 +331,8 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
 """
             # Gọi model sinh JSON
             try:
-                response = self.generation_model.generate_content(prompt)
-                json_text = response.text[response.text.find('{'):response.text.rfind('}') + 1]
+                response_text = llm_client.generate(self.generation_model_name, prompt, priority=LLM_PRIORITY_BACKGROUND)
+                json_text = response_text[response_text.find('{'):response_text.rfind('}') + 1]
                 
                 mindmap = json.loads(json_text)
 
@@ -366,18 +350,28 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
 
                 self.save_mindmap_to_supabase(chat_history_id, mindmap_name, mindmap)
                 
-                print(f"✅ Mindmap JSON generated and saved: {mindmap_name}")
+                logger.info(f"✅ Mindmap JSON generated and saved: {mindmap_name}")
             except Exception as e:
-                print(f"❌ Error generating mindmap: {e}")
+                logger.error(f"❌ Error generating mindmap: {e}")
         except Exception as e:
-            print(f"❌ Error in background mindmap generation: {e}")
+            logger.error(f"❌ Error in background mindmap generation: {e}")
 
-    def store_documents(self, contents, file_id: str, filename: str, file_type: str = None):
-        """Store documents from a specific file"""
-        loader = ParallelLoader(file_content=contents, max_workers=4)
-        print(f"📂 Loading {filename}...")
+    def store_documents(self, contents=None, file_id: str = None, filename: str = None, file_type: str = None, file_path: str = None, schedule_artifacts: bool = True):
+        """Store documents from a specific file (bytes in `contents`, or a spooled file at `file_path`).
+
+        schedule_artifacts=False leaves summary/mindmap scheduling to the caller, e.g. until
+        the files row they update has been inserted.
+        """
+        with span("store_documents", file_id=file_id, file_type=file_type) as store_span:
+            return self._store_documents(store_span, contents, file_id, filename, file_type, file_path, schedule_artifacts)
+
+    def _store_documents(self, store_span, contents, file_id, filename, file_type, file_path, schedule_artifacts):
+        loader = ParallelLoader(file_content=contents, max_workers=4, file_path=file_path)
+        logger.info(f"📂 Loading {filename}...")
         doc_chunks = loader.load_chunks()
-        print(f"📂 {len(doc_chunks)} chunks loaded")
+        store_span.set("chunks", len(doc_chunks))
+        count("ingest.files")
+        count("ingest.chunks", len(doc_chunks))
         
         # Add file_id to metadata of each chunk
         for doc in doc_chunks:
@@ -387,35 +381,22 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
                 'file_type': file_type
             })
         
-        print(f"📊 Processing {len(doc_chunks)} chunks from {filename}...")
+        logger.info(f"📊 Processing {len(doc_chunks)} chunks from {filename}...")
         
         try:
-            # Load existing store or create new one
-            if self.chroma is None:
-                print("📂 Loading existing vector store...")
-                self.load_existing_store()
-            
+            # Embedding chạy song song giữa các upload; chỉ phần ghi vào collection
+            # đi qua writer duy nhất của collection (gộp batch, khoá giữa các process)
+            vectors = self.embedding_model.embed_documents([doc.page_content for doc in doc_chunks])
+            ids = [f"{file_id}_{doc.metadata['chunk_id']}" for doc in doc_chunks]
+            with span("vector_upsert", chunks=len(ids)):
+                file_catalog.register_store(self.user_id, self.chat_history_id, self.persist_dir)
+                upsert_chunks(self.persist_dir, self.collection_name, ids, doc_chunks, vectors).result()
+
             if self.chroma is None:
-                # Create new store
-                print("📂 Creating new vector store...")
-                self.chroma = Chroma.from_documents(
-                    documents=doc_chunks,
-                    embedding=self.embedding_model,
-                    persist_directory=self.persist_dir,
-                    collection_name=self.collection_name,
-                )
-                print("✅ New vector store created")
-            else:
-                # Add to existing store
-                print("📂 Adding to existing vector store...")
-                self.chroma.add_documents(doc_chunks)
-            
-            self.chroma.persist()
+                self.chroma = self._open_store()
             
             # Update file manager
-            self.file_manager.add_file(file_id, filename, file_type)
-            self.file_manager.files_info[file_id]['chunk_count'] = len(doc_chunks)
-            self.file_manager.save_files_info()
+            self.file_manager.add_file(file_id, filename, file_type, chunk_count=len(doc_chunks))
             
             # Save loaded chunks to file for reference
             chunk_output_dir = os.path.join(self.persist_dir, "chunk_logs")
@@ -423,90 +404,174 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
             out_path = os.path.join(chunk_output_dir, f"{file_id}_{filename.replace(' ', '_')}.txt")
 
 
-            # Thread tạo summary
-            threading.Thread(
-                target=self.generate_summary_from_chunks,
-                args=(self.chat_history_id, file_id,),
-                daemon=True
-            ).start()
+            if schedule_artifacts:
+                self.schedule_default_artifacts(file_id)
 
             return True
             
         except Exception as e:
-            print(f"❌ Error storing documents: {e}")
+            logger.error(f"❌ Error storing documents: {e}")
+            store_span.set("error", str(e))
             return False
 
+    def schedule_default_artifacts(self, file_id: str):
+        """Queue summary and mindmap generation for a file on the background scheduler"""
+        artifact_scheduler.submit("summary", self.user_id, self.chat_history_id, file_id)
+        artifact_scheduler.submit("mindmap", self.user_id, self.chat_history_id, file_id)
+
     def remove_file_documents(self, file_id: str):
         """Remove all documents from a specific file"""
         if self.chroma is None:
             self.load_existing_store()
         
         if self.chroma is None:
-            print("❌ No vector store found")
+            logger.error("❌ No vector store found")
             return False
         
         try:
-            # Get all documents with this file_id
-            results = self.chroma.get(where={"file_id": file_id})
+            # Xoá qua writer của collection để không tranh lock với các upload đang ghi
+            removed = delete_file_chunks(self.persist_dir, self.collection_name, file_id).result()
             
-            if results['ids']:
-                # Delete documents by IDs
-                self.chroma.delete(ids=results['ids'])
-                self.chroma.persist()
-                
+            if removed:
                 # Remove from file manager
                 filename = self.file_manager.get_file_info(file_id).get('filename', 'Unknown')
                 self.file_manager.remove_file(file_id)
                 
-                print(f"✅ Removed {len(results['ids'])} chunks from {filename}")
+                logger.info(f"✅ Removed {removed} chunks from {filename}")
+                # Thu hồi dung lượng của các chunk đã xoá (chạy nền, gộp theo chat)
+                artifact_scheduler.submit("vacuum", self.user_id, self.chat_history_id, "")
                 return True
             else:
-                print(f"⚠️ No documents found for file_id: {file_id}")
+                logger.warning(f"⚠️ No documents found for file_id: {file_id}")
                 return False
                 
         except Exception as e:
-            print(f"❌ Error removing documents: {e}")
+            logger.error(f"❌ Error removing documents: {e}")
             return False
 
+    @property
+    def file_manager(self) -> FileManager:
+        # Chỉ mở catalog khi thực sự cần (chat/retrieve không đụng tới)
+        if self._file_manager is None:
+            self._file_manager = FileManager(self.user_id, self.chat_history_id)
+        return self._file_manager
+
+    @traced("open_store")
+    def _open_store(self):
+        # chromadb nặng: chỉ import khi lần đầu mở collection
+        from langchain_community.vectorstores import Chroma
+        return Chroma(
+            persist_directory=self.persist_dir,
+            collection_name=self.collection_name,
+            embedding_function=self.embedding_model,
+        )
+
+    def _backfill_sidecar(self):
+        """Build the sidecar from a collection created before it was enabled (full-size vectors only)"""
+        if EMBEDDING_DIMENSIONS < EMBEDDING_FULL_DIMENSIONS or self.vector_sidecar.count() > 0:
+            return
+        existing = self.chroma.get(include=["embeddings", "metadatas"])
+        if len(existing["ids"]) == 0:
+            return
+        logger.info(f"📂 Building vector sidecar from {len(existing['ids'])} existing chunks...")
+        submit_write(
+            self.persist_dir, self.collection_name, "sidecar_add",
+            ids=existing["ids"],
+            file_ids=[(metadata or {}).get('file_id') for metadata in existing["metadatas"]],
+            vectors=existing["embeddings"],
+        ).result()
+
+    def _sidecar_search(self, query_embedding: List[float], k: int, file_ids: Optional[List[str]]) -> List[Document]:
+        self._backfill_sidecar()
+        hits = self.vector_sidecar.search(query_embedding, k=k, candidates=RESCORE_CANDIDATES, file_ids=file_ids)
+        if not hits:
+            return []
+
+        found = self.chroma.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        docs = []
+        for chunk_id, score in hits:
+            doc = by_id.get(chunk_id)
+            if doc is not None:
+                doc.metadata["score"] = score
+                docs.append(doc)
+        return docs
+
     def load_existing_store(self):
         """Load existing vector store"""
         if os.path.exists(self.persist_dir):
             try:
-                self.chroma = Chroma(
-                    persist_directory=self.persist_dir,
-                    collection_name=self.collection_name,
-                    embedding_function=self.embedding_model,
-                )
-                print("✅ Existing vector store loaded")
+                self.chroma = self._open_store()
+                logger.info("✅ Existing vector store loaded")
                 return self.chroma
             except Exception as e:
-                print(f"❌ Error loading vector store: {e}")
+                logger.error(f"❌ Error loading vector store: {e}")
                 return None
         return None
 
-    def retrieve_documents(self, query: str, k: int = 5, file_ids: List[str] = None):
-        """Retrieve relevant documents, optionally filtered by file_ids"""
+    def retrieve_documents(self, query: str, k: int = 5, file_ids: List[str] = None, rerank: Optional[bool] = None):
+        """Retrieve relevant documents, optionally filtered by file_ids.
+
+        When a local reranker is configured (RERANKER_MODEL_DIR) and rerank is not False,
+        RERANK_CANDIDATES chunks are over-fetched from the vector store and the reranker
+        keeps the best k. Per-stage timings of the last call are kept in
+        self.last_retrieval_timings.
+        """
+        self.last_retrieval_timings = {}
         if self.chroma is None:
             self.load_existing_store()
         
         if self.chroma is None:
             return []
         
+        reranker = get_reranker() if rerank is not False else None
+        fetch_k = max(k, RERANK_CANDIDATES) if reranker is not None else k
+
         try:
             # Create filter if file_ids provided
             where_clause = None
             if file_ids:
                 where_clause = {"file_id": {"$in": file_ids}}
             
-            docs = self.chroma.similarity_search(
-                query, 
-                k=k,
-                filter=where_clause
-            )
-            return docs
+            started = time.perf_counter()
+            with span("embed_query"):
+                query_embedding = self.embedding_model.embed_query(query)
+            embedded = time.perf_counter()
+            with span("vector_search", k=fetch_k, sidecar=self.vector_sidecar is not None):
+                if self.vector_sidecar is not None:
+                    docs = self._sidecar_search(query_embedding, fetch_k, file_ids)
+                else:
+                    docs = self.chroma.similarity_search_by_vector(
+                        query_embedding,
+                        k=fetch_k,
+                        filter=where_clause
+                    )
+            searched = time.perf_counter()
+            self.last_retrieval_timings = {
+                "embed_query_ms": round((embedded - started) * 1000, 2),
+                "vector_search_ms": round((searched - embedded) * 1000, 2),
+                "candidates": len(docs),
+            }
+            observe("retrieval.embed_query_ms", self.last_retrieval_timings["embed_query_ms"])
+            observe("retrieval.vector_search_ms", self.last_retrieval_timings["vector_search_ms"])
+
+            if reranker is not None and len(docs) > 1:
+                with span("rerank", candidates=len(docs)):
+                    ranked = reranker.rerank(query, docs, top_k=k)
+                for doc, score in ranked:
+                    doc.metadata["rerank_score"] = score
+                docs = [doc for doc, _ in ranked]
+                self.last_retrieval_timings["rerank_ms"] = round((time.perf_counter() - searched) * 1000, 2)
+                observe("retrieval.rerank_ms", self.last_retrieval_timings["rerank_ms"])
+
+            return docs[:k]
             
         except Exception as e:
-            print(f"❌ Error during retrieval: {e}")
+            logger.error(f"❌ Error during retrieval: {e}")
+            count("retrieval.errors")
             return []
 
     def search_across_all_files(self, query: str, k: int = 5):
@@ -517,39 +582,47 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
         """Search only in specific files"""
         return self.retrieve_documents(query, k=k, file_ids=file_ids)
 
-    def generate_response_with_retry(self, prompt: str, max_retries: int = 3) -> str:
-        """Generate response with retry logic"""
-        for attempt in range(max_retries):
-            try:
-                response = self.generation_model.generate_content(prompt)
-                return response.text
-            except Exception as e:
-                if "429" in str(e) or "quota" in str(e).lower():
-                    wait_time = min(60 * (2 ** attempt), 300)
-                    print(f"⏳ Rate limit hit. Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"❌ Error: {e}")
-                    break
-        
-        return f"❌ Failed to generate response after {max_retries} attempts."
+    def generate_response_with_retry(self, prompt: str) -> str:
+        """Generate response for an interactive request.
+
+        Retries and 429 backoff are handled by llm_client, which raises LLMBusyError
+        instead of sleeping when the answer cannot start within the request deadline.
+        """
+        try:
+            return llm_client.generate(
+                self.generation_model_name,
+                prompt,
+                priority=LLM_PRIORITY_INTERACTIVE,
+                deadline_s=LLM_INTERACTIVE_DEADLINE,
+            )
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error: {e}")
+
+        return "❌ Failed to generate response."
 
     def chat(self, query: str, k: int = 5, file_ids: List[str] = None):
         """Main chat interface"""
+        with span("chat", k=k, filtered=bool(file_ids)):
+            return self._chat(query, k, file_ids)
+
+    def _chat(self, query: str, k: int, file_ids: Optional[List[str]]):
         # Retrieve relevant documents
         context_docs = self.retrieve_documents(query, k=k, file_ids=file_ids)
+        timings = dict(self.last_retrieval_timings)
         if not context_docs:
             answer = "⚠️ No relevant documents found in the uploaded files."
             return {
                 "answer": answer,
                 "sources": [],
                 "query": query,
-                "searched_files": file_ids or "all"
+                "searched_files": file_ids or "all",
+                "timings": timings,
             }
         
         # Group sources by file
         sources_by_file = {}
-        context_text = []
         for doc in context_docs:
             file_id = doc.metadata.get('file_id', 'unknown')
             filename = doc.metadata.get('filename', 'Unknown File')
@@ -564,11 +637,12 @@ Chỉ trả về JSON hợp lệ, không cần giải thích thêm.
                 'content': doc.page_content,
                 'metadata': doc.metadata
             })
-            
-            context_text.append(f"[From {filename}]: {doc.page_content}")
         
-        # Create prompt
-        context = "\n\n".join(context_text[:3000])  # Limit context length
+        # Đóng gói context theo token budget (dedupe, gộp chunk liền kề, theo thứ tự liên quan)
+        context_builder = ContextBuilder()
+        with span("context_build", chunks=len(context_docs)):
+            packed = context_builder.build(context_docs)
+        context = packed["context"]
         prompt = f"""
 You are a helpful assistant. Use the provided context from uploaded documents to answer the user's question as accurately and concisely as possible.
 
@@ -588,18 +662,28 @@ You are a helpful assistant. Use the provided context from uploaded documents to
 
 📝 Answer:"""
 
-        answer = self.generate_response_with_retry(prompt)
+        usage = {key: value for key, value in packed.items() if key != "context"}
+        usage["prompt_tokens"] = context_builder.counter.count(prompt)
+        logger.info(f"🧮 Prompt: {usage['prompt_tokens']} tokens ({usage['context_tokens']}/{usage['token_budget']} context, {usage['chunks_used']}/{usage['chunks_retrieved']} chunks)")
+        count("chat.prompt_tokens", usage["prompt_tokens"])
+        count("chat.context_chunks", usage["chunks_used"])
+
+        generation_started = time.perf_counter()
+        with span("generation", model=self.generation_model_name, prompt_tokens=usage["prompt_tokens"]):
+            answer = self.generate_response_with_retry(prompt)
+        timings["generation_ms"] = round((time.perf_counter() - generation_started) * 1000, 2)
         response = {
             "answer": answer,
             "sources_by_file": sources_by_file,
             "query": query,
-            "searched_files": file_ids or "all"
+            "searched_files": file_ids or "all",
+            "usage": usage,
+            "timings": timings,
         }
         
         # Display results
         for file_id, file_info in sources_by_file.items():
-            print(f"\n--- {file_info['filename']} ---")
-            print(f"   {len(file_info['chunks'])} relevant chunks found")
+            logger.debug(f"--- {file_info['filename']} --- {len(file_info['chunks'])} relevant chunks found")
 
         # Save relevant chunks to a file
         with open("relevant_chunks.txt", "w", encoding="utf-8") as f:
@@ -648,5 +732,22 @@ You are a helpful assistant. Use the provided context from uploaded documents to
             }
             
         except Exception as e:
-            print(f"❌ Error getting stats: {e}")
+            logger.error(f"❌ Error getting stats: {e}")
             return {"total_files": 0, "total_chunks": 0}
+
+
+def run_summary_job(user_id: str, chat_history_id: str, file_id: str):
+    MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id).generate_summary_from_chunks(chat_history_id, file_id)
+
+
+def run_mindmap_job(user_id: str, chat_history_id: str, file_id: str):
+    MultiFileRAGSystem(user_id=user_id, chat_history_id=chat_history_id).generate_mindmap_from_chunks(chat_history_id, file_id)
+
+
+def run_vacuum_job(user_id: str, chat_history_id: str, file_id: str):
+    vacuum_store(resolve_store_dir(user_id, chat_history_id))
+
+
+artifact_scheduler.register("summary", run_summary_job, PRIORITY_SUMMARY)
+artifact_scheduler.register("mindmap", run_mindmap_job, PRIORITY_MINDMAP)
+artifact_scheduler.register("vacuum", run_vacuum_job, PRIORITY_MAINTENANCE)
@@ -3,16 +3,16 @@ import dotenv
 import os
 import re
 from typing import List, Tuple
-import google.generativeai as genai
+from llm_client import llm_client, configure_genai, LLM_PRIORITY_BACKGROUND
 
 dotenv.load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY_SUMMARY")
 
-genai.configure(api_key=API_KEY)
+configure_genai(API_KEY)
 
 class Summarizer:
     def __init__(self, model_name: str = "gemini-2.5-pro"):
-        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
 
     def summarize(self, content: str, system_prompt = (
     """You are an expert content summarization assistant that produces professional, well-structured Markdown documents.
@@ -106,26 +106,9 @@ Before generating the final output, **VERIFY EACH POINT**:
 , stream: bool = True) -> str:
 
         full_prompt = f"{system_prompt}\n\nHere is the content:\n\n{content}"
-        
-        response = ""
-        if stream:
-            response = ""
-            in_think_block = False
-            for chunk in self.model.generate_content(full_prompt, stream=True):
-                part = chunk.text
-
-                if "<think>" in part:
-                    in_think_block = True
-                    part = part.split("<think>")[0]
-
-                if "</think>" in part:
-                    in_think_block = False
-                    part = part.split("</think>")[-1]
-
-                if not in_think_block and part.strip():
-                    response += part
-        else:
-            response = self.model.generate_content(full_prompt).text
-            response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
+
+        # Summary chạy nền nên xếp sau các request tương tác
+        response = llm_client.generate(self.model_name, full_prompt, priority=LLM_PRIORITY_BACKGROUND, stream=stream)
+        response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL)
 
         return response
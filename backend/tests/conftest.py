@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Các singleton (catalog, journal, cache...) tạo file ngay khi import: trỏ hết vào thư mục tạm, không đụng ./chroma_store
+_STATE_DIR = tempfile.mkdtemp(prefix="backend_tests_")
+for name, relative in (
+    ("CHROMA_ROOT", "chroma_store"),
+    ("FILE_CATALOG_PATH", "file_catalog.sqlite3"),
+    ("CLEANUP_DB_PATH", "cleanup.sqlite3"),
+    ("ARTIFACT_JOBS_FILE", "artifact_jobs.json"),
+    ("WRITE_BEHIND_DIR", "write_behind"),
+    ("READ_CACHE_EPOCH_DIR", "read_cache"),
+    ("GENERATION_CACHE_DIR", "generation_cache"),
+    ("TRACING_DIR", "traces"),
+    ("PROFILE_DIR", "profiles"),
+):
+    os.environ.setdefault(name, os.path.join(_STATE_DIR, relative))
+os.environ.setdefault("TRACING_EXPORTER", "none")
+os.environ.setdefault("CLEANUP_SWEEP_INTERVAL_S", "0")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "header.payload.signature")
+os.environ.setdefault("GEMINI_API_KEY", "test")
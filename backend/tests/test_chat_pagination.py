@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class FakeChatsQuery:
+    """In-memory stand-in for supabase.table("chats"): eq, cursor filter, order, limit"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.desc = None
+        self.limit_count = None
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, field, value):
+        self.filters.append(lambda row: row[field] == value)
+        return self
+
+    def order(self, field, desc=False):
+        if self.desc is None:
+            self.desc = desc
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if all(check(row) for check in self.filters)]
+        rows.sort(key=lambda row: (row["created_at"], row["chat_id"]), reverse=bool(self.desc))
+        return SimpleNamespace(data=[dict(row) for row in rows[:self.limit_count]])
+
+
+@pytest.fixture
+def chats(monkeypatch):
+    rows = []
+
+    def cursor_filter(query, op, cursor):
+        # PostgREST dịch or_(...) phía server; ở đây áp cùng điều kiện lên dữ liệu trong bộ nhớ
+        query.filters.append(lambda row: main._beyond_cursor(row, op, cursor))
+        return query
+
+    monkeypatch.setattr(main, "supabase", SimpleNamespace(table=lambda name: FakeChatsQuery(rows)))
+    monkeypatch.setattr(main, "_cursor_filter", cursor_filter)
+    monkeypatch.setattr(main.write_behind, "pending_inserts", lambda table, **filters: [])
+    return rows
+
+
+def chat(chat_id, created_at, chat_history_id="h1"):
+    return {"chat_id": chat_id, "chat_history_id": chat_history_id, "query": f"q{chat_id}",
+            "response": f"r{chat_id}", "created_at": created_at}
+
+
+def test_paging_backwards_visits_rows_sharing_a_timestamp_exactly_once(chats):
+    # Write-behind insert theo batch: nhiều row cùng created_at
+    chats.extend(chat(f"c{i:02d}", "2024-01-01T00:00:00") for i in range(7))
+    chats.extend(chat(f"d{i:02d}", "2024-01-01T00:00:01") for i in range(3))
+    chats.append(chat("other", "2024-01-01T00:00:00", chat_history_id="h2"))
+
+    seen, before = [], None
+    while True:
+        rows, before = main.load_chat_page("h1", limit=4, before=before)
+        seen = [row["chat_id"] for row in rows] + seen
+        if before is None:
+            break
+
+    assert seen == [f"c{i:02d}" for i in range(7)] + [f"d{i:02d}" for i in range(3)]
+
+
+def test_page_is_oldest_first_with_cursor_at_its_first_row(chats):
+    chats.extend(chat(f"c{i}", f"2024-01-01T00:00:0{i}") for i in range(5))
+
+    rows, cursor = main.load_chat_page("h1", limit=2)
+
+    assert [row["chat_id"] for row in rows] == ["c3", "c4"]
+    assert cursor == "2024-01-01T00:00:03|c3"
+
+
+def test_since_returns_only_newer_rows_and_advances_the_cursor(chats):
+    chats.extend(chat(f"c{i}", "2024-01-01T00:00:00") for i in range(3))
+
+    rows, cursor = main.load_chat_page("h1", limit=10, since="2024-01-01T00:00:00|c0")
+    assert [row["chat_id"] for row in rows] == ["c1", "c2"]
+    assert cursor == "2024-01-01T00:00:00|c2"
+
+    rows, unchanged = main.load_chat_page("h1", limit=10, since=cursor)
+    assert rows == [] and unchanged == cursor
+
+
+def test_pending_rows_are_merged_into_the_page(chats, monkeypatch):
+    chats.append(chat("c0", "2024-01-01T00:00:00"))
+    pending = [chat("c1", "2024-01-01T00:00:01"), chat("c0", "2024-01-01T00:00:00")]
+    monkeypatch.setattr(main.write_behind, "pending_inserts", lambda table, **filters: list(pending))
+
+    rows, cursor = main.load_chat_page("h1", limit=10)
+
+    assert [row["chat_id"] for row in rows] == ["c0", "c1"]
+    assert cursor is None
+
+
+def test_cursor_without_chat_id_still_pages_by_created_at():
+    row = {"created_at": "2024-01-01T00:00:01", "chat_id": "a"}
+
+    assert main._parse_cursor("2024-01-01T00:00:00") == ("2024-01-01T00:00:00", None)
+    assert main._beyond_cursor(row, "gt", "2024-01-01T00:00:00")
+    assert not main._beyond_cursor(row, "lt", "2024-01-01T00:00:00")
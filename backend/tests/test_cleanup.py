@@ -0,0 +1,73 @@
+import pytest
+
+import cleanup
+from cleanup import CleanupJournal, CleanupPipeline, FILE_STEPS, CHAT_STEPS, _task_id
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    pipeline = CleanupPipeline(journal=CleanupJournal(str(tmp_path / "cleanup.sqlite3")), sweep_interval=0)
+    calls = []
+    pipeline.calls = calls
+    # Thay từng bước bằng bản ghi lại lời gọi (bước thật đụng tới Chroma, Storage, Supabase)
+    for prefix, steps in (("cleanup_file", FILE_STEPS), ("cleanup_chat", CHAT_STEPS)):
+        for step in steps:
+            monkeypatch.setattr(pipeline, f"_{prefix}_{step}", lambda task, step=step: calls.append(step) or 10)
+    monkeypatch.setattr(cleanup.artifact_scheduler, "submit", lambda *args: True)
+    return pipeline
+
+
+def fail_once(pipeline, monkeypatch, name: str):
+    def step(task):
+        monkeypatch.setattr(pipeline, name, lambda task: pipeline.calls.append(name) or 0)
+        raise RuntimeError("storage unavailable")
+    monkeypatch.setattr(pipeline, name, step)
+
+
+def test_failed_step_is_resumed_without_repeating_finished_steps(pipeline, monkeypatch):
+    pipeline.delete_file("u1", "h1", "f1", storage_path="u1/h1/f1.pdf")
+    task_id = _task_id("cleanup_file", "h1", "f1")
+    fail_once(pipeline, monkeypatch, "_cleanup_file_storage")
+
+    with pytest.raises(RuntimeError):
+        pipeline.run("cleanup_file", "u1", "h1", "f1")
+
+    task = pipeline.journal.get(task_id)
+    assert task["steps_done"] == ["vectors", "chunk_logs", "catalog"]
+    assert task["finished_at"] is None
+    assert task["error"].startswith("storage:")
+
+    pipeline.run("cleanup_file", "u1", "h1", "f1")
+
+    assert pipeline.calls == ["vectors", "chunk_logs", "catalog", "_cleanup_file_storage", "caches", "compact"]
+    task = pipeline.journal.get(task_id)
+    assert task["steps_done"] == list(FILE_STEPS)
+    assert task["finished_at"] is not None and task["error"] is None
+    # Bước lỗi trả 0 byte; năm bước còn lại mỗi bước 10
+    assert task["reclaimed_bytes"] == 50
+
+
+def test_finished_task_is_not_run_again(pipeline):
+    pipeline.delete_chat("u1", "h1")
+    pipeline.run("cleanup_chat", "u1", "h1", "")
+    pipeline.run("cleanup_chat", "u1", "h1", "")
+
+    assert pipeline.calls == list(CHAT_STEPS)
+
+
+def test_resubmitting_an_unfinished_task_keeps_its_progress(pipeline, monkeypatch):
+    pipeline.delete_chat("u1", "h1")
+    fail_once(pipeline, monkeypatch, "_cleanup_chat_storage")
+    with pytest.raises(RuntimeError):
+        pipeline.run("cleanup_chat", "u1", "h1", "")
+
+    pipeline.delete_chat("u1", "h1")
+
+    assert pipeline.journal.get(_task_id("cleanup_chat", "h1", ""))["steps_done"] == ["vectors", "chunk_logs", "catalog"]
+
+
+def test_job_recovered_without_its_journal_row_starts_from_scratch(pipeline):
+    pipeline.run("cleanup_file", "u1", "h1", "f2")
+
+    assert pipeline.calls == list(FILE_STEPS)
+    assert pipeline.journal.get(_task_id("cleanup_file", "h1", "f2"))["finished_at"] is not None
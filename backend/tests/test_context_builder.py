@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+from context_builder import ContextBuilder, TokenCounter, SEPARATOR
+
+
+class CharCounter(TokenCounter):
+    """~4 chars/token, independent of whether tiktoken is installed"""
+
+    def __init__(self, safety_margin: float = 1.0):
+        self.safety_margin = safety_margin
+        self._encoding = None
+
+
+def doc(text, file_id="f1", chunk_id=None, filename="a.pdf"):
+    return SimpleNamespace(page_content=text, metadata={"file_id": file_id, "chunk_id": chunk_id, "filename": filename})
+
+
+def test_duplicate_and_contained_chunks_are_dropped():
+    builder = ContextBuilder(token_budget=1000, counter=CharCounter())
+    packed = builder.build([
+        doc("alpha beta gamma delta", chunk_id=3),
+        doc("alpha beta gamma delta", chunk_id=3),
+        doc("beta gamma", file_id="f2"),
+    ])
+
+    assert packed["segments"] == 1
+    assert packed["chunks_used"] == 1
+    assert packed["chunks_retrieved"] == 3
+
+
+def test_consecutive_chunks_merge_without_their_overlap():
+    overlap = "shared overlap text between chunks"
+    builder = ContextBuilder(token_budget=1000, counter=CharCounter())
+    packed = builder.build([
+        doc(f"{overlap} and the tail", chunk_id=2),
+        doc(f"head of the file {overlap}", chunk_id=1),
+    ])
+
+    assert packed["segments"] == 1
+    assert packed["chunks_used"] == 2
+    assert packed["context"].count(overlap) == 1
+    assert packed["context"].index("head of the file") < packed["context"].index("tail")
+
+
+def test_segments_follow_best_retrieval_rank():
+    builder = ContextBuilder(token_budget=1000, counter=CharCounter())
+    packed = builder.build([
+        doc("from the second file", file_id="f2", filename="b.pdf"),
+        doc("from the first file", file_id="f1", filename="a.pdf"),
+    ])
+
+    first, second = packed["context"].split(SEPARATOR)
+    assert first.startswith("[From b.pdf]")
+    assert second.startswith("[From a.pdf]")
+
+
+def test_context_stays_within_budget():
+    builder = ContextBuilder(token_budget=120, counter=CharCounter())
+    # Mỗi đoạn ~45 token: hai đoạn vừa, phần còn lại nhỏ hơn MIN_SEGMENT_TOKENS nên không chèn đoạn cắt
+    docs = [doc(" ".join(f"word{i}-{j}" for j in range(20)), file_id=f"f{i}") for i in range(5)]
+    packed = builder.build(docs)
+
+    assert packed["context_tokens"] <= 120
+    assert packed["segments"] == 2
+    assert packed["chunks_used"] == 2
+
+
+def test_segment_that_does_not_fit_is_truncated_to_fill_the_budget():
+    builder = ContextBuilder(token_budget=120, counter=CharCounter())
+    packed = builder.build([doc(" ".join(f"word-{j}" for j in range(200)))])
+
+    assert packed["segments"] == 1
+    assert 100 <= packed["context_tokens"] <= 120
+
+
+def test_safety_margin_scales_counts_and_truncation():
+    counter = CharCounter(safety_margin=1.5)
+    text = "x" * 400
+
+    assert counter.count(text) == 150
+    assert counter.count(counter.truncate(text, 60)) <= 60
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import llm_client
+from llm_client import LLMBusyError, LLMGovernor, _ModelBudget, WINDOW_SECONDS
+
+
+def test_rpm_window_delays_until_oldest_request_leaves():
+    budget = _ModelBudget(rpm=2, tpm=1_000_000)
+    budget.window.extend([[0.0, 10], [1.0, 10]])
+
+    assert budget.delay(10, now=10.0) == pytest.approx(WINDOW_SECONDS - 10.0)
+    # Request đầu tiên đã ra khỏi cửa sổ
+    assert budget.delay(10, now=WINDOW_SECONDS + 0.5) == 0
+    assert len(budget.window) == 1
+
+
+def test_tpm_window_waits_only_for_enough_tokens_to_free():
+    budget = _ModelBudget(rpm=100, tpm=1000)
+    budget.window.extend([[0.0, 300], [5.0, 600]])
+
+    # Thiếu 100 token: chỉ cần entry đầu (300 token) hết hạn
+    assert budget.delay(200, now=10.0) == pytest.approx(WINDOW_SECONDS - 10.0)
+    assert budget.delay(100, now=10.0) == 0
+
+
+def test_oversized_request_is_capped_to_tpm():
+    budget = _ModelBudget(rpm=100, tpm=1000)
+
+    assert budget.delay(50_000, now=0.0) == 0
+
+
+def test_cooldown_applies_to_every_caller():
+    budget = _ModelBudget(rpm=100, tpm=1000)
+    budget.cooldown_until = 30.0
+
+    assert budget.delay(1, now=10.0) == pytest.approx(20.0)
+
+
+def test_acquire_records_request_in_window(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MODEL_BUDGETS", {"model": {"rpm": 5, "tpm": 1000}})
+    governor = LLMGovernor()
+
+    entry = governor._acquire("model", 2000, llm_client.LLM_PRIORITY_INTERACTIVE, deadline=None)
+
+    assert entry[1] == 1000
+    assert list(governor._budgets["model"].window) == [entry]
+
+
+def test_acquire_rejects_when_window_is_full_past_deadline(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MODEL_BUDGETS", {"model": {"rpm": 1, "tpm": 1000}})
+    governor = LLMGovernor()
+    governor._budget("model").window.append([time.monotonic(), 1])
+
+    with pytest.raises(LLMBusyError) as excinfo:
+        governor._acquire("model", 1, llm_client.LLM_PRIORITY_INTERACTIVE, deadline=time.monotonic() + 1)
+
+    assert excinfo.value.deadline_exceeded
+    assert governor.stats()["model"]["rejected"] == 1
+    assert governor.stats()["model"]["queued"] == 0
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import vector_index
+from vector_index import VectorSidecar
+
+
+def unit_vectors(count: int, dims: int = 16, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def segments_on_disk(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.startswith("seg."))
+
+
+def test_each_add_appends_one_segment_and_commits_ids(tmp_path):
+    sidecar = VectorSidecar(str(tmp_path), dims=8, quantization="none")
+    sidecar.add(["a", "b"], ["f1", "f1"], unit_vectors(2))
+    sidecar.add(["c"], ["f2"], unit_vectors(1, seed=1))
+
+    with open(tmp_path / "ids.json", "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["ids"] == ["a", "b", "c"]
+    assert meta["segments"] == segments_on_disk(tmp_path)
+    assert len(meta["segments"]) == 2
+    assert sidecar.count() == 3
+
+
+def test_upsert_marks_replaced_row_dead_and_search_uses_new_vector(tmp_path):
+    vectors = unit_vectors(3)
+    sidecar = VectorSidecar(str(tmp_path), dims=8, quantization="none")
+    sidecar.add(["a", "b", "c"], ["f1"] * 3, vectors)
+    sidecar.add(["a"], ["f1"], vectors[2:3])
+
+    assert sidecar.ids[0] is None
+    assert sidecar.count() == 3
+    hits = sidecar.search(vectors[2], k=2, candidates=3)
+    assert {chunk_id for chunk_id, _ in hits} == {"a", "c"}
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_other_instance_sees_committed_segments(tmp_path):
+    vectors = unit_vectors(4)
+    writer = VectorSidecar(str(tmp_path), dims=16, quantization="int8")
+    writer.add(["a", "b", "c", "d"], ["f1", "f1", "f2", "f2"], vectors)
+    writer.remove(file_id="f1")
+
+    reader = VectorSidecar(str(tmp_path), dims=16, quantization="int8")
+    assert reader.count() == 2
+    assert [chunk_id for chunk_id, _ in reader.search(vectors[3], k=1)] == ["d"]
+
+
+def test_segments_are_compacted_when_dead_rows_outnumber_live(tmp_path):
+    vectors = unit_vectors(4)
+    sidecar = VectorSidecar(str(tmp_path), dims=16, quantization="binary")
+    sidecar.add(["a", "b", "c", "d"], ["f1"] * 4, vectors)
+    sidecar.add(["e"], ["f2"], unit_vectors(1, seed=1))
+    sidecar.remove(ids=["a", "b", "c"])
+
+    assert sidecar.ids == ["d", "e"]
+    assert len(segments_on_disk(tmp_path)) == 1
+    assert [chunk_id for chunk_id, _ in sidecar.search(vectors[3], k=1)] == ["d"]
+
+
+def test_segments_are_compacted_past_the_segment_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_SIDECAR_MAX_SEGMENTS", 2)
+    sidecar = VectorSidecar(str(tmp_path), dims=16, quantization="none")
+    for i in range(3):
+        sidecar.add([f"id{i}"], ["f1"], unit_vectors(1, seed=i))
+
+    assert len(segments_on_disk(tmp_path)) == 1
+    assert sidecar.count() == 3
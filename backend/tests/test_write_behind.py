@@ -0,0 +1,138 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from postgrest.exceptions import APIError
+
+import write_behind
+from write_behind import WriteBehindQueue
+
+
+class FakeTable:
+    def __init__(self, supabase, name):
+        self.supabase = supabase
+        self.name = name
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        if any(row.get("chat_history_id") == "deleted" for row in self.rows):
+            raise APIError({"message": "violates foreign key constraint", "code": "23503"})
+        self.supabase.inserted.extend((self.name, dict(row)) for row in self.rows)
+        return SimpleNamespace(data=self.rows)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.inserted = []
+
+    def table(self, name):
+        return FakeTable(self, name)
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    fake = FakeSupabase()
+    monkeypatch.setattr(write_behind, "get_supabase", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def make_queue(supabase):
+    queues = []
+
+    def make(directory, **kwargs) -> WriteBehindQueue:
+        # Flush thủ công: thread nền không tự flush trong lúc test
+        queue = WriteBehindQueue(directory=str(directory), flush_interval_ms=3_600_000, fsync=False, **kwargs)
+        queue.start()
+        queues.append(queue)
+        return queue
+
+    yield make
+    # Ghi hết phần còn lại khi Supabase giả vẫn còn (atexit sẽ flush lại)
+    for queue in queues:
+        queue.flush()
+
+
+def journal_ops(queue):
+    with open(queue._journal_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_insert_is_journaled_before_flush_and_journal_is_emptied_after(tmp_path, supabase, make_queue):
+    queue = make_queue(tmp_path)
+    queue.insert("chats", {"chat_id": "c1", "chat_history_id": "h1"})
+
+    ops = journal_ops(queue)
+    assert [op["row"]["chat_id"] for op in ops] == ["c1"]
+    assert ops[0]["id"]
+
+    assert queue.flush()
+    assert supabase.inserted == [("chats", {"chat_id": "c1", "chat_history_id": "h1"})]
+    assert journal_ops(queue) == []
+
+
+def test_update_of_pending_row_is_folded_into_the_insert(tmp_path, supabase, make_queue):
+    queue = make_queue(tmp_path)
+    queue.insert("chats", {"chat_id": "c1", "chat_history_id": "h1", "response": ""})
+    queue.update("chats", {"chat_id": "c1"}, {"response": "done"})
+
+    assert queue.flush()
+    assert supabase.inserted == [("chats", {"chat_id": "c1", "chat_history_id": "h1", "response": "done"})]
+    assert queue.stats()["ops_merged"] == 1
+
+
+def test_rejected_row_is_dead_lettered_without_blocking_the_rest(tmp_path, supabase, make_queue):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.insert("chats", {"chat_id": "bad", "chat_history_id": "deleted"})
+    queue.insert("chats", {"chat_id": "good", "chat_history_id": "h1"})
+
+    assert not queue.flush()
+    assert [row["chat_id"] for _, row in supabase.inserted] == ["good"]
+    # Số lần thử được đếm theo row id ghi trong journal, không theo id(row)
+    row_id = journal_ops(queue)[0]["id"]
+    assert queue._attempts == {row_id: 1}
+
+    assert queue.flush()
+    assert queue.stats()["dead_lettered"] == 1
+    assert queue._attempts == {}
+    with open(tmp_path / "dead_letter.jsonl", "r", encoding="utf-8") as f:
+        dead = [json.loads(line) for line in f]
+    assert [record["row"]["chat_id"] for record in dead] == ["bad"]
+    assert dead[0]["id"] == row_id
+
+
+def test_journal_of_exited_worker_is_claimed_and_replayed(tmp_path, supabase, make_queue):
+    os.makedirs(tmp_path, exist_ok=True)
+    orphan = tmp_path / "journal.1-1000-deadbeef.jsonl"
+    orphan.write_text(
+        json.dumps({"op": "insert", "table": "chats", "row": {"chat_id": "c9", "chat_history_id": "h1"}, "id": "r9"}) + "\n"
+        + '{"op": "insert", "table": "ch',
+        encoding="utf-8",
+    )
+
+    queue = make_queue(tmp_path)
+
+    assert not orphan.exists()
+    assert [op["id"] for op in journal_ops(queue)] == ["r9"]
+    assert queue.flush()
+    assert supabase.inserted == [("chats", {"chat_id": "c9", "chat_history_id": "h1"})]
+
+
+def test_pending_inserts_include_rows_journaled_by_other_workers(tmp_path, supabase, make_queue):
+    first = make_queue(tmp_path)
+    second = make_queue(tmp_path)
+    first.insert("chats", {"chat_id": "c1", "chat_history_id": "h1"})
+    first.update("chats", {"chat_id": "c1"}, {"response": "r"})
+    second.insert("chats", {"chat_id": "c2", "chat_history_id": "h1"})
+    second.insert("chats", {"chat_id": "c3", "chat_history_id": "h2"})
+
+    pending = second.pending_inserts("chats", chat_history_id="h1")
+    assert sorted(row["chat_id"] for row in pending) == ["c1", "c2"]
+    assert next(row for row in pending if row["chat_id"] == "c1")["response"] == "r"
+
+    first.flush()
+    assert [row["chat_id"] for row in second.pending_inserts("chats", chat_history_id="h1")] == ["c2"]
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import queue
+import atexit
+import bisect
+import logging
+import logging.handlers
+import itertools
+import threading
+import contextvars
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# none: tắt (gần như không tốn gì) | file: ghi JSONL theo process | otlp: OpenTelemetry OTLP/gRPC
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_DIR = os.getenv("TRACING_DIR", "./chroma_store/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "docwhiz-backend")
+TRACING_FLUSH_INTERVAL_S = float(os.getenv("TRACING_FLUSH_INTERVAL_S", "5"))
+# File trace lớn hơn ngưỡng này thì xoay vòng (giữ một file .1)
+TRACING_FILE_MAX_MB = float(os.getenv("TRACING_FILE_MAX_MB", "100"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def configure_logging():
+    """Route log records through a queue so hot paths never block on stdout"""
+    root = logging.getLogger()
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return
+    records: queue.Queue = queue.Queue(-1)
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(LOG_LEVEL)
+
+
+def _attribute(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+def _key(name: str, attributes: Dict[str, Any]) -> Tuple:
+    return (name, tuple(sorted((k, _attribute(v)) for k, v in attributes.items())))
+
+
+class _NoopSpan:
+    """Returned by span() while tracing is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _StageTimer:
+    """Times a stage for the sinks only (no exporter): no ids, context or attributes are kept"""
+
+    __slots__ = ("tracer", "name", "started")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._forward_observe("span.duration_ms", (time.perf_counter() - self.started) * 1000, {"span": self.name})
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+class _Span:
+    """Span recorded by the in-process tracer (file exporter)"""
+
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id", "parent_id", "started", "wall_start", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = next(self.tracer._ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else f"{os.getpid()}-{self.span_id}"
+        self._token = _current_span.set(self)
+        self.wall_start = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._finish(self, duration_ms)
+        return False
+
+
+class _OtelSpan:
+    """Span forwarded to the OpenTelemetry SDK"""
+
+    __slots__ = ("tracer", "name", "attributes", "started", "_context", "_span")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        attributes = {key: _attribute(value) for key, value in self.attributes.items()}
+        self._context = self.tracer._otel_tracer.start_as_current_span(self.name, attributes=attributes)
+        self._span = self._context.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def set(self, key: str, value: Any):
+        self._span.set_attribute(key, _attribute(value))
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.observe("span.duration_ms", (time.perf_counter() - self.started) * 1000, span=self.name)
+        return self._context.__exit__(exc_type, exc, tb)
+
+
+class Tracer:
+    """Spans, counters and latency histograms for the ingestion/chat pipelines.
+
+    With the "none" exporter every call returns immediately (span() hands back a shared
+    no-op object), so instrumentation can stay on hot paths. "file" aggregates counters
+    and histograms in memory and appends finished spans plus periodic metric snapshots
+    to a per-process JSONL file from a background thread. "otlp" forwards spans and
+    metrics to the OpenTelemetry SDK (endpoint from the standard OTEL_EXPORTER_OTLP_*
+    variables). Every finished span also records its duration in the
+    "span.duration_ms" histogram.
+
+    Sinks added with add_sink() (e.g. the Prometheus bridge in metrics.py) receive every
+    counter and histogram sample, whatever the exporter. Sinks alone do not enable the
+    exporter: with "none", span() only times the stage for the sinks and nothing is
+    aggregated or written.
+    """
+
+    def __init__(self, exporter: str = TRACING_EXPORTER, directory: str = TRACING_DIR):
+        self.exporter = exporter if exporter in ("file", "otlp") else "none"
+        self.enabled = self.exporter != "none"
+        # enabled, hoặc có sink cần nhận counter/histogram
+        self.active = self.enabled
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._counters: Dict[Tuple, float] = {}
+        self._histograms: Dict[Tuple, Dict[str, Any]] = {}
+        self._spans: list = []
+        self._path: Optional[str] = None
+        self._otel_tracer = None
+        self._otel_counters: Dict[str, Any] = {}
+        self._otel_histograms: Dict[str, Any] = {}
+        self._sinks: list = []
+
+        if self.exporter == "otlp" and not self._setup_otel():
+            self.exporter, self.enabled, self.active = "none", False, False
+        if self.exporter == "file":
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"traces.{os.getpid()}.jsonl")
+            threading.Thread(target=self._flush_loop, name="trace-flusher", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _setup_otel(self) -> bool:
+        try:
+            from opentelemetry import metrics, trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.sdk.metrics import MeterProvider
+            from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        except ImportError as e:
+            logger.warning(f"⚠️ TRACING_EXPORTER=otlp but OpenTelemetry is not installed ({e}); tracing disabled")
+            return False
+
+        resource = Resource.create({"service.name": TRACING_SERVICE_NAME, "process.pid": os.getpid()})
+        provider = TracerProvider(resource=resource)
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        meter_provider = MeterProvider(resource=resource, metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())])
+        metrics.set_meter_provider(meter_provider)
+        self._otel_tracer = trace.get_tracer("docwhiz")
+        self._meter = metrics.get_meter("docwhiz")
+        atexit.register(provider.shutdown)
+        atexit.register(meter_provider.shutdown)
+        return True
+
+    # ---------- public API ----------
+
+    def add_sink(self, sink):
+        """Forward counters/histograms to sink.count(name, value, attrs) and sink.observe(name, value, attrs)"""
+        self._sinks.append(sink)
+        self.active = True
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _StageTimer(self, name) if self._sinks else _NOOP_SPAN
+        if self._otel_tracer is not None:
+            return _OtelSpan(self, name, attributes)
+        return _Span(self, name, attributes)
+
+    def count(self, name: str, value: float = 1, **attributes):
+        if not self.active:
+            return
+        for sink in self._sinks:
+            sink.count(name, value, attributes)
+        if not self.enabled:
+            return
+        key = _key(name, attributes)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self._otel_tracer is not None:
+            counter = self._otel_counters.get(name)
+            if counter is None:
+                counter = self._otel_counters[name] = self._meter.create_counter(name)
+            counter.add(value, attributes=dict(key[1]))
+
+    def observe(self, name: str, value: float, **attributes):
+        if not self.active:
+            return
+        self._forward_observe(name, value, attributes)
+        if not self.enabled:
+            return
+        key = _key(name, attributes)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+            histogram["buckets"][bisect.bisect_left(HISTOGRAM_BUCKETS_MS, value)] += 1
+        if self._otel_tracer is not None:
+            instrument = self._otel_histograms.get(name)
+            if instrument is None:
+                instrument = self._otel_histograms[name] = self._meter.create_histogram(name)
+            instrument.record(value, attributes=dict(key[1]))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and histograms aggregated in this process"""
+        with self._lock:
+            return {
+                "counters": [{"name": name, "attributes": dict(attrs), "value": value} for (name, attrs), value in self._counters.items()],
+                "histograms": [
+                    {"name": name, "attributes": dict(attrs), "count": h["count"], "sum": round(h["sum"], 3),
+                     "max": round(h["max"], 3), "buckets": dict(zip([*map(str, HISTOGRAM_BUCKETS_MS), "+Inf"], h["buckets"]))}
+                    for (name, attrs), h in self._histograms.items()
+                ],
+            }
+
+    def flush(self):
+        if self._path is None:
+            return
+        with self._lock:
+            spans, self._spans = self._spans, []
+        lines = [json.dumps(record, ensure_ascii=False, default=str) for record in spans]
+        lines.append(json.dumps({"type": "metrics", "time": time.time(), **self.snapshot()}, ensure_ascii=False))
+        try:
+            if os.path.exists(self._path) and os.path.getsize(self._path) > TRACING_FILE_MAX_MB * 2 ** 20:
+                os.replace(self._path, f"{self._path}.1")
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write traces: {e}")
+
+    # ---------- internals ----------
+
+    def _forward_observe(self, name: str, value: float, attributes: Dict[str, Any]):
+        for sink in self._sinks:
+            sink.observe(name, value, attributes)
+
+    def _finish(self, span: _Span, duration_ms: float):
+        record = {
+            "type": "span",
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start": span.wall_start,
+            "duration_ms": round(duration_ms, 3),
+            "attributes": span.attributes,
+        }
+        if self._path is not None:
+            with self._lock:
+                self._spans.append(record)
+        self.observe("span.duration_ms", duration_ms, span=span.name)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(TRACING_FLUSH_INTERVAL_S)
+            self.flush()
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """Context manager timing one pipeline stage; nested spans form a trace"""
+    return tracer.span(name, **attributes) if tracer.active else _NOOP_SPAN
+
+
+def count(name: str, value: float = 1, **attributes):
+    if tracer.active:
+        tracer.count(name, value, **attributes)
+
+
+def observe(name: str, value: float, **attributes):
+    """Record one latency (ms) or size sample in a histogram"""
+    if tracer.active:
+        tracer.observe(name, value, **attributes)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator: run the function inside a span"""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.active:
+                return fn(*args, **kwargs)
+            with tracer.span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from cachetools import LRUCache
+
+from local_embeddings import LOCAL_EMBEDDING_DIMENSIONS
+
+# "jina" (API) hoặc "local" (ONNX Runtime trên CPU, không cần mạng)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "jina").lower()
+# Số chiều gốc của vector mỗi backend trả về
+JINA_EMBEDDING_DIMENSIONS = 1024
+BACKEND_DIMENSIONS = {"jina": JINA_EMBEDDING_DIMENSIONS, "local": LOCAL_EMBEDDING_DIMENSIONS}
+EMBEDDING_FULL_DIMENSIONS = BACKEND_DIMENSIONS.get(EMBEDDING_BACKEND, JINA_EMBEDDING_DIMENSIONS)
+# Số chiều lưu trong index (Matryoshka: jina-embeddings-v3 cho phép cắt 1024 -> 512/256), không vượt số chiều gốc
+EMBEDDING_DIMENSIONS = min(int(os.getenv("EMBEDDING_DIMENSIONS", str(EMBEDDING_FULL_DIMENSIONS))), EMBEDDING_FULL_DIMENSIONS)
+# none | int8 | binary
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+# Số ứng viên lấy từ index rút gọn trước khi chấm lại bằng vector đầy đủ
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "50"))
+# Số segment tối đa trước khi gộp lại thành một file
+VECTOR_SIDECAR_MAX_SEGMENTS = int(os.getenv("VECTOR_SIDECAR_MAX_SEGMENTS", "32"))
+# Số sidecar (index rút gọn trong RAM) giữ lại mỗi process
+VECTOR_SIDECAR_CACHE_SIZE = int(os.getenv("VECTOR_SIDECAR_CACHE_SIZE", "64"))
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+
+def truncate_vectors(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """Keep the first `dims` Matryoshka dimensions and re-normalise to unit length"""
+    truncated = np.asarray(vectors, dtype=np.float32)[..., :dims]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.clip(norms, 1e-12, None)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantisation: returns (codes, scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    codes = np.clip(np.round(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bit per dimension, packed 8 per byte"""
+    return np.packbits(vectors > 0, axis=-1)
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def needs_sidecar(dims: int = EMBEDDING_DIMENSIONS, quantization: str = EMBEDDING_QUANTIZATION) -> bool:
+    return dims < EMBEDDING_FULL_DIMENSIONS or quantization != "none"
+
+
+class VectorSidecar:
+    """Per-collection vector store kept next to Chroma for reduced-precision search.
+
+    Full-precision vectors are saved to disk and memory-mapped, so only the rows of the
+    candidates being rescored are read. The compact index (truncated float32, int8
+    codes or packed sign bits) is what stays in RAM and is scanned for every query.
+
+    Vectors are written as append-only segment files: an upsert writes only the new
+    vectors and marks the rows it replaces as dead, a delete only marks rows dead.
+    ids.json (written last) lists the segments and is the commit point. The segments are
+    rewritten into one when dead rows outnumber live ones or there are more than
+    VECTOR_SIDECAR_MAX_SEGMENTS of them.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dims: int = EMBEDDING_DIMENSIONS,
+        quantization: str = EMBEDDING_QUANTIZATION,
+    ):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown EMBEDDING_QUANTIZATION: {quantization}")
+        self.directory = directory
+        self.dims = dims
+        self.quantization = quantization
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._meta_mtime: Optional[int] = None
+        # ids[i] là None khi row i đã bị xoá/ghi đè (vector vẫn nằm trong segment cũ)
+        self.ids: List[Optional[str]] = []
+        self.file_ids: List[Optional[str]] = []
+        self.segment_names: List[str] = []
+        self.segments: List[np.ndarray] = []
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._row_of: Dict[str, int] = {}
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        # Nạp lại khi process/instance khác đã ghi (so mtime của ids.json, một os.stat mỗi lần)
+        meta_path = self._path("ids.json")
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._meta_mtime:
+            return
+        if mtime is not None:
+            for attempt in range(3):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                # ids.json cũ chỉ có một file vector
+                names = meta.get("segments") or [meta.get("vectors", "full.npy")]
+                try:
+                    segments = [np.load(self._path(name), mmap_mode="r") for name in names]
+                    break
+                except FileNotFoundError:
+                    # Writer vừa compact và xoá segment cũ: đọc lại ids.json
+                    if attempt == 2:
+                        raise
+            self.ids = meta["ids"]
+            self.file_ids = meta["file_ids"]
+            self.segment_names, self.segments = names, segments
+        else:
+            self.ids, self.file_ids, self.segment_names, self.segments = [], [], [], []
+        self._reindex()
+        self.codes, self.scales = self._encode(self.segments)
+        self._meta_mtime = mtime
+        self._loaded = True
+
+    def _reindex(self):
+        sizes = [len(segment) for segment in self.segments]
+        self._offsets = np.cumsum([0] + sizes[:-1]).astype(np.int64) if sizes else np.zeros(0, dtype=np.int64)
+        self._row_of = {row_id: i for i, row_id in enumerate(self.ids) if row_id is not None}
+
+    def _encode(self, segments: List[np.ndarray]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Compact index rows for the given full-precision segments"""
+        segments = [segment for segment in segments if len(segment)]
+        if not segments:
+            return None, None
+        compact = np.vstack([truncate_vectors(segment, self.dims) for segment in segments])
+        if self.quantization == "int8":
+            return quantize_int8(compact)
+        if self.quantization == "binary":
+            return quantize_binary(compact), None
+        return compact, None
+
+    def _full_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Full-precision vectors of the given global row numbers (reads only those rows)"""
+        width = self.segments[0].shape[1]
+        out = np.empty((len(rows), width), dtype=np.float32)
+        segment_of = np.searchsorted(self._offsets, rows, side="right") - 1
+        for segment in np.unique(segment_of):
+            mask = segment_of == segment
+            out[mask] = self.segments[segment][rows[mask] - self._offsets[segment]]
+        return out
+
+    def _commit(self, removed_segments: Sequence[str] = ()):
+        # ids.json là điểm commit: reader ở process khác không bao giờ thấy ids và segment lệch nhau
+        tmp_meta = self._path("ids.json.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "file_ids": self.file_ids, "segments": self.segment_names}, f)
+        os.replace(tmp_meta, self._path("ids.json"))
+        for name in removed_segments:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._meta_mtime = os.stat(self._path("ids.json")).st_mtime_ns
+
+    def _write_segment(self, vectors: np.ndarray) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"seg.{time.time_ns()}.npy"
+        np.save(self._path(name), np.ascontiguousarray(vectors, dtype=np.float32))
+        return name
+
+    def _maybe_compact(self):
+        live = len(self._row_of)
+        dead = len(self.ids) - live
+        if dead <= live and len(self.segments) <= VECTOR_SIDECAR_MAX_SEGMENTS:
+            return
+        keep = np.array(sorted(self._row_of.values()), dtype=np.int64)
+        old_names = list(self.segment_names)
+        self.ids = [self.ids[i] for i in keep]
+        self.file_ids = [self.file_ids[i] for i in keep]
+        if len(keep):
+            full = self._full_rows(keep)
+            name = self._write_segment(full)
+            self.segment_names, self.segments = [name], [np.load(self._path(name), mmap_mode="r")]
+        else:
+            self.segment_names, self.segments = [], []
+        self._reindex()
+        self.codes, self.scales = self._encode(self.segments)
+        self._commit(removed_segments=old_names)
+
+    def count(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._row_of)
+
+    def add(self, ids: Sequence[str], file_ids: Sequence[str], vectors: Iterable[Sequence[float]]):
+        """Upsert full-precision vectors (appends one segment)"""
+        vectors = np.asarray(list(vectors), dtype=np.float32)
+        if len(ids) == 0:
+            return
+        with self._lock:
+            self._load()
+            for row_id in ids:
+                row = self._row_of.get(row_id)
+                if row is not None:
+                    self.ids[row] = self.file_ids[row] = None
+            name = self._write_segment(vectors)
+            segment = np.load(self._path(name), mmap_mode="r")
+            self.ids = self.ids + list(ids)
+            self.file_ids = self.file_ids + list(file_ids)
+            self.segment_names = self.segment_names + [name]
+            self.segments = self.segments + [segment]
+            self._reindex()
+            # Chỉ mã hoá vector mới, nối vào index đang có
+            codes, scales = self._encode([segment])
+            if self.codes is None:
+                self.codes, self.scales = codes, scales
+            else:
+                self.codes = np.concatenate([self.codes, codes])
+                self.scales = np.concatenate([self.scales, scales]) if scales is not None else None
+            self._commit()
+            self._maybe_compact()
+
+    def remove(self, ids: Optional[Iterable[str]] = None, file_id: Optional[str] = None):
+        with self._lock:
+            self._load()
+            drop = set(ids or [])
+            removed = 0
+            for i, existing in enumerate(self.ids):
+                if existing is not None and (existing in drop or (file_id is not None and self.file_ids[i] == file_id)):
+                    self.ids[i] = self.file_ids[i] = None
+                    removed += 1
+            if not removed:
+                return
+            self._reindex()
+            self._commit()
+            self._maybe_compact()
+
+    def _compact_scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        # rows=None: quét toàn bộ index, tránh copy
+        codes = self.codes if rows is None else self.codes[rows]
+        compact_query = truncate_vectors(query, self.dims)
+        if self.quantization == "binary":
+            query_bits = quantize_binary(compact_query[None, :])[0]
+            distances = _POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1)
+            return -distances.astype(np.float32)
+        if self.quantization == "int8":
+            scales = self.scales if rows is None else self.scales[rows]
+            return (codes.astype(np.float32) @ compact_query) * scales
+        return codes @ compact_query
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int,
+        candidates: int = RESCORE_CANDIDATES,
+        file_ids: Optional[List[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        """Scan the compact index, then rescore the best candidates with full vectors"""
+        with self._lock:
+            self._load()
+            if self.codes is None or not self._row_of:
+                return []
+            query = np.asarray(query, dtype=np.float32)
+            rows = None
+            if file_ids:
+                wanted = set(file_ids)
+                rows = np.array([i for i, file_id in enumerate(self.file_ids) if file_id in wanted], dtype=np.int64)
+                if len(rows) == 0:
+                    return []
+            elif len(self._row_of) < len(self.ids):
+                # Bỏ các row đã bị xoá/ghi đè
+                rows = np.fromiter(self._row_of.values(), dtype=np.int64)
+
+            scores = self._compact_scores(query, rows)
+            n_candidates = min(len(scores), max(k, candidates))
+            top = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            candidate_rows = np.sort(top if rows is None else rows[top])
+
+            full_query = query / max(float(np.linalg.norm(query)), 1e-12)
+            full_scores = self._full_rows(candidate_rows) @ full_query
+            order = np.argsort(-full_scores)[:k]
+            return [(self.ids[candidate_rows[i]], float(full_scores[i])) for i in order]
+
+    def memory_bytes(self) -> Dict[str, int]:
+        with self._lock:
+            self._load()
+            index_bytes = 0 if self.codes is None else self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+            full_bytes = sum(int(np.prod(segment.shape)) * 4 for segment in self.segments)
+            return {"index_bytes": index_bytes, "full_vectors_on_disk": full_bytes}
+
+
+_sidecars: LRUCache = LRUCache(maxsize=VECTOR_SIDECAR_CACHE_SIZE)
+_sidecars_lock = threading.Lock()
+
+
+def get_sidecar(directory: str) -> VectorSidecar:
+    """Process-wide sidecar for a directory, rebuilt only when its ids.json changes"""
+    # Mỗi request tạo MultiFileRAGSystem mới: không đọc lại ids.json và dựng lại index mỗi lần
+    key = os.path.normpath(directory)
+    with _sidecars_lock:
+        sidecar = _sidecars.get(key)
+        if sidecar is None:
+            sidecar = VectorSidecar(directory)
+            _sidecars[key] = sidecar
+        return sidecar
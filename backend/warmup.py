@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+import logging
+from typing import Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Nạp trước các thư viện nặng trong nền sau khi worker khởi động (mặc định tắt: nạp khi dùng lần đầu).
+# "true" = các bước mặc định, hoặc liệt kê, ví dụ "llm,vector_store,pdf,ocr"
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower()
+DEFAULT_WARMUP_STEPS = ("jwks", "llm", "vector_store", "pdf")
+
+
+def _warm_jwks():
+    from auth import jwks_cache
+    jwks_cache.warm()
+
+
+def _warm_llm():
+    from llm_client import load_genai
+    load_genai()
+
+
+def _warm_vector_store():
+    import chromadb
+    from langchain_community.vectorstores import Chroma
+
+
+def _warm_pdf():
+    import fitz
+    from PIL import Image
+    from langchain_text_splitters import TokenTextSplitter
+    # Khởi tạo splitter để nạp (và cache) bảng mã tiktoken
+    TokenTextSplitter(chunk_size=100, chunk_overlap=0)
+
+
+def _warm_ocr():
+    # torch + easyocr: vài trăm MB RSS; worker OCR fork từ process này sẽ dùng lại
+    import easyocr
+
+
+WARMUP_STEPS: Dict[str, Callable[[], None]] = {
+    "jwks": _warm_jwks,
+    "llm": _warm_llm,
+    "vector_store": _warm_vector_store,
+    "pdf": _warm_pdf,
+    "ocr": _warm_ocr,
+}
+
+
+def configured_steps(setting: str = WARMUP_ON_STARTUP) -> Sequence[str]:
+    if setting in ("", "0", "false", "no"):
+        return ()
+    if setting in ("1", "true", "yes"):
+        return DEFAULT_WARMUP_STEPS
+    return [step.strip() for step in setting.split(",") if step.strip() in WARMUP_STEPS]
+
+
+def run_warmup(steps: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    """Run warm-up steps in order; returns the seconds each one took"""
+    timings = {}
+    for step in configured_steps() if steps is None else steps:
+        started = time.perf_counter()
+        try:
+            WARMUP_STEPS[step]()
+        except Exception as e:
+            logger.warning(f"⚠️ Warm-up step {step} failed: {e}")
+            continue
+        timings[step] = round(time.perf_counter() - started, 3)
+    if timings:
+        logger.info(f"✅ Warm-up done: {', '.join(f'{step} {seconds}s' for step, seconds in timings.items())}")
+    return timings
+
+
+def start_warmup():
+    """Warm up in a background thread so the worker starts serving immediately"""
+    if configured_steps():
+        threading.Thread(target=run_warmup, name="warmup", daemon=True).start()
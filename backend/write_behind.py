@@ -0,0 +1,463 @@
+import os
+import json
+import glob
+import time
+import uuid
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from filelock import FileLock, Timeout
+from postgrest.exceptions import APIError
+
+from http_clients import get_supabase
+from tracing import span, count
+
+logger = logging.getLogger(__name__)
+
+# Flush khi đủ số thao tác đang chờ, hoặc khi thao tác cũ nhất đã chờ quá lâu
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "100"))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "500"))
+WRITE_BEHIND_INSERT_BATCH = int(os.getenv("WRITE_BEHIND_INSERT_BATCH", "500"))
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "./chroma_store/write_behind")
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "true").lower() == "true"
+# Row bị Supabase từ chối (lỗi dữ liệu, không phải lỗi mạng) quá số lần này thì chuyển vào dead-letter
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+FlushHook = Callable[[str, List[Dict[str, Any]]], None]
+
+
+def _match_key(match: Dict[str, Any]) -> Tuple:
+    return tuple(sorted(match.items()))
+
+
+def _journal_inserts(path: str) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """Inserts still pending in a journal file, with later updates folded in"""
+    inserts: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return inserts
+    for line in lines:
+        try:
+            op = json.loads(line)
+        except json.JSONDecodeError:
+            # Dòng đang được ghi dở
+            continue
+        if op["op"] == "insert":
+            if op.get("id"):
+                inserts[op["id"]] = (op["table"], dict(op["row"]))
+            continue
+        for table, row in inserts.values():
+            if table == op["table"] and all(row.get(field) == value for field, value in op["match"].items()):
+                row.update(op["values"])
+    return inserts
+
+
+class WriteBehindQueue:
+    """Buffers Supabase inserts/updates and writes them from a background thread.
+
+    Inserts are grouped per table (and column set) and sent as bulk inserts. Updates
+    are keyed by (table, match filter): later values are merged into earlier ones, and
+    an update that targets a row still waiting to be inserted is folded into that row.
+    Every operation is appended to a journal owned by this process start (pid + start
+    time + random suffix, so a restarted container reusing PID 1 gets a new one) before
+    it is acknowledged; the journal is rewritten after each flush. The owner holds a lock
+    file for its lifetime. On start, journals whose lock is free are claimed by an atomic
+    rename (so only one worker replays each) and replayed.
+
+    Each insert gets a row id when it is enqueued; the id is journaled with the row (it
+    is not sent to Supabase) and keys the retry count. pending_inserts() also reads the
+    journals of the other workers, so a read served by any worker sees rows that another
+    worker has acknowledged but not yet flushed.
+
+    A failed bulk insert is retried row by row. Network errors requeue the rows; a row
+    that Supabase itself rejects (e.g. a foreign key to a deleted chat) is retried up to
+    WRITE_BEHIND_MAX_ATTEMPTS flushes and then appended to dead_letter.jsonl, so it
+    cannot hold back the rest of the queue.
+    """
+
+    def __init__(
+        self,
+        directory: str = WRITE_BEHIND_DIR,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        flush_interval_ms: float = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+        insert_batch: int = WRITE_BEHIND_INSERT_BATCH,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+        max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+    ):
+        self.directory = directory
+        self.max_pending = max(1, max_pending)
+        self.flush_interval = flush_interval_ms / 1000
+        self.insert_batch = max(1, insert_batch)
+        self.fsync = fsync
+        self.max_attempts = max(1, max_attempts)
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        # table -> danh sách (row id, row) chờ insert
+        self._inserts: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        # (table, match) -> (match, values đã gộp)
+        self._updates: Dict[Tuple[str, Tuple], Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self._pending = 0
+        self._oldest: Optional[float] = None
+        self._journal = None
+        self._journal_path = None
+        self._token = f"{os.getpid()}-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self._owner_lock: Optional[FileLock] = None
+        # row id / key của update -> số lần Supabase đã từ chối
+        self._attempts: Dict[Any, int] = {}
+        # journal của worker khác -> ((mtime, size), các row insert đang chờ)
+        self._peer_journals: Dict[str, Tuple[Tuple[int, int], Dict[str, Tuple[str, Dict[str, Any]]]]] = {}
+        self._peer_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._hooks: List[FlushHook] = []
+        self._failures = 0
+
+        self.ops_enqueued = 0
+        self.ops_merged = 0
+        self.requests_sent = 0
+        self.flushes = 0
+        self.dead_lettered = 0
+
+    # ---------- public API ----------
+
+    def insert(self, table: str, row: Dict[str, Any]):
+        """Queue a row insert"""
+        self._enqueue({"op": "insert", "table": table, "row": row, "id": uuid.uuid4().hex})
+
+    def update(self, table: str, match: Dict[str, Any], values: Dict[str, Any]):
+        """Queue `UPDATE table SET values WHERE match` (equality filters only)"""
+        self._enqueue({"op": "update", "table": table, "match": match, "values": values})
+
+    def on_flush(self, hook: FlushHook):
+        """Call hook(table, rows) after rows of `table` were written to Supabase"""
+        self._hooks.append(hook)
+
+    def pending_inserts(self, table: str, **filters) -> List[Dict[str, Any]]:
+        """Rows not yet written (by any worker), so reads can include the caller's own recent writes"""
+        with self._cond:
+            pending = {row_id: dict(row) for row_id, row in self._inserts.get(table, [])}
+        # Request trước có thể đã được worker khác nhận: đọc cả journal của các worker đó
+        for row_id, row in self._peer_inserts(table).items():
+            pending.setdefault(row_id, row)
+        return [
+            row for row in pending.values()
+            if all(row.get(field) == value for field, value in filters.items())
+        ]
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            # Giữ lock suốt đời process: process khác thấy lock còn bị giữ thì không replay journal này
+            self._owner_lock = FileLock(self._lock_path(self._token))
+            self._owner_lock.acquire()
+            self._journal_path = os.path.join(self.directory, f"journal.{self._token}.jsonl")
+            self._journal = open(self._journal_path, "a", encoding="utf-8")
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        self._recover()
+        atexit.register(self.flush)
+
+    def flush(self) -> bool:
+        """Write everything pending now; returns False if some writes are left for a later flush"""
+        with self._flush_lock:
+            with self._cond:
+                inserts, updates = self._inserts, self._updates
+                self._inserts, self._updates = {}, {}
+                self._pending, self._oldest = 0, None
+            if not inserts and not updates:
+                return True
+
+            rows = sum(len(table_rows) for table_rows in inserts.values()) + len(updates)
+            with span("supabase.flush", rows=rows, tables=len(set(inserts) | {key[0] for key in updates})):
+                failed_inserts, failed_updates = self._write(inserts, updates)
+            with self._cond:
+                # Giữ lại phần lỗi (trước các thao tác mới đến trong lúc flush)
+                for table, rows in failed_inserts.items():
+                    self._inserts[table] = rows + self._inserts.get(table, [])
+                for key, (match, values) in failed_updates.items():
+                    if key in self._updates:
+                        values = {**values, **self._updates[key][1]}
+                    self._updates[key] = (match, values)
+                self._pending = sum(len(rows) for rows in self._inserts.values()) + len(self._updates)
+                if self._pending:
+                    self._oldest = self._oldest or time.monotonic()
+                self._rewrite_journal()
+            self.flushes += 1
+            ok = not failed_inserts and not failed_updates
+            self._failures = 0 if ok else self._failures + 1
+            return ok
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending": self._pending,
+                "ops_enqueued": self.ops_enqueued,
+                "ops_merged": self.ops_merged,
+                "requests_sent": self.requests_sent,
+                "flushes": self.flushes,
+                "dead_lettered": self.dead_lettered,
+            }
+
+    # ---------- internals ----------
+
+    def _enqueue(self, op: Dict[str, Any], journal: bool = True):
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if journal:
+                self._journal.write(json.dumps(op, ensure_ascii=False, default=str) + "\n")
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            self._apply(op)
+            self.ops_enqueued += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify()
+
+    def _apply(self, op: Dict[str, Any]):
+        table = op["table"]
+        if op["op"] == "insert":
+            # Journal cũ (trước khi có row id) không có "id"
+            self._inserts.setdefault(table, []).append((op.get("id") or uuid.uuid4().hex, dict(op["row"])))
+            self._pending += 1
+            return
+
+        match, values = op["match"], op["values"]
+        # Row vẫn đang chờ insert: gộp luôn vào row đó
+        for _, row in self._inserts.get(table, []):
+            if all(row.get(field) == value for field, value in match.items()):
+                row.update(values)
+                self.ops_merged += 1
+                return
+
+        key = (table, _match_key(match))
+        if key in self._updates:
+            self._updates[key][1].update(values)
+            self.ops_merged += 1
+        else:
+            self._updates[key] = (dict(match), dict(values))
+            self._pending += 1
+
+    def _write(self, inserts, updates):
+        supabase = get_supabase()
+        failed_inserts: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        failed_updates = {}
+
+        for table, entries in inserts.items():
+            # PostgREST bulk insert yêu cầu các row có cùng tập cột
+            groups: Dict[Tuple, List[Tuple[str, Dict[str, Any]]]] = {}
+            for entry in entries:
+                groups.setdefault(tuple(sorted(entry[1].keys())), []).append(entry)
+            for group in groups.values():
+                for i in range(0, len(group), self.insert_batch):
+                    batch = group[i:i + self.insert_batch]
+                    try:
+                        self._insert(supabase, table, batch)
+                    except Exception as e:
+                        count("supabase.write_errors", table=table, op="insert")
+                        logger.error(f"❌ Write-behind insert into {table} failed ({len(batch)} rows): {e}")
+                        if not isinstance(e, APIError):
+                            # Lỗi mạng/Supabase không phản hồi: giữ nguyên cả batch, thử lại sau
+                            failed_inserts.setdefault(table, []).extend(batch)
+                            continue
+                        # Supabase từ chối batch: thử từng row để row lỗi không chặn các row hợp lệ
+                        retry = self._insert_rows(supabase, table, batch)
+                        if retry:
+                            failed_inserts.setdefault(table, []).extend(retry)
+
+        for key, (match, values) in updates.items():
+            table = key[0]
+            try:
+                query = supabase.table(table).update(values)
+                for field, value in match.items():
+                    query = query.eq(field, value)
+                query.execute()
+                self.requests_sent += 1
+                self._attempts.pop(key, None)
+                count("supabase.rows_written", table=table, op="update")
+                self._run_hooks(table, [{**match, **values}])
+            except Exception as e:
+                count("supabase.write_errors", table=table, op="update")
+                logger.error(f"❌ Write-behind update of {table} {match} failed: {e}")
+                if isinstance(e, APIError) and self._rejected(key):
+                    self._dead_letter({"op": "update", "table": table, "match": match, "values": values}, e)
+                    continue
+                failed_updates[key] = (match, values)
+
+        return failed_inserts, failed_updates
+
+    def _insert(self, supabase, table: str, entries: List[Tuple[str, Dict[str, Any]]]):
+        rows = [row for _, row in entries]
+        supabase.table(table).insert(rows).execute()
+        self.requests_sent += 1
+        for row_id, _ in entries:
+            self._attempts.pop(row_id, None)
+        count("supabase.rows_written", len(rows), table=table, op="insert")
+        self._run_hooks(table, rows)
+
+    def _insert_rows(self, supabase, table: str, batch: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Insert rows one at a time; returns the rows to retry on a later flush"""
+        retry = []
+        for index, entry in enumerate(batch):
+            row_id, row = entry
+            try:
+                self._insert(supabase, table, [entry])
+            except APIError as e:
+                if self._rejected(row_id):
+                    self._dead_letter({"op": "insert", "table": table, "row": row, "id": row_id}, e)
+                else:
+                    retry.append(entry)
+            except Exception as e:
+                logger.error(f"❌ Write-behind insert into {table} failed: {e}")
+                # Mất kết nối giữa chừng: các row còn lại để lần flush sau
+                retry.extend(batch[index:])
+                break
+        return retry
+
+    def _rejected(self, key: Any) -> bool:
+        """Count a rejection; True once the operation has used up its attempts"""
+        self._attempts[key] = self._attempts.get(key, 0) + 1
+        if self._attempts[key] < self.max_attempts:
+            return False
+        del self._attempts[key]
+        return True
+
+    def _dead_letter(self, op: Dict[str, Any], error: Exception):
+        record = {**op, "error": str(error), "attempts": self.max_attempts, "failed_at": time.time()}
+        with open(os.path.join(self.directory, "dead_letter.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.dead_lettered += 1
+        count("supabase.dead_lettered", table=op["table"], op=op["op"])
+        logger.error(f"❌ Write-behind gave up on {op['op']} into {op['table']} after {self.max_attempts} attempts: {error}")
+
+    def _run_hooks(self, table: str, rows: List[Dict[str, Any]]):
+        for hook in self._hooks:
+            try:
+                hook(table, rows)
+            except Exception as e:
+                logger.warning(f"⚠️ Write-behind flush hook failed: {e}")
+
+    def _rewrite_journal(self):
+        # Journal chỉ còn các thao tác chưa ghi được
+        tmp_path = f"{self._journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for table, entries in self._inserts.items():
+                for row_id, row in entries:
+                    f.write(json.dumps({"op": "insert", "table": table, "row": row, "id": row_id}, ensure_ascii=False, default=str) + "\n")
+            for (table, _), (match, values) in self._updates.items():
+                f.write(json.dumps({"op": "update", "table": table, "match": match, "values": values}, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+    def _peer_inserts(self, table: str) -> Dict[str, Dict[str, Any]]:
+        """Pending inserts into `table` journaled by other workers (row id -> row)"""
+        rows: Dict[str, Dict[str, Any]] = {}
+        with self._peer_lock:
+            paths = glob.glob(os.path.join(self.directory, "journal.*.jsonl"))
+            paths += glob.glob(os.path.join(self.directory, "claimed.*.jsonl"))
+            seen = set()
+            for path in paths:
+                if path == self._journal_path:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                seen.add(path)
+                version = (stat.st_mtime_ns, stat.st_size)
+                cached = self._peer_journals.get(path)
+                if cached is None or cached[0] != version:
+                    cached = self._peer_journals[path] = (version, _journal_inserts(path))
+                for row_id, (row_table, row) in cached[1].items():
+                    if row_table == table:
+                        rows[row_id] = dict(row)
+            # Journal đã flush xong/đã bị nhận thì không giữ trong cache nữa
+            for path in set(self._peer_journals) - seen:
+                self._peer_journals.pop(path, None)
+        return rows
+
+    def _lock_path(self, token: str) -> str:
+        return os.path.join(self.directory, f"journal.{token}.lock")
+
+    def _owner_dead(self, token: str) -> bool:
+        if token == self._token:
+            return False
+        lock = FileLock(self._lock_path(token))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            return False
+        lock.release()
+        return True
+
+    def _recover(self):
+        """Replay journals of processes that exited before flushing"""
+        paths = glob.glob(os.path.join(self.directory, "journal.*.jsonl"))
+        # Journal đã được một worker khác nhận nhưng worker đó chết giữa chừng
+        paths += glob.glob(os.path.join(self.directory, "claimed.*.jsonl"))
+        for path in paths:
+            if path == self._journal_path:
+                continue
+            parts = os.path.basename(path).split(".")
+            owner = parts[1]
+            if not self._owner_dead(owner):
+                continue
+            # Đổi tên là thao tác nguyên tử: chỉ một worker nhận được journal này
+            source = ".".join(parts[1:-1]) if parts[0] == "journal" else ".".join(parts[2:-1])
+            claimed = os.path.join(self.directory, f"claimed.{self._token}.{source}.jsonl")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                os.remove(self._lock_path(owner))
+            except FileNotFoundError:
+                pass
+
+            recovered = 0
+            with open(claimed, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        # Ghi lại vào journal của process này trước khi xoá bản đã nhận
+                        self._enqueue(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Dòng cuối bị ghi dở khi process chết
+                        continue
+                    recovered += 1
+            os.remove(claimed)
+            if recovered:
+                logger.info(f"📂 Recovered {recovered} pending Supabase writes from {path}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending >= self.max_pending and not self._failures:
+                        break
+                    if self._oldest is not None:
+                        # Lỗi liên tiếp thì giãn thời gian thử lại
+                        delay = min(self.flush_interval * (2 ** self._failures), 30)
+                        remaining = self._oldest + delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(timeout=remaining)
+                    else:
+                        self._cond.wait()
+            self.flush()
+
+
+write_behind = WriteBehindQueue()